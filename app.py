@@ -5,30 +5,48 @@
 import email
 
 import logging
-from typing import Union
+from dataclasses import dataclass
 from urllib.request import urlopen
 import json
 from os import environ as env
 from functools import wraps
-import http.client
 
 from chalice import Chalice, Response
-import boto3
-from jose import jwt
-from fastapi import HTTPException
-
-from pydantic import BaseModel
 
 from chalicelib.settings import settings
-from chalicelib.utility_password import get_password_hash
-from chalicelib.utility_jwt import login_for_access_token, \
-    get_current_active_user_chalice
+from chalicelib.utility_lazy_import import LazyModule, lazy_function
 from chalicelib.utility_date import get_formatted_date
 from chalicelib.utility_general import log_endpoint_debug, \
     log_debug, log_normal
-from chalicelib.api_openai import openai_api_with_defaults
+from chalicelib.api_openai import (
+    openai_api_with_defaults, openai_api_stream_with_defaults,
+    is_stream_request, openai_api_batch)
+from chalicelib.utility_ai_cache import ai_response_cache
+from chalicelib.utility_ai_usage import (
+    ai_usage, get_usage_user, AiUsageForbidden)
 from chalicelib.api_currency_exchange import (
-    crypto, usdcop, usdveb, veb_cop, usdveb_full, usdveb_monitor)
+    crypto, usdcop, usdveb, veb_cop, usdveb_full, usdveb_monitor,
+    crypto_batch, convert)
+from chalicelib.utility_cache import get_cache_stats
+from chalicelib.utility_auth0 import auth0_connection, management_tokens
+from chalicelib.utility_jwks import JwksCache
+from chalicelib.utility_rates_history import (
+    get_rates_history, get_rates_history_pairs)
+
+
+# Heavy dependencies are only imported when an endpoint needs them, so the
+# rates endpoints cold starts don't pay for boto3, python-jose, fastapi,
+# pydantic, pymongo and werkzeug. Run "make import_time" to check the
+# import times.
+boto3 = LazyModule('boto3')
+jwt = LazyModule('jose.jwt')
+# chalicelib.utility_jwt imports fastapi, pydantic and utility_db (pymongo)
+login_for_access_token = lazy_function(
+    'chalicelib.utility_jwt', 'login_for_access_token')
+get_current_active_user_chalice = lazy_function(
+    'chalicelib.utility_jwt', 'get_current_active_user_chalice')
+get_password_hash = lazy_function(
+    'chalicelib.utility_password', 'get_password_hash')
 
 
 logging.basicConfig(
@@ -129,6 +147,19 @@ def get_form_data():
     return form_data
 
 
+def get_request_username():
+    """
+    Returns the user authenticated by requires_auth: the JWT username or
+    the Auth0 token 'sub'.
+    """
+    context = app.current_request.context or {}
+    if context.get('user'):
+        return context['user'].get('username')
+    if context.get('current_user'):
+        return context['current_user'].get('sub')
+    return None
+
+
 def get_query_params():
     query_params = app.current_request.to_dict()['query_params']
     if query_params is None:
@@ -200,6 +231,38 @@ def get_token_auth_header():
     return token
 
 
+def fetch_jwks():
+    """Fetches the Auth0 JWKS
+    """
+    url = "https://"+env.get("AUTH0_DOMAIN")+"/.well-known/jwks.json"
+    log_debug(f'fetch_jwks | url: {url}')
+    try:
+        jsonurl = urlopen(url)
+        log_debug(f'fetch_jwks | jsonurl: {jsonurl}')
+    except Exception as e:
+        raise AuthError({"code": "invalid_claims",
+                         "description": "Unable to fetch JWKS"
+                         " (" + str(e) + ")"}, 401)
+    try:
+        jwks = json.loads(jsonurl.read())
+        log_debug(f'fetch_jwks | jwks: {jwks}')
+    except Exception as e:
+        raise AuthError({"code": "invalid_claims",
+                         "description": "Unable to parse JWKS"
+                         " (" + str(e) + ")"}, 401)
+    return jwks
+
+
+jwks_cache = JwksCache(fetch_jwks, algorithm=env.get("AUTH0_ALGORITHMS"))
+
+
+def get_jwks(refresh=False):
+    """Returns the Auth0 JWKS, cached for AUTH0_JWKS_TTL seconds (the
+    lambda warmup events fetch it ahead with 'refresh').
+    """
+    return jwks_cache.get_jwks(refresh=refresh)
+
+
 def requires_auth(f):
     """Wrapper to determine if the Access Token is valid
     """
@@ -212,6 +275,7 @@ def requires_auth(f):
         return f(*args, **kwargs)
 
     def jwt_decorated(*args, **kwargs):
+        from fastapi import HTTPException
         try:
             token = get_token_auth_header()
             log_debug(f'>> requires_auth.jwt_decorated | token: {token}')
@@ -245,34 +309,9 @@ def requires_auth(f):
                 error_msg_formatter(e, 'JWT_AUTH_ERROR'),
                 {'Content-Type': 'application/json'}
             )
-        url = "https://"+env.get("AUTH0_DOMAIN")+"/.well-known/jwks.json"
-        log_debug(f'auth_decorated | url: {url}')
-        try:
-            jsonurl = urlopen(url)
-            log_debug(f'auth_decorated | jsonurl: {jsonurl}')
-        except Exception as e:
-            raise AuthError({"code": "invalid_claims",
-                             "description": "Unable to fetch JWKS"
-                             " (" + str(e) + ")"}, 401)
-        try:
-            jwks = json.loads(jsonurl.read())
-            log_debug(f'auth_decorated | jwks: {jwks}')
-        except Exception as e:
-            raise AuthError({"code": "invalid_claims",
-                             "description": "Unable to parse JWKS"
-                             " (" + str(e) + ")"}, 401)
         unverified_header = jwt.get_unverified_header(token)
         log_debug(f'auth_decorated | unverified_header: {unverified_header}')
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header.get("kid"):
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]
-                }
+        rsa_key = jwks_cache.get_key(unverified_header.get("kid"))
         if rsa_key:
             log_debug(f'auth_decorated | rsa_key: {rsa_key}')
             try:
@@ -309,14 +348,29 @@ def auth0_api_call(endpoint_suffix, body_data, additional_headers={}):
     """Auth0 API/MAPI call
     """
     body = json.dumps(body_data)
-    conn = http.client.HTTPSConnection(env.get("AUTH0_DOMAIN"))
     headers = {'content-type': "application/json"} | additional_headers
+    # Keep-alive connection to AUTH0_DOMAIN, reused across the calls
+    _, data = auth0_connection.request(
+        env.get("AUTH0_DOMAIN"), "POST", endpoint_suffix, body, headers
+    )
+    return (data.decode("utf-8"))
 
-    conn.request("POST", endpoint_suffix, body, headers)
 
-    res = conn.getresponse()
-    data = res.read()
-    return (data.decode("utf-8"))
+def get_management_token():
+    """Auth0 client_credentials token for the Management API, cached until
+    it's about to expire. Returns the token response dict, or the Auth0
+    error response str.
+    """
+    body_data = {
+        "client_id": env.get("AUTH0_MAPI_CLIENT_ID"),
+        "client_secret": env.get("AUTH0_MAPI_CLIENT_SECRET"),
+        "audience": "https://" + env.get("AUTH0_DOMAIN") + "/api/v2/",
+        "grant_type": "client_credentials"
+    }
+    return management_tokens.get(
+        (body_data["client_id"], body_data["audience"]),
+        lambda: auth0_api_call("/oauth/token", body_data)
+    )
 
 
 # ---------- DynamoDB generals ----------
@@ -338,13 +392,7 @@ def get_app_db(table_name):
 def login():
     """Login
     """
-    body_data = {
-        "client_id": env.get("AUTH0_MAPI_CLIENT_ID"),
-        "client_secret": env.get("AUTH0_MAPI_CLIENT_SECRET"),
-        "audience": "https://" + env.get("AUTH0_DOMAIN") + "/api/v2/",
-        "grant_type": "client_credentials"
-    }
-    return auth0_api_call("/oauth/token", body_data)
+    return get_management_token()
 
 
 @app.route('/auth0_client_grant', methods=['GET'])
@@ -356,8 +404,14 @@ def auth0_client_grant():
         "audience": "https://" + env.get("AUTH0_DOMAIN") + "/api/v2/",
         "scope": ["create:client_grants"],
     }
+    mapi_token = env.get("AUTH0_MAPI_API_TOKEN")
+    if not mapi_token:
+        token_response = get_management_token()
+        if not isinstance(token_response, dict):
+            return token_response
+        mapi_token = token_response["access_token"]
     additional_headers = {
-        "Authorization": "Bearer " + env.get("AUTH0_MAPI_API_TOKEN")
+        "Authorization": "Bearer " + mapi_token
     }
     return auth0_api_call(
         "/api/v2/client-grants", body_data, additional_headers
@@ -367,7 +421,8 @@ def auth0_client_grant():
 # JWT Authentication EndPoints
 
 
-class UserData(BaseModel):
+@dataclass
+class UserData:
     username: str
     password: str
 
@@ -375,6 +430,7 @@ class UserData(BaseModel):
 @app.route("/token", methods=['POST'],
            content_types=['multipart/form-data'])
 def login_for_access_token_endpoint():
+    from fastapi import HTTPException
     log_endpoint_debug('/token')
     log_debug('login_for_access_token_endpoint | Before get form_data!')
     form_data = get_multipart_form_data()
@@ -406,13 +462,22 @@ def login_for_access_token_endpoint():
 
 @app.route("/pget", methods=['GET'])
 def pget():
+    from chalicelib.utility_password import PasswordServiceBusy
     log_endpoint_debug('/pget')
     query_params = get_query_params()
     log_debug(f'pget | query_params: {query_params}')
     password = query_params['p']
+    try:
+        password_hashed = get_password_hash(password)
+    except PasswordServiceBusy:
+        return http_response(
+            503,
+            'Too many password requests, please retry later',
+            {'Content-Type': 'application/json', 'Retry-After': '1'}
+        )
     return dict(
         {
-            'password_hashed': get_password_hash(password)
+            'password_hashed': password_hashed
         }
     )
 
@@ -420,15 +485,6 @@ def pget():
 # This API specific EndPoints
 
 
-class Body(BaseModel):
-    q: Union[str, None] = None
-    debug: Union[int, None] = None
-    p: Union[str, None] = None
-    m: Union[str, None] = None
-    t: Union[str, None] = None
-    mt: Union[str, None] = None
-
-
 @app.route("/query_params", methods=['GET'])
 def api_query_params():
     log_endpoint_debug('/query_params')
@@ -437,6 +493,31 @@ def api_query_params():
     return api_response
 
 
+@app.route("/rates_cache_stats", methods=['GET'])
+def api_rates_cache_stats():
+    log_endpoint_debug('/rates_cache_stats')
+    return get_cache_stats()
+
+
+@app.route("/ai_cache_stats", methods=['GET'])
+def api_ai_cache_stats():
+    log_endpoint_debug('/ai_cache_stats')
+    return ai_response_cache.stats()
+
+
+@app.route("/ai_usage", methods=['GET'])
+@requires_auth
+def api_ai_usage():
+    log_endpoint_debug('/ai_usage')
+    query_params = get_query_params()
+    try:
+        user = get_usage_user(
+            get_request_username(), query_params.get('user'))
+    except AiUsageForbidden as err:
+        return http_response(403, str(err), None)
+    return ai_usage.get_totals(user, query_params.get('model'))
+
+
 # @app.route("/get_cnf", methods=['GET'])
 # def api_get_cnf():
 #     log_endpoint_debug('/get_cnf')
@@ -457,13 +538,33 @@ def api_query_params():
 #     return api_response
 
 
+def get_sse_response(events):
+    """
+    The Python Lambda runtime has no response streaming (API Gateway
+    buffers the whole response anyway), so the server-sent events are
+    collected and sent in one body, in the same format as the FastAPI
+    streamed response.
+    """
+    return Response(
+        body=''.join(events),
+        headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+        },
+    )
+
+
 @app.route("/ai", methods=['POST'])
 @requires_auth
 def ai_post():
     log_endpoint_debug('/ai POST')
     form_data = get_form_data()
     log_debug(f'ai_post: body = {str(form_data)}')
-    api_response = openai_api_with_defaults(form_data)
+    if is_stream_request(form_data):
+        return get_sse_response(openai_api_stream_with_defaults(
+            form_data, get_request_username()))
+    api_response = openai_api_with_defaults(
+        form_data, get_request_username())
     log_debug(f'ai_post: api_response = {api_response}')
     return api_response
 
@@ -474,11 +575,25 @@ def ai_get():
     log_endpoint_debug('/ai GET')
     query_params = get_query_params()
     log_debug(f'ai_get: request = {query_params}')
-    api_response = openai_api_with_defaults(query_params)
+    if is_stream_request(query_params):
+        return get_sse_response(
+            openai_api_stream_with_defaults(
+                query_params, get_request_username()))
+    api_response = openai_api_with_defaults(
+        query_params, get_request_username())
     log_debug(f'ai_get: api_response = {api_response}')
     return api_response
 
 
+@app.route("/ai/batch", methods=['POST'])
+@requires_auth
+def ai_batch_post():
+    log_endpoint_debug('/ai/batch POST')
+    form_data = get_form_data()
+    log_debug(f'ai_batch_post: items = {len(form_data.get("items") or [])}')
+    return openai_api_batch(form_data, get_request_username())
+
+
 @app.route("/codex", methods=['GET'])
 @requires_auth
 def codex_get():
@@ -486,7 +601,8 @@ def codex_get():
     request_params = get_query_params()
     request_params['m'] = 'code-davinci-002'
     log_debug(f'codex_get: request = {request_params}')
-    api_response = openai_api_with_defaults(request_params)
+    api_response = openai_api_with_defaults(
+        request_params, get_request_username())
     log_debug(f'codex_get: api_response = {api_response}')
     return api_response
 
@@ -603,3 +719,42 @@ def endpoint_crypto(symbol: str, debug: int):
 def endpoint_crypto_curr(symbol: str, currency: str, debug: int):
     log_endpoint_debug(f'/crypto_wc/{symbol}/{currency}/{debug}')
     return crypto(symbol, currency, str(debug) == "1")
+
+
+@app.route("/crypto_batch", methods=['GET'])
+def endpoint_crypto_batch():
+    log_endpoint_debug('/crypto_batch')
+    query_params = get_query_params()
+    return crypto_batch(
+        query_params.get('symbols'),
+        query_params.get('currencies'),
+        str(query_params.get('formatted', '0')) == "1"
+    )
+
+
+@app.route("/convert/{from_currency}/{to_currency}", methods=['GET'])
+def endpoint_convert(from_currency: str, to_currency: str):
+    log_endpoint_debug(f'/convert/{from_currency}/{to_currency}')
+    return convert(
+        from_currency,
+        to_currency,
+        get_query_params().get('amount'),
+    )
+
+
+@app.route("/rates_history", methods=['GET'])
+def endpoint_rates_history_pairs():
+    log_endpoint_debug('/rates_history')
+    return get_rates_history_pairs()
+
+
+@app.route("/rates_history/{pair}", methods=['GET'])
+def endpoint_rates_history(pair: str):
+    log_endpoint_debug(f'/rates_history/{pair}')
+    query_params = get_query_params()
+    return get_rates_history(
+        pair,
+        query_params.get('as_of'),
+        query_params.get('start'),
+        query_params.get('end'),
+    )
@@ -1,52 +1,245 @@
 import os
+import asyncio
 import datetime
-import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from chalicelib.utility_general import get_api_standard_response, log_warning
-from chalicelib.utility_telegram import report_error_to_tg_group
+from chalicelib.utility_telegram import (
+    report_error_to_tg_group, report_error_to_tg_group_async)
 from chalicelib.utility_general import log_debug
+from chalicelib.utility_cache import cached_rates
+from chalicelib.utility_singleflight import single_flight
+from chalicelib.utility_circuit_breaker import circuit_breaker
+from chalicelib.utility_http import http_get, async_http_get
+from chalicelib.utility_rates_history import recorded_rates
+from chalicelib.utility_rate_graph import rate_graph
+from chalicelib.settings import settings
 
 
 DEBUG = os.getenv("CODE_DEBUG", "0") == "1"
 log_debug(f"[DEBUG] {DEBUG}")
 
 
+# Concurrent fan-out
+
+
+_fanout_executor = None
+_fanout_executor_lock = threading.Lock()
+
+
+def get_fanout_executor():
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _fanout_executor_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(
+                    max_workers=int(settings.RATES_FANOUT_WORKERS),
+                    thread_name_prefix='rates_fanout',
+                )
+    return _fanout_executor
+
+
+def fetch_concurrently(*fetchers):
+    """
+    Runs the independent fetchers in the fan-out thread pool and returns
+    their results in the same order. Falls back to sequential calls when
+    RATES_FANOUT_ENABLED is not "1".
+    """
+    if settings.RATES_FANOUT_ENABLED != "1":
+        return [fetcher() for fetcher in fetchers]
+    futures = [get_fanout_executor().submit(fetcher) for fetcher in fetchers]
+    return [future.result() for future in futures]
+
+
+async def fetch_concurrently_async(*fetchers):
+    """
+    asyncio version of fetch_concurrently() for the FastAPI app. The
+    fetchers are 'async def' functions (or lambdas returning coroutines)
+    and are gathered in the running event loop.
+    """
+    if settings.RATES_FANOUT_ENABLED != "1":
+        return [await fetcher() for fetcher in fetchers]
+    return list(await asyncio.gather(*[fetcher() for fetcher in fetchers]))
+
+
+# Rates history
+
+
+def get_bcv_rates(result):
+    return {
+        f"{symbol_data['symbol']}-VES": symbol_data['value']
+        for symbol_data in result['data'].values()
+        if isinstance(symbol_data, dict) and 'value' in symbol_data
+    }
+
+
+def get_monitor_rates(result):
+    return {
+        f"USD-VES-MONITOR-{symbol_data['symbol']}": symbol_data['value']
+        for symbol_data in result['data'].values()
+        if isinstance(symbol_data, dict) and 'value' in symbol_data
+    }
+
+
+def get_cop_rates(result):
+    return {
+        'USD-COP': result['data']['official_cop']['data']['valor'],
+        'USD-COP-GOOGLE': result['data']['google_cop']['data']['value'],
+    }
+
+
+def get_crypto_rates(symbol, result):
+    return {
+        f'{symbol}-{currency}': value
+        for currency, value in result.items()
+        if isinstance(value, (int, float))
+    }
+
+
+def get_crypto_api_rates(result, symbol, currency):
+    return get_crypto_rates(symbol.upper(), result)
+
+
+def get_crypto_multi_api_rates(result, symbols, currencies):
+    rates = {}
+    for symbol, symbol_result in result.items():
+        if isinstance(symbol_result, dict):
+            rates.update(get_crypto_rates(symbol, symbol_result))
+    return rates
+
+
 # Exchange APIs
 
 
-def crypto_api(symbol, currency):
+def get_api_error_response(err):
     api_response = get_api_standard_response()
-    currency = currency.upper()
-    symbol = symbol.upper()
+    api_response['error'] = True
+    api_response['error_message'] = str(err)
+    return api_response
+
+
+def is_crypto_upstream_failure(api_response):
+    """
+    cryptocompare answers unknown symbols or currencies with a 200
+    {'Response': 'Error'}: that's not an outage, so it doesn't count
+    for the circuit breaker.
+    """
+    return api_response['error'] and \
+        api_response['data'].get('Response', '') != 'Error'
+
+
+def get_crypto_api_url(symbol, currency):
     # url = 'https://min-api.cryptocompare.com/data/price?' + \
     # 'fsym=ETH&tsyms=BTC,USD,EUR'
-    url = 'https://min-api.cryptocompare.com/data/price?' + \
-        f'fsym={symbol}&tsyms={currency}'
-    try:
-        response = requests.get(url)
-        # Ok response:
-        # {'USD': 0.2741}
-        # Error response:
-        # {'Response': 'Error', 'Message': 'fsym is a required param.',
-        # 'HasWarning': False, 'Type': 2, 'RateLimit': {}, 'Data': {},
-        # 'ParamWithError': 'fsym'}
-    except Exception as err:
+    return 'https://min-api.cryptocompare.com/data/price?' + \
+        f'fsym={symbol.upper()}&tsyms={currency.upper()}'
+
+
+def get_crypto_api_response(response):
+    """
+    Builds the api_response from a min-api.cryptocompare.com
+    requests or httpx response.
+    """
+    # Ok response:
+    # {'USD': 0.2741}
+    # Error response:
+    # {'Response': 'Error', 'Message': 'fsym is a required param.',
+    # 'HasWarning': False, 'Type': 2, 'RateLimit': {}, 'Data': {},
+    # 'ParamWithError': 'fsym'}
+    api_response = get_api_standard_response()
+    if response.status_code != 200:
         api_response['error'] = True
-        api_response['error_message'] = str(err)
+        api_response['error_message'] = 'ERROR reading the ' + \
+            'min-api.cryptocompare.com API'
     else:
-        if response.status_code != 200:
+        api_response['data'] = response.json()
+        if api_response['data'].get('Response', '') == 'Error':
             api_response['error'] = True
-            api_response['error_message'] = 'ERROR reading the ' + \
-                'min-api.cryptocompare.com API'
-        else:
-            api_response['data'] = response.json()
-            if api_response['data'].get('Response', '') == 'Error':
-                api_response['error'] = True
-                api_response['error_message'] = "ERROR: " + \
-                    api_response['data']['Message']
+            api_response['error_message'] = "ERROR: " + \
+                api_response['data']['Message']
+    return api_response
+
+
+@cached_rates('crypto')
+@single_flight('crypto')
+@recorded_rates(get_crypto_api_rates)
+@circuit_breaker('crypto', is_failure=is_crypto_upstream_failure)
+def crypto_api(symbol, currency):
+    try:
+        response = http_get(get_crypto_api_url(symbol, currency))
+    except Exception as err:
+        api_response = get_api_error_response(err)
+    else:
+        api_response = get_crypto_api_response(response)
     report_error_to_tg_group(api_response)
     return api_response
 
 
+@cached_rates('crypto')
+@single_flight('crypto')
+@recorded_rates(get_crypto_api_rates)
+@circuit_breaker('crypto', is_failure=is_crypto_upstream_failure)
+async def crypto_api_async(symbol, currency):
+    try:
+        response = await async_http_get(get_crypto_api_url(symbol, currency))
+    except Exception as err:
+        api_response = get_api_error_response(err)
+    else:
+        api_response = get_crypto_api_response(response)
+    await report_error_to_tg_group_async(api_response)
+    return api_response
+
+
+def get_crypto_multi_api_url(symbols, currencies):
+    # Ok response:
+    # {'BTC': {'USD': 109437.64, 'EUR': 96420.1},
+    #  'ETH': {'USD': 2561.3, 'EUR': 2256.8}}
+    return 'https://min-api.cryptocompare.com/data/pricemulti?' + \
+        f'fsyms={symbols.upper()}&tsyms={currencies.upper()}'
+
+
+@cached_rates('crypto', 'multi')
+@single_flight('crypto', 'multi')
+@recorded_rates(get_crypto_multi_api_rates)
+@circuit_breaker('crypto', 'multi',
+                 is_failure=is_crypto_upstream_failure)
+def crypto_multi_api(symbols, currencies):
+    """
+    Multi-price version of crypto_api(). 'symbols' and 'currencies'
+    are comma separated lists, e.g. "BTC,ETH" and "USD,EUR".
+    """
+    try:
+        response = http_get(get_crypto_multi_api_url(symbols, currencies))
+    except Exception as err:
+        api_response = get_api_error_response(err)
+    else:
+        api_response = get_crypto_api_response(response)
+    report_error_to_tg_group(api_response)
+    return api_response
+
+
+@cached_rates('crypto', 'multi')
+@single_flight('crypto', 'multi')
+@recorded_rates(get_crypto_multi_api_rates)
+@circuit_breaker('crypto', 'multi',
+                 is_failure=is_crypto_upstream_failure)
+async def crypto_multi_api_async(symbols, currencies):
+    try:
+        response = await async_http_get(
+            get_crypto_multi_api_url(symbols, currencies)
+        )
+    except Exception as err:
+        api_response = get_api_error_response(err)
+    else:
+        api_response = get_crypto_api_response(response)
+    await report_error_to_tg_group_async(api_response)
+    return api_response
+
+
+@cached_rates('monitor')
+@single_flight('monitor')
+@recorded_rates(get_monitor_rates)
+@circuit_breaker('monitor')
 def veb_monitor_api():
     # url = 'https://monitor-exchange-rates.vercel.app/get_exchange_rates'
     url = os.getenv("MONITOR_EXCHANGE_URL")
@@ -58,12 +251,34 @@ def veb_monitor_api():
     return api_response
 
 
+@cached_rates('monitor')
+@single_flight('monitor')
+@recorded_rates(get_monitor_rates)
+@circuit_breaker('monitor')
+async def veb_monitor_api_async():
+    url = os.getenv("MONITOR_EXCHANGE_URL")
+    if not url:
+        # The scraper classes are blocking, keep them off the event loop
+        api_response = await asyncio.to_thread(veb_monitor_api_from_class)
+    else:
+        api_response = await get_api_resp_from_url_async(
+            url, "Monitor USD/Bs"
+        )
+    _ = DEBUG and log_debug('veb_monitor_api_async | ' +
+                            f'api_response:\n{api_response}')
+    return api_response
+
+
 def veb_monitor_api_from_class():
     from monitor_exchange_rates.monitor import get_monitor_exchange_rates
     api_response = get_monitor_exchange_rates()
     return get_api_resp_from_class_wrapper(api_response)
 
 
+@cached_rates('bcv')
+@single_flight('bcv')
+@recorded_rates(get_bcv_rates)
+@circuit_breaker('bcv')
 def veb_bcv_api():
     # url = 'https://bcv-exchange-rates.vercel.app/get_exchange_rates'
     url = os.getenv("VEB_EXCHANGE_URL")
@@ -75,6 +290,23 @@ def veb_bcv_api():
     return api_response
 
 
+@cached_rates('bcv')
+@single_flight('bcv')
+@recorded_rates(get_bcv_rates)
+@circuit_breaker('bcv')
+async def veb_bcv_api_async():
+    url = os.getenv("VEB_EXCHANGE_URL")
+    if not url:
+        api_response = await asyncio.to_thread(veb_bcv_api_from_class)
+    else:
+        api_response = await get_api_resp_from_url_async(
+            url, "BCV official USD/Bs"
+        )
+    _ = DEBUG and log_debug('veb_bcv_api_async | ' +
+                            f'api_response:\n{api_response}')
+    return api_response
+
+
 def veb_bcv_api_from_class():
     from bcv_exchange_rates.bcv import get_bcv_exchange_rates
     api_response = get_bcv_exchange_rates()
@@ -89,32 +321,47 @@ def get_api_resp_from_class_wrapper(api_resp):
     return api_response
 
 
-def get_api_resp_from_url(url, name):
+def get_api_resp_from_http_response(response, name):
     api_response = get_api_standard_response()
+    if response.status_code == 200:
+        result = response.json()
+        api_response['data'] = dict(result)
+        api_response['error'] = result['error']
+        api_response['error_message'] = result['error_message']
+    else:
+        api_response['error'] = True
+        api_response['error_message'] = f'ERROR reading {name} API'
+    return api_response
+
+
+def get_api_resp_from_url(url, name):
     try:
-        response = requests.get(url)
+        response = http_get(url)
     except Exception as err:
-        api_response['error'] = True
-        api_response['error_message'] = str(err)
+        api_response = get_api_error_response(err)
     else:
-        if response.status_code == 200:
-            result = response.json()
-            api_response['data'] = dict(result)
-            api_response['error'] = result['error']
-            api_response['error_message'] = result['error_message']
-        else:
-            api_response['error'] = True
-            api_response['error_message'] = f'ERROR reading {name} API'
+        api_response = get_api_resp_from_http_response(response, name)
     report_error_to_tg_group(api_response)
     return api_response
 
 
+async def get_api_resp_from_url_async(url, name):
+    try:
+        response = await async_http_get(url)
+    except Exception as err:
+        api_response = get_api_error_response(err)
+    else:
+        api_response = get_api_resp_from_http_response(response, name)
+    await report_error_to_tg_group_async(api_response)
+    return api_response
+
+
 def veb_dolartoday_api():
     # DEPRECATED
     api_response = get_api_standard_response()
     url = 'https://s3.amazonaws.com/dolartoday/data.json'
     try:
-        response = requests.get(url)
+        response = http_get(url)
     except Exception as err:
         api_response['error'] = True
         api_response['error_message'] = str(err)
@@ -130,6 +377,10 @@ def veb_dolartoday_api():
     return api_response
 
 
+@cached_rates('cop')
+@single_flight('cop')
+@recorded_rates(get_cop_rates)
+@circuit_breaker('cop')
 def cop_api():
     # url = 'https://cop-exchange-rates.vercel.app/get_exchange_rates'
     url = os.getenv("COP_EXCHANGE_URL")
@@ -141,6 +392,22 @@ def cop_api():
     return api_response
 
 
+@cached_rates('cop')
+@single_flight('cop')
+@recorded_rates(get_cop_rates)
+@circuit_breaker('cop')
+async def cop_api_async():
+    url = os.getenv("COP_EXCHANGE_URL")
+    if not url:
+        api_response = await asyncio.to_thread(cop_api_from_class)
+    else:
+        api_response = await get_api_resp_from_url_async(
+            url, "Colombian Peso USD/COP"
+        )
+    _ = DEBUG and log_debug(f"cop_api_async | api_response:\n{api_response}")
+    return api_response
+
+
 def cop_api_from_class():
     from cop_exchange_rates.cop import get_cop_exchange_rates
     api_response = get_cop_exchange_rates()
@@ -150,10 +417,33 @@ def cop_api_from_class():
 # Middleware
 
 
+def get_last_known_good_message(api_response):
+    """
+    Returns the note appended to the messages built from a circuit
+    breaker last-known-good api_response, or '' for fresh responses.
+    """
+    last_known_good = api_response.get('last_known_good')
+    if not last_known_good:
+        return ''
+    return '\nWARNING: provider unavailable, showing the last known ' + \
+        f"value from {int(last_known_good['age'])} seconds ago."
+
+
 def crypto(symbol, currency, debug):
     currency = currency.upper()
     symbol = symbol.upper()
     api_response = crypto_api(symbol, currency)
+    return crypto_message(symbol, currency, debug, api_response)
+
+
+async def crypto_async(symbol, currency, debug):
+    currency = currency.upper()
+    symbol = symbol.upper()
+    api_response = await crypto_api_async(symbol, currency)
+    return crypto_message(symbol, currency, debug, api_response)
+
+
+def crypto_message(symbol, currency, debug, api_response):
     if api_response['error']:
         response_message = api_response['error_message']
         if debug:
@@ -163,15 +453,126 @@ def crypto(symbol, currency, debug):
     if debug:
         response_message = f'The {symbol} exchange rate is: {result}'
     else:
-        exchange_rate = f'{float(result[currency]):.2f}' \
-            if currency in result \
-            else f"ERROR: no {currency} element in API result"
-        response_message = f'The {symbol} to {currency} ' + \
-            f'exchange rate is: {exchange_rate}'
+        response_message = crypto_pair_message(symbol, currency, result)
+    response_message += get_last_known_good_message(api_response)
     _ = DEBUG and log_debug(f"crypto | response_message:\n{response_message}")
     return response_message
 
 
+def crypto_pair_message(symbol, currency, result):
+    exchange_rate = f'{float(result[currency]):.2f}' \
+        if currency in result \
+        else f"ERROR: no {currency} element in API result"
+    return f'The {symbol} to {currency} ' + \
+        f'exchange rate is: {exchange_rate}'
+
+
+def get_symbols_list(symbols, default=None):
+    symbols_list = []
+    for symbol in (symbols or default or '').split(','):
+        symbol = symbol.strip().upper()
+        if symbol and symbol not in symbols_list:
+            symbols_list.append(symbol)
+    return symbols_list
+
+
+def get_crypto_batch_error(symbols_list, currencies_list):
+    """
+    Returns the error api_response of an empty or oversized crypto
+    batch, or None if it's valid.
+    """
+    if not symbols_list:
+        api_response = get_api_standard_response()
+        api_response['error'] = True
+        api_response['error_message'] = 'ERROR: no symbols supplied'
+        return api_response
+    if len(symbols_list) > int(settings.CRYPTO_BATCH_MAX_SYMBOLS) or \
+       len(currencies_list) > int(settings.CRYPTO_BATCH_MAX_CURRENCIES):
+        api_response = get_api_standard_response()
+        api_response['error'] = True
+        api_response['error_message'] = 'ERROR: too many symbols ' + \
+            f'(max {settings.CRYPTO_BATCH_MAX_SYMBOLS}) or currencies ' + \
+            f'(max {settings.CRYPTO_BATCH_MAX_CURRENCIES})'
+        return api_response
+    return None
+
+
+def crypto_batch(symbols, currencies=None, formatted=False):
+    """
+    Returns the exchange rates matrix for several crypto symbols and
+    currencies with a single cryptocompare 'pricemulti' call.
+    :param symbols: comma separated crypto symbols, e.g. "BTC,ETH,SOL".
+    :param currencies: comma separated currencies, e.g. "USD,EUR,COP".
+        Defaults to "USD".
+    :param formatted: if True, adds the crypto() per-pair messages.
+    :return: standard api response with the 'data' matrix
+        {symbol: {currency: rate}}, the 'missing' pairs and,
+        if formatted, the 'messages' matrix.
+    """
+    symbols_list = get_symbols_list(symbols)
+    currencies_list = get_symbols_list(currencies, 'USD')
+    api_response = get_crypto_batch_error(symbols_list, currencies_list)
+    if api_response:
+        return api_response
+    api_response = crypto_multi_api(
+        ','.join(symbols_list), ','.join(currencies_list)
+    )
+    return crypto_batch_response(
+        symbols_list, currencies_list, formatted, api_response
+    )
+
+
+async def crypto_batch_async(symbols, currencies=None, formatted=False):
+    symbols_list = get_symbols_list(symbols)
+    currencies_list = get_symbols_list(currencies, 'USD')
+    api_response = get_crypto_batch_error(symbols_list, currencies_list)
+    if api_response:
+        return api_response
+    api_response = await crypto_multi_api_async(
+        ','.join(symbols_list), ','.join(currencies_list)
+    )
+    return crypto_batch_response(
+        symbols_list, currencies_list, formatted, api_response
+    )
+
+
+def crypto_batch_response(symbols_list, currencies_list, formatted,
+                          api_response):
+    if api_response['error']:
+        return api_response
+    result = api_response['data']
+    last_known_good = api_response.get('last_known_good')
+    api_response = get_api_standard_response()
+    if last_known_good:
+        api_response['last_known_good'] = last_known_good
+    api_response['data'] = {
+        symbol: {
+            currency: result[symbol][currency]
+            for currency in currencies_list
+            if currency in result.get(symbol, {})
+        }
+        for symbol in symbols_list
+    }
+    api_response['missing'] = [
+        f'{symbol}-{currency}'
+        for symbol in symbols_list
+        for currency in currencies_list
+        if currency not in api_response['data'][symbol]
+    ]
+    if formatted:
+        api_response['messages'] = {
+            symbol: {
+                currency: crypto_pair_message(
+                    symbol, currency, api_response['data'][symbol]
+                )
+                for currency in currencies_list
+            }
+            for symbol in symbols_list
+        }
+    _ = DEBUG and log_debug(f"crypto_batch | api_response:\n{api_response}")
+    return api_response
+
+
 def eth(debug):
     return crypto('eth', 'usd', debug)
 
@@ -181,7 +582,14 @@ def btc(debug):
 
 
 def veb_bcv(debug):
-    api_response = veb_bcv_api()
+    return veb_bcv_message(debug, veb_bcv_api())
+
+
+async def veb_bcv_async(debug):
+    return veb_bcv_message(debug, await veb_bcv_api_async())
+
+
+def veb_bcv_message(debug, api_response):
     if api_response['error']:
         return api_response['error_message']
     result = api_response['data']
@@ -193,12 +601,20 @@ def veb_bcv(debug):
         response_message = 'BCV official exchange rate:' + \
             f' {exchange_rate:.2f} Bs/USD.\n' + \
             f'Effective Date: {effective_date}'
+    response_message += get_last_known_good_message(api_response)
     _ = DEBUG and log_debug(f"veb_bcv | response_message:\n{response_message}")
     return response_message
 
 
 def veb_monitor(debug):
-    api_response = veb_monitor_api()
+    return veb_monitor_message(debug, veb_monitor_api())
+
+
+async def veb_monitor_async(debug):
+    return veb_monitor_message(debug, await veb_monitor_api_async())
+
+
+def veb_monitor_message(debug, api_response):
     response_message = 'Monitor exchange rate:\n'
     if api_response['error']:
         response_message += "\n".join(api_response['error_message'])
@@ -216,6 +632,7 @@ def veb_monitor(debug):
         from_date = result['data']['effective_date']
         response_message += f'{exchange_rate}\n' + \
             f'Effective Date: {from_date}'
+    response_message += get_last_known_good_message(api_response)
     _ = DEBUG and log_debug("veb_monitor | " +
                             f"response_message:\n{response_message}")
     return response_message
@@ -247,6 +664,13 @@ def usdveb(debug):
     return response_message
 
 
+async def usdveb_async(debug):
+    response_message = await veb_bcv_async(debug)
+    _ = DEBUG and log_debug("usdveb_async | " +
+                            f"response_message:\n{response_message}")
+    return response_message
+
+
 def usdveb_monitor(debug):
     response_message = veb_monitor(debug)
     _ = DEBUG and log_debug("usdveb_monitor | " +
@@ -254,18 +678,48 @@ def usdveb_monitor(debug):
     return response_message
 
 
-def usdveb_full(debug):
-    response_message = veb_bcv(debug)
-    response_message += '\n\n' + veb_monitor(debug)
+async def usdveb_monitor_async(debug):
+    response_message = await veb_monitor_async(debug)
+    _ = DEBUG and log_debug("usdveb_monitor_async | " +
+                            f"response_message:\n{response_message}")
+    return response_message
+
+
+def usdveb_full_message(bcv_message, monitor_message):
+    response_message = bcv_message
+    response_message += '\n\n' + monitor_message
     # response_message += '\n\n' + veb_dolartoday(debug)
     _ = DEBUG and log_debug("usdveb_full | " +
                             f"response_message:\n{response_message}")
     return response_message
 
 
+def usdveb_full(debug):
+    bcv_message, monitor_message = fetch_concurrently(
+        lambda: veb_bcv(debug),
+        lambda: veb_monitor(debug),
+    )
+    return usdveb_full_message(bcv_message, monitor_message)
+
+
+async def usdveb_full_async(debug):
+    bcv_message, monitor_message = await fetch_concurrently_async(
+        lambda: veb_bcv_async(debug),
+        lambda: veb_monitor_async(debug),
+    )
+    return usdveb_full_message(bcv_message, monitor_message)
+
+
 def usdcop(debug):
+    return usdcop_message(debug, cop_api())
+
+
+async def usdcop_async(debug):
+    return usdcop_message(debug, await cop_api_async())
+
+
+def usdcop_message(debug, api_response):
     try:
-        api_response = cop_api()
         if api_response['error']:
             return api_response['error_message']
         result = api_response['data']['data']['official_cop']['data']
@@ -312,6 +766,7 @@ def usdcop(debug):
                 f'{google_exchange_rate_bank:.2f} COP/USD' + \
                 f' (+{google_exchange_rate_bank_prec:.2f}%).\n' + \
                 f'Effective date: {google_effective_date}.'
+        response_message += get_last_known_good_message(api_response)
 
     except Exception as err:
         response_message = f'ERROR in usdcop: {err}'
@@ -321,8 +776,18 @@ def usdcop(debug):
 
 
 def veb_cop(currency_pair, debug):
-    veb_response = veb_bcv_api()
-    cop_response = cop_api()
+    veb_response, cop_response = fetch_concurrently(veb_bcv_api, cop_api)
+    return veb_cop_message(currency_pair, debug, veb_response, cop_response)
+
+
+async def veb_cop_async(currency_pair, debug):
+    veb_response, cop_response = await fetch_concurrently_async(
+        veb_bcv_api_async, cop_api_async
+    )
+    return veb_cop_message(currency_pair, debug, veb_response, cop_response)
+
+
+def veb_cop_message(currency_pair, debug, veb_response, cop_response):
     if veb_response['error']:
         return veb_response['error_message']
     if cop_response['error']:
@@ -346,5 +811,92 @@ def veb_cop(currency_pair, debug):
         response_message = 'Exchange rate:' + \
             f' {exchange_rate:.4f} {suffix}.\n' + \
             f'Effective Date: {effective_date}'
+    response_message += get_last_known_good_message(veb_response)
+    response_message += get_last_known_good_message(cop_response)
     _ = DEBUG and log_debug(f"veb_cop | response_message:\n{response_message}")
     return response_message
+
+
+def get_base_rates(bcv_response, monitor_response, cop_response,
+                   crypto_response):
+    """
+    Returns the {pair: rate} base rates of the cross-rate graph from the
+    providers api_responses. Failed providers are left out, so their
+    currencies are just not convertible.
+    """
+    base_rates = {}
+    for api_response, get_rates in [
+        (bcv_response, get_bcv_rates),
+        (monitor_response, get_monitor_rates),
+        (cop_response, get_cop_rates),
+    ]:
+        if api_response['error']:
+            continue
+        try:
+            base_rates.update(get_rates(api_response['data']))
+        except Exception as err:
+            log_warning(f'get_base_rates | ERROR: {err}')
+    if not crypto_response['error']:
+        for symbol, result in crypto_response['data'].items():
+            if isinstance(result, dict):
+                base_rates.update(get_crypto_rates(symbol, result))
+    return base_rates
+
+
+def get_graph_crypto_symbols():
+    return ','.join(get_symbols_list(settings.RATE_GRAPH_CRYPTO_SYMBOLS))
+
+
+def get_conversion(from_currency, to_currency, amount=None):
+    api_response = get_api_standard_response()
+    from_currency = from_currency.upper()
+    to_currency = to_currency.upper()
+    try:
+        amount = 1.0 if amount is None else float(amount)
+    except ValueError:
+        api_response['error'] = True
+        api_response['error_message'] = f'ERROR: invalid amount {amount}'
+        return api_response
+    exchange_rate = rate_graph.rate(from_currency, to_currency)
+    if exchange_rate is None:
+        api_response['error'] = True
+        api_response['error_message'] = 'ERROR: no exchange rate from ' + \
+            f'{from_currency} to {to_currency}'
+        api_response['data'] = {'currencies': rate_graph.currencies()}
+        return api_response
+    api_response['data'] = {
+        'from': from_currency,
+        'to': to_currency,
+        'rate': exchange_rate,
+        'amount': amount,
+        'value': amount * exchange_rate,
+        'updated_at': rate_graph.stats()['updated_at'],
+    }
+    return api_response
+
+
+def convert(from_currency, to_currency, amount=None):
+    """
+    Converts 'amount' (default 1) between any pair of known currencies
+    (e.g. BTC to VES or COP to ETH) through the cross-rate graph. The
+    graph is only rebuilt when the cached base rates change.
+    """
+    base_responses = fetch_concurrently(
+        veb_bcv_api,
+        veb_monitor_api,
+        cop_api,
+        lambda: crypto_multi_api(get_graph_crypto_symbols(), 'USD'),
+    )
+    rate_graph.update(get_base_rates(*base_responses))
+    return get_conversion(from_currency, to_currency, amount)
+
+
+async def convert_async(from_currency, to_currency, amount=None):
+    base_responses = await fetch_concurrently_async(
+        veb_bcv_api_async,
+        veb_monitor_api_async,
+        cop_api_async,
+        lambda: crypto_multi_api_async(get_graph_crypto_symbols(), 'USD'),
+    )
+    rate_graph.update(get_base_rates(*base_responses))
+    return get_conversion(from_currency, to_currency, amount)
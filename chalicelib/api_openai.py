@@ -1,12 +1,22 @@
 # openai_api.py
 # 2023-01-24 | CR
+import asyncio
 import json
-import openai
-import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
 
 from chalicelib.utility_general import \
     get_api_standard_response, log_debug, log_warning
 from chalicelib.settings import settings
+from chalicelib.utility_http import (
+    http_post, async_http_post, http_post_stream, async_http_post_stream)
+from chalicelib.utility_ai_cache import (
+    ai_response_cache, get_ai_cache_key, is_cacheable)
+from chalicelib.utility_rate_limiter import (
+    openai_rate_limiter, RateLimitExceeded)
+from chalicelib.utility_tokens import fit_prompt, PromptTooLong
+from chalicelib.utility_ai_usage import ai_usage
 
 
 class openai_defaults:
@@ -19,6 +29,11 @@ class openai_defaults:
     API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
 
 
+# Model name prefixes that take 'max_completion_tokens' instead of
+# 'max_tokens'
+MAX_COMPLETION_TOKENS_MODELS = ('o1', 'o3', 'o4-mini', 'gpt-5')
+
+
 def adjust_prompt(prompt_model, messages):
     response = get_api_standard_response()
     if not messages:
@@ -26,7 +41,8 @@ def adjust_prompt(prompt_model, messages):
         response['error_message'] = 'ERROR OAI-050:' + \
             'No question supplied'
         return response
-    if messages[0] == '{':
+    if messages[0] in ('{', '['):
+        # A JSON list of {"role", "content"} messages (a conversation)
         try:
             response['messages'] = json.loads(messages)
             return response
@@ -60,58 +76,138 @@ def adjust_prompt(prompt_model, messages):
     return response
 
 
-def openai_api_general(
+def is_valid_messages(messages):
+    return isinstance(messages, list) and bool(messages) and all(
+        isinstance(message, dict) and message.get('role')
+        for message in messages
+    )
+
+
+def get_max_tokens_param(openai_model):
+    """
+    The reasoning models (o1, o3, o4-mini, gpt-5...) take the completion
+    tokens limit as 'max_completion_tokens' and reject 'max_tokens'.
+    """
+    if str(openai_model).startswith(MAX_COMPLETION_TOKENS_MODELS):
+        return "max_completion_tokens"
+    return "max_tokens"
+
+
+def get_openai_request(
     messages,
-    debug=False,
-    prompt_model=openai_defaults.PROMPT_MODEL,
-    openai_model=openai_defaults.OPENAI_MODEL,
-    temperature=openai_defaults.TEMPERATURE,
-    max_tokens=None
+    prompt_model,
+    openai_model,
+    temperature,
+    max_tokens,
+    stream=False
 ):
-    response = get_api_standard_response()
-    if not messages:
-        response['error'] = True
-        response['error_message'] = 'ERROR OAI-010:' + \
-            'No question supplied'
-        return response
-    try:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-        }
-        prompt = adjust_prompt(prompt_model, messages)
-        if not prompt['error']:
-            return prompt
-        data = {
-            "model": openai_model,
-            "messages": prompt['messages'],
-            "temperature": temperature,
-        }
-        if max_tokens is not None:
-            data["max_tokens"] = max_tokens
-        log_debug(f'>>> openai_api_general.data: {data}')
-        http_response = requests.post(
-            openai_defaults.API_ENDPOINT,
-            headers=headers,
-            data=json.dumps(data)
+    """
+    Returns the api_response with the 'headers' and 'data' of the
+    chat completions request, or the adjust_prompt() error response.
+    The pre-flight (OPENAI_PROMPT_PREFLIGHT) counts the 'prompt_tokens'
+    and trims the oversized conversations, or raises PromptTooLong. The
+    answer room it derives is only used for that check: a tokens limit
+    is sent only if the caller gave 'max_tokens'.
+    """
+    prompt = adjust_prompt(prompt_model, messages)
+    if prompt['error']:
+        return prompt
+    if not is_valid_messages(prompt['messages']):
+        return get_openai_error(
+            'OAI-065', 'The question must be a list of {"role", "content"}'
+            ' messages')
+    if settings.OPENAI_PROMPT_PREFLIGHT in ('trim', 'reject'):
+        fitted_prompt = fit_prompt(
+            prompt['messages'], openai_model, max_tokens,
+            openai_defaults.MAX_TOKENS_MAX, int(openai_defaults.MAX_TOKENS_MIN)
         )
-        if http_response.status_code == 200:
-            openai_response = http_response.json()
-            openai_response['question'] = messages
-        else:
-            # raise Exception(f"Error {response.status_code}: {response.text}")
-            response['error'] = True
-            response['error_message'] = 'ERROR OAI-040: Status Code:' + \
-                f' {response.status_code}' + \
-                f'| Msg: {response.text}'
-            log_warning(response['error_message'])
-            return response
+        prompt['messages'] = fitted_prompt['messages']
+        prompt['prompt_tokens'] = fitted_prompt['prompt_tokens']
+        prompt['trimmed'] = fitted_prompt['trimmed']
+    data = {
+        "model": openai_model,
+        "messages": prompt['messages'],
+        "temperature": temperature,
+    }
+    if max_tokens is not None:
+        data[get_max_tokens_param(openai_model)] = int(max_tokens)
+    if stream:
+        data["stream"] = True
+        # The last chunk has the tokens usage
+        data["stream_options"] = {"include_usage": True}
+    log_debug(f'>>> openai_api_general.data: {data}')
+    prompt['headers'] = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+    }
+    prompt['data'] = json.dumps(data)
+    return prompt
 
-    except Exception as err:
+
+def has_choices_content(openai_response):
+    try:
+        return bool(openai_response["choices"][0]["message"]["content"])
+    except Exception:
+        return False
+
+
+def get_openai_cache_key(request, openai_model, temperature, max_tokens,
+                         cache):
+    """
+    Returns the response cache key of a chat completions request, or None
+    if it must not be cached.
+    """
+    if not is_cacheable(temperature, cache):
+        return None
+    return get_ai_cache_key(
+        openai_model, request['messages'], temperature, max_tokens
+    )
+
+
+def get_cached_openai_result(cache_key, messages, debug):
+    """
+    Returns the result of a cached OpenAI response, or None.
+    """
+    if cache_key is None:
+        return None
+    openai_response = ai_response_cache.get(cache_key)
+    if openai_response is None:
+        return None
+    log_debug(f'>>> openai_api_general | cache hit: {cache_key}')
+    openai_response['cached'] = True
+    return get_openai_response_result(openai_response, messages, debug)
+
+
+def get_openai_result(http_response, messages, debug, cache_key=None,
+                      usage_key=None):
+    """
+    Parses the chat completions requests or httpx response. The tokens
+    usage is recorded for the (user, model) 'usage_key'.
+    """
+    response = get_api_standard_response()
+    if http_response.status_code != 200:
+        # raise Exception(f"Error {response.status_code}: {response.text}")
         response['error'] = True
-        response['error_message'] = f'ERROR OAI-030: {str(err)}'
+        response['error_message'] = 'ERROR OAI-040: Status Code:' + \
+            f' {http_response.status_code}' + \
+            f'| Msg: {http_response.text}'
         log_warning(response['error_message'])
         return response
+    openai_response = http_response.json()
+    if usage_key is not None:
+        ai_usage.record(*usage_key, openai_response.get('usage'))
+    if cache_key is not None and has_choices_content(openai_response):
+        ai_response_cache.set(cache_key, openai_response)
+    return get_openai_response_result(openai_response, messages, debug)
+
+
+def get_openai_response_result(openai_response, messages, debug):
+    """
+    Returns the answer (choices message content) of an OpenAI response, or
+    the whole response if 'debug'.
+    """
+    response = get_api_standard_response()
+    openai_response['question'] = messages
 
     if debug:
         response['data'] = openai_response
@@ -133,6 +229,453 @@ def openai_api_general(
     return response
 
 
+# Rate limits
+
+
+def get_rate_limit_params(request):
+    """
+    Returns the (model, tokens) of a chat completions request for the
+    rate limiter: the pre-flight prompt tokens (or about 4 characters per
+    token) plus the completion tokens limit, if any.
+    """
+    data = json.loads(request['data'])
+    prompt_tokens = request.get('prompt_tokens')
+    if prompt_tokens is None:
+        prompt_tokens = sum(
+            len(str(message.get('content', '')))
+            for message in data.get('messages', [])
+        ) // 4
+    return data.get('model'), \
+        prompt_tokens + int(data.get(get_max_tokens_param(
+            data.get('model'))) or 0)
+
+
+def reserve_openai_attempt(model, tokens, attempt):
+    """
+    Reserves the rate limiter slot of an attempt (from 0) of a request.
+    The tokens are reserved once per request: a retried attempt only
+    takes a request slot. Returns the seconds to wait before sending it.
+    """
+    return openai_rate_limiter.reserve(model, 0 if attempt else tokens)
+
+
+def post_openai_request(request):
+    """
+    Sends the chat completions request when the rate limiter gives it a
+    slot, retrying the 429 and 5xx responses with jittered backoff.
+    Returns the last http response.
+    """
+    model, tokens = get_rate_limit_params(request)
+    attempt = 0
+    while True:
+        time.sleep(reserve_openai_attempt(model, tokens, attempt))
+        http_response = http_post(
+            openai_defaults.API_ENDPOINT,
+            read_timeout=settings.OPENAI_READ_TIMEOUT,
+            headers=request['headers'],
+            data=request['data']
+        )
+        retry_delay = openai_rate_limiter.get_retry_delay(
+            model, http_response, attempt)
+        if retry_delay is None:
+            return http_response
+        log_warning(f'OpenAI {model} | Status Code:'
+                    f' {http_response.status_code} | retry in'
+                    f' {retry_delay:.2f} s')
+        time.sleep(retry_delay)
+        attempt += 1
+
+
+async def post_openai_request_async(request):
+    """
+    post_openai_request() for the FastAPI app.
+    """
+    model, tokens = get_rate_limit_params(request)
+    attempt = 0
+    while True:
+        await asyncio.sleep(
+            reserve_openai_attempt(model, tokens, attempt))
+        http_response = await async_http_post(
+            openai_defaults.API_ENDPOINT,
+            read_timeout=settings.OPENAI_READ_TIMEOUT,
+            headers=request['headers'],
+            content=request['data']
+        )
+        retry_delay = openai_rate_limiter.get_retry_delay(
+            model, http_response, attempt)
+        if retry_delay is None:
+            return http_response
+        log_warning(f'OpenAI {model} | Status Code:'
+                    f' {http_response.status_code} | retry in'
+                    f' {retry_delay:.2f} s')
+        await asyncio.sleep(retry_delay)
+        attempt += 1
+
+
+@contextmanager
+def open_openai_stream(request):
+    """
+    post_openai_request() for the streamed requests: yields the response
+    to read, after the retries of the 429 and 5xx responses.
+    """
+    model, tokens = get_rate_limit_params(request)
+    attempt = 0
+    while True:
+        time.sleep(reserve_openai_attempt(model, tokens, attempt))
+        with http_post_stream(
+            openai_defaults.API_ENDPOINT,
+            read_timeout=settings.OPENAI_READ_TIMEOUT,
+            headers=request['headers'],
+            data=request['data']
+        ) as http_response:
+            retry_delay = openai_rate_limiter.get_retry_delay(
+                model, http_response, attempt)
+            if retry_delay is None:
+                yield http_response
+                return
+        time.sleep(retry_delay)
+        attempt += 1
+
+
+@asynccontextmanager
+async def open_openai_stream_async(request):
+    """
+    open_openai_stream() for the FastAPI app. The error responses body is
+    read, so it can be reported.
+    """
+    model, tokens = get_rate_limit_params(request)
+    attempt = 0
+    while True:
+        await asyncio.sleep(
+            reserve_openai_attempt(model, tokens, attempt))
+        async with async_http_post_stream(
+            openai_defaults.API_ENDPOINT,
+            read_timeout=settings.OPENAI_READ_TIMEOUT,
+            headers=request['headers'],
+            content=request['data']
+        ) as http_response:
+            if http_response.status_code != 200:
+                await http_response.aread()
+            retry_delay = openai_rate_limiter.get_retry_delay(
+                model, http_response, attempt)
+            if retry_delay is None:
+                yield http_response
+                return
+        await asyncio.sleep(retry_delay)
+        attempt += 1
+
+
+def get_openai_error(error_code, error_message):
+    response = get_api_standard_response()
+    response['error'] = True
+    response['error_message'] = f'ERROR {error_code}: {error_message}'
+    log_warning(response['error_message'])
+    return response
+
+
+def openai_api_general(
+    messages,
+    debug=False,
+    prompt_model=openai_defaults.PROMPT_MODEL,
+    openai_model=openai_defaults.OPENAI_MODEL,
+    temperature=openai_defaults.TEMPERATURE,
+    max_tokens=None,
+    cache=None,
+    user=None
+):
+    """
+    Deterministic requests (temperature 0, or 'cache' "1") are served
+    from the response cache if the same question was already answered.
+    """
+    if not messages:
+        return get_openai_error('OAI-010', 'No question supplied')
+    try:
+        request = get_openai_request(
+            messages, prompt_model, openai_model, temperature, max_tokens
+        )
+        if request['error']:
+            return request
+        cache_key = get_openai_cache_key(
+            request, openai_model, temperature, max_tokens, cache
+        )
+        cached_result = get_cached_openai_result(cache_key, messages, debug)
+        if cached_result is not None:
+            ai_usage.record(user, openai_model, cached=True)
+            return cached_result
+        http_response = post_openai_request(request)
+        return get_openai_result(http_response, messages, debug, cache_key,
+                                 (user, openai_model))
+    except RateLimitExceeded as err:
+        return get_openai_error('OAI-045', str(err))
+    except PromptTooLong as err:
+        return get_openai_error('OAI-070', str(err))
+    except Exception as err:
+        return get_openai_error('OAI-030', str(err))
+
+
+async def openai_api_general_async(
+    messages,
+    debug=False,
+    prompt_model=openai_defaults.PROMPT_MODEL,
+    openai_model=openai_defaults.OPENAI_MODEL,
+    temperature=openai_defaults.TEMPERATURE,
+    max_tokens=None,
+    cache=None,
+    user=None
+):
+    """
+    openai_api_general() for the FastAPI app, using the httpx client
+    of the running event loop.
+    """
+    if not messages:
+        return get_openai_error('OAI-010', 'No question supplied')
+    try:
+        request = get_openai_request(
+            messages, prompt_model, openai_model, temperature, max_tokens
+        )
+        if request['error']:
+            return request
+        cache_key = get_openai_cache_key(
+            request, openai_model, temperature, max_tokens, cache
+        )
+        cached_result = get_cached_openai_result(cache_key, messages, debug)
+        if cached_result is not None:
+            ai_usage.record(user, openai_model, cached=True)
+            return cached_result
+        http_response = await post_openai_request_async(request)
+        return get_openai_result(http_response, messages, debug, cache_key,
+                                 (user, openai_model))
+    except RateLimitExceeded as err:
+        return get_openai_error('OAI-045', str(err))
+    except PromptTooLong as err:
+        return get_openai_error('OAI-070', str(err))
+    except Exception as err:
+        return get_openai_error('OAI-030', str(err))
+
+
+# Streaming (server-sent events)
+
+
+SSE_DONE = 'data: [DONE]\n\n'
+
+
+def get_sse_event(data, event=None):
+    """
+    Returns a server-sent event with the JSON 'data'.
+    """
+    sse_event = f'event: {event}\n' if event else ''
+    return sse_event + f'data: {json.dumps(data)}\n\n'
+
+
+def get_stream_chunk(line):
+    """
+    Returns the parsed chunk of an OpenAI stream line, {} if it has none
+    (e.g. a keep-alive) or None on the '[DONE]' line.
+    """
+    if not line or not line.startswith('data:'):
+        return {}
+    payload = line[len('data:'):].strip()
+    if payload == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(payload)
+    except ValueError:
+        return {}
+    return chunk if isinstance(chunk, dict) else {}
+
+
+def get_chunk_choice(chunk):
+    try:
+        return chunk["choices"][0] or {}
+    except (KeyError, IndexError, TypeError):
+        return {}
+
+
+def get_stream_delta(line):
+    """
+    Returns the content delta of an OpenAI stream line, '' if it has none
+    (e.g. the role chunk or a keep-alive) or None on the '[DONE]' line.
+    """
+    chunk = get_stream_chunk(line)
+    if chunk is None:
+        return None
+    return (get_chunk_choice(chunk).get("delta") or {}).get("content") or ''
+
+
+def get_streamed_response():
+    """
+    Returns the chat completion object rebuilt from the stream chunks by
+    add_stream_chunk(), so a streamed answer is cached the same way as a
+    non streamed one.
+    """
+    return {
+        "object": "chat.completion",
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": None},
+            "finish_reason": None,
+        }],
+        "usage": None,
+    }
+
+
+def add_stream_chunk(openai_response, chunk):
+    """
+    Adds a stream chunk response fields, finish reason and tokens usage
+    (the last chunk) to the 'openai_response'.
+    """
+    for field in ('id', 'created', 'model', 'system_fingerprint'):
+        if chunk.get(field) is not None:
+            openai_response[field] = chunk[field]
+    if chunk.get("usage"):
+        openai_response["usage"] = chunk["usage"]
+    finish_reason = get_chunk_choice(chunk).get("finish_reason")
+    if finish_reason:
+        openai_response["choices"][0]["finish_reason"] = finish_reason
+
+
+def get_cached_openai_content(cache_key):
+    if cache_key is None:
+        return None
+    openai_response = ai_response_cache.get(cache_key)
+    if openai_response is None:
+        return None
+    return openai_response["choices"][0]["message"]["content"]
+
+
+def cache_streamed_response(cache_key, openai_response, content):
+    if cache_key is None or not content:
+        return
+    openai_response["choices"][0]["message"]["content"] = ''.join(content)
+    ai_response_cache.set(cache_key, openai_response)
+
+
+def openai_api_stream(
+    messages,
+    debug=False,
+    prompt_model=openai_defaults.PROMPT_MODEL,
+    openai_model=openai_defaults.OPENAI_MODEL,
+    temperature=openai_defaults.TEMPERATURE,
+    max_tokens=None,
+    cache=None,
+    user=None
+):
+    """
+    openai_api_general() as a generator of server-sent events: one
+    {"delta": "..."} event per OpenAI token delta as they arrive, then
+    "[DONE]". The errors are an "error" event with the error response.
+    """
+    if not messages:
+        yield get_sse_event(
+            get_openai_error('OAI-010', 'No question supplied'), 'error')
+        return
+    try:
+        request = get_openai_request(
+            messages, prompt_model, openai_model, temperature, max_tokens,
+            stream=True
+        )
+        if request['error']:
+            yield get_sse_event(request, 'error')
+            return
+        cache_key = get_openai_cache_key(
+            request, openai_model, temperature, max_tokens, cache
+        )
+        cached_content = get_cached_openai_content(cache_key)
+        if cached_content is not None:
+            ai_usage.record(user, openai_model, cached=True)
+            yield get_sse_event({'delta': cached_content})
+            yield SSE_DONE
+            return
+        content = []
+        openai_response = get_streamed_response()
+        with open_openai_stream(request) as http_response:
+            if http_response.status_code != 200:
+                yield get_sse_event(get_openai_result(
+                    http_response, messages, debug), 'error')
+                return
+            for line in http_response.iter_lines(decode_unicode=True):
+                chunk = get_stream_chunk(line)
+                if chunk is None:
+                    break
+                add_stream_chunk(openai_response, chunk)
+                delta = (get_chunk_choice(chunk).get('delta') or {}).get(
+                    'content')
+                if delta:
+                    content.append(delta)
+                    yield get_sse_event({'delta': delta})
+        ai_usage.record(user, openai_model, openai_response['usage'])
+        cache_streamed_response(cache_key, openai_response, content)
+        yield SSE_DONE
+    except RateLimitExceeded as err:
+        yield get_sse_event(get_openai_error('OAI-045', str(err)), 'error')
+    except PromptTooLong as err:
+        yield get_sse_event(get_openai_error('OAI-070', str(err)), 'error')
+    except Exception as err:
+        yield get_sse_event(get_openai_error('OAI-030', str(err)), 'error')
+
+
+async def openai_api_stream_async(
+    messages,
+    debug=False,
+    prompt_model=openai_defaults.PROMPT_MODEL,
+    openai_model=openai_defaults.OPENAI_MODEL,
+    temperature=openai_defaults.TEMPERATURE,
+    max_tokens=None,
+    cache=None,
+    user=None
+):
+    """
+    openai_api_stream() for the FastAPI app.
+    """
+    if not messages:
+        yield get_sse_event(
+            get_openai_error('OAI-010', 'No question supplied'), 'error')
+        return
+    try:
+        request = get_openai_request(
+            messages, prompt_model, openai_model, temperature, max_tokens,
+            stream=True
+        )
+        if request['error']:
+            yield get_sse_event(request, 'error')
+            return
+        cache_key = get_openai_cache_key(
+            request, openai_model, temperature, max_tokens, cache
+        )
+        cached_content = get_cached_openai_content(cache_key)
+        if cached_content is not None:
+            ai_usage.record(user, openai_model, cached=True)
+            yield get_sse_event({'delta': cached_content})
+            yield SSE_DONE
+            return
+        content = []
+        openai_response = get_streamed_response()
+        async with open_openai_stream_async(request) as http_response:
+            if http_response.status_code != 200:
+                yield get_sse_event(get_openai_result(
+                    http_response, messages, debug), 'error')
+                return
+            async for line in http_response.aiter_lines():
+                chunk = get_stream_chunk(line)
+                if chunk is None:
+                    break
+                add_stream_chunk(openai_response, chunk)
+                delta = (get_chunk_choice(chunk).get('delta') or {}).get(
+                    'content')
+                if delta:
+                    content.append(delta)
+                    yield get_sse_event({'delta': delta})
+        ai_usage.record(user, openai_model, openai_response['usage'])
+        cache_streamed_response(cache_key, openai_response, content)
+        yield SSE_DONE
+    except RateLimitExceeded as err:
+        yield get_sse_event(get_openai_error('OAI-045', str(err)), 'error')
+    except PromptTooLong as err:
+        yield get_sse_event(get_openai_error('OAI-070', str(err)), 'error')
+    except Exception as err:
+        yield get_sse_event(get_openai_error('OAI-030', str(err)), 'error')
+
+
 def get_prompt_model(prompt_model, question):
     response = question
     if prompt_model == 'title_suggestion':
@@ -155,6 +698,8 @@ def openai_api_general_oai_lib(
     temperature=openai_defaults.TEMPERATURE,
     max_tokens=openai_defaults.MAX_TOKENS_MIN
 ):
+    # The openai SDK is slow to import and only used here
+    import openai
     openai.api_key = settings.OPENAI_API_KEY
     response = get_api_standard_response()
     if not question:
@@ -205,13 +750,16 @@ def openai_api_general_oai_lib(
     return response
 
 
-def openai_api_with_defaults(request):
+def get_openai_params(request):
     question = request.get('q')
     debug = request.get('debug', '0')
     prompt_model = request.get('p')
     openai_model = request.get('m')
     temperature = request.get('t')
     max_tokens = request.get('mt')
+    # Response cache: "1" to opt in, "0" to opt out, by default only
+    # with temperature 0
+    cache = request.get('cache')
 
     prompt_model = openai_defaults.PROMPT_MODEL if prompt_model is None \
         else prompt_model
@@ -222,11 +770,148 @@ def openai_api_with_defaults(request):
     # max_tokens = openai_defaults.MAX_TOKENS_MAX if max_tokens is None \
     #     else max_tokens
 
-    return openai_api_general(
+    return (
         question,
         debug == '1',
         prompt_model,
         openai_model,
         temperature,
-        max_tokens
+        max_tokens,
+        cache
     )
+
+
+def openai_api_with_defaults(request, user=None):
+    return openai_api_general(*get_openai_params(request), user=user)
+
+
+async def openai_api_with_defaults_async(request, user=None):
+    return await openai_api_general_async(
+        *get_openai_params(request), user=user)
+
+
+def is_stream_request(request):
+    return str(request.get('stream', '0')) == '1'
+
+
+def openai_api_stream_with_defaults(request, user=None):
+    return openai_api_stream(*get_openai_params(request), user=user)
+
+
+def openai_api_stream_with_defaults_async(request, user=None):
+    return openai_api_stream_async(*get_openai_params(request), user=user)
+
+
+# Batch
+
+
+BATCH_DEFAULT_FIELDS = ('debug', 'p', 'm', 't', 'mt', 'cache')
+
+
+def get_batch_items(request):
+    """
+    Returns the (items, error response) of a /ai/batch request. Each item
+    is an /ai request; the request level 'debug', 'p', 'm', 't', 'mt' and
+    'cache' are the defaults of the items that don't have them.
+    """
+    items = request.get('items')
+    if not isinstance(items, list) or not items:
+        return None, get_openai_error('OAI-080', 'No items supplied')
+    if len(items) > int(settings.AI_BATCH_MAX_ITEMS):
+        return None, get_openai_error(
+            'OAI-085', f'Too many items (max {settings.AI_BATCH_MAX_ITEMS})')
+    defaults = {
+        field: request[field] for field in BATCH_DEFAULT_FIELDS
+        if request.get(field) is not None
+    }
+    return [
+        dict(defaults, **{
+            key: value for key, value in item.items() if value is not None
+        }) if isinstance(item, dict) else item
+        for item in items
+    ], None
+
+
+def get_batch_concurrency(request, items_count):
+    """
+    The request 'concurrency' can only lower AI_BATCH_CONCURRENCY.
+    """
+    concurrency = int(settings.AI_BATCH_CONCURRENCY)
+    try:
+        concurrency = min(concurrency, int(request.get('concurrency')))
+    except (TypeError, ValueError):
+        pass
+    return max(1, min(concurrency, items_count))
+
+
+def get_batch_item_result(result):
+    """
+    Returns an /ai result as a standard response: the answers (str) go in
+    'data', the error and debug responses are already one.
+    """
+    if isinstance(result, dict):
+        return result
+    response = get_api_standard_response()
+    response['data'] = result
+    return response
+
+
+def get_batch_response(results):
+    response = get_api_standard_response()
+    response['data'] = results
+    response['errors'] = sum(1 for result in results if result['error'])
+    return response
+
+
+def openai_api_batch_item(item, user=None):
+    try:
+        if not isinstance(item, dict):
+            raise ValueError('The item must be an object')
+        return get_batch_item_result(openai_api_with_defaults(item, user))
+    except Exception as err:
+        return get_openai_error('OAI-090', str(err))
+
+
+async def openai_api_batch_item_async(item, semaphore, user=None):
+    async with semaphore:
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('The item must be an object')
+            return get_batch_item_result(
+                await openai_api_with_defaults_async(item, user))
+        except Exception as err:
+            return get_openai_error('OAI-090', str(err))
+
+
+def openai_api_batch(request, user=None):
+    """
+    Runs the /ai requests of the 'items' with at most 'concurrency'
+    (AI_BATCH_CONCURRENCY) OpenAI calls at the same time. Returns the
+    standard response with the items results, in the same order, in 'data'
+    and the number of failed items in 'errors'. An item error doesn't fail
+    the batch.
+    """
+    items, error_response = get_batch_items(request)
+    if error_response:
+        return error_response
+    concurrency = get_batch_concurrency(request, len(items))
+    with ThreadPoolExecutor(max_workers=concurrency,
+                            thread_name_prefix='ai_batch') as executor:
+        results = list(executor.map(
+            lambda item: openai_api_batch_item(item, user), items))
+    return get_batch_response(results)
+
+
+async def openai_api_batch_async(request, user=None):
+    """
+    openai_api_batch() for the FastAPI app.
+    """
+    items, error_response = get_batch_items(request)
+    if error_response:
+        return error_response
+    semaphore = asyncio.Semaphore(
+        get_batch_concurrency(request, len(items)))
+    results = await asyncio.gather(*[
+        openai_api_batch_item_async(item, semaphore, user) for item in items
+    ])
+    return get_batch_response(list(results))
@@ -3,24 +3,41 @@
 # 2023-01-24 | CR
 #
 import logging
-from typing import Union
+from contextlib import asynccontextmanager
+from typing import List, Union
 
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from a2wsgi import ASGIMiddleware
 from pydantic import BaseModel
 
-from chalicelib.utility_password import get_password_hash
+from chalicelib.utility_password import (
+    PasswordServiceBusy, get_password_hash_async)
 from chalicelib.utility_jwt import (
-    Token, login_for_access_token, get_current_active_user)
+    Token, login_for_access_token_async, get_current_active_user,
+    get_password_busy_exception)
 from chalicelib.utility_date import get_formatted_date
 from chalicelib.utility_general import (
     get_command_line_args, log_endpoint_debug, log_debug, log_normal)
 from chalicelib.model_users import User
-from chalicelib.api_openai import openai_api_with_defaults
+from chalicelib.api_openai import (
+    openai_api_with_defaults_async, openai_api_stream_with_defaults_async,
+    is_stream_request, openai_api_batch_async)
+from chalicelib.utility_ai_cache import ai_response_cache
+from chalicelib.utility_ai_usage import (
+    ai_usage, get_usage_user, AiUsageForbidden)
 from chalicelib.api_currency_exchange import (
-    crypto, usdcop, usdveb, veb_cop, usdveb_full, usdveb_monitor)
+    crypto_async, usdcop_async, usdveb_async, usdveb_monitor_async,
+    veb_cop_async, usdveb_full_async, crypto_batch_async,
+    convert_async)
 from chalicelib.request_processing import request_processing
+from chalicelib.settings import settings
+from chalicelib.utility_rates_refresher import rates_refresher
+from chalicelib.utility_cache import get_cache_stats
+from chalicelib.utility_rates_history import (
+    get_rates_history, get_rates_history_pairs)
+from chalicelib.utility_http import close_async_client
 
 
 logging.basicConfig(
@@ -34,8 +51,28 @@ if params['mode'] == 'cli':
     apiResponse = request_processing(params.get('body', ''))
     log_normal(apiResponse)
 
-api = FastAPI()
+
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    if settings.RATES_REFRESHER_ENABLED == "1":
+        rates_refresher.start()
+    yield
+    await rates_refresher.stop()
+    await close_async_client()
+
+
+api = FastAPI(lifespan=lifespan)
 app = ASGIMiddleware(api)
+
+
+@api.middleware("http")
+async def ensure_rates_refresher(request: Request, call_next):
+    # The WSGI wrapper (gunicorn + a2wsgi) doesn't run the lifespan
+    # events, so the refresher is started on the first request instead.
+    if settings.RATES_REFRESHER_ENABLED == "1" and \
+       not rates_refresher.is_running():
+        rates_refresher.start()
+    return await call_next(request)
 log_normal(f'Mediabros APIs started [FastAPI]. {get_formatted_date()}')
 
 
@@ -47,13 +84,17 @@ async def login_for_access_token_endpoint(
     form_data: OAuth2PasswordRequestForm = Depends()
 ):
     log_endpoint_debug('/token')
-    return login_for_access_token(form_data)
+    return await login_for_access_token_async(form_data)
 
 
 @api.get("/pget")
 async def pget(p: str):
     log_endpoint_debug('/pget')
-    return dict({'password_hashed': get_password_hash(p)})
+    try:
+        password_hashed = await get_password_hash_async(p)
+    except PasswordServiceBusy:
+        raise get_password_busy_exception()
+    return dict({'password_hashed': password_hashed})
 
 
 # @api.get("/users/me/", response_model=User)
@@ -81,6 +122,32 @@ class Body(BaseModel):
     m: Union[str, None] = None
     t: Union[str, None] = None
     mt: Union[str, None] = None
+    cache: Union[str, None] = None
+    stream: Union[str, None] = None
+
+
+class BatchBody(BaseModel):
+    items: List[Body] = []
+    # Defaults of the items
+    debug: Union[int, None] = None
+    p: Union[str, None] = None
+    m: Union[str, None] = None
+    t: Union[str, None] = None
+    mt: Union[str, None] = None
+    cache: Union[str, None] = None
+    concurrency: Union[int, None] = None
+
+
+def get_sse_response(events):
+    """
+    Sends the server-sent 'events' as they are generated, with no proxy
+    buffering.
+    """
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
 @api.get("/query_params/")
@@ -91,6 +158,34 @@ async def api_query_params(request: Request):
     return api_response
 
 
+@api.get("/rates_cache_stats")
+def api_rates_cache_stats():
+    log_endpoint_debug('/rates_cache_stats')
+    cache_stats = get_cache_stats()
+    cache_stats['refresher'] = rates_refresher.status()
+    return cache_stats
+
+
+@api.get("/ai_cache_stats")
+def api_ai_cache_stats():
+    log_endpoint_debug('/ai_cache_stats')
+    return ai_response_cache.stats()
+
+
+@api.get("/ai_usage")
+async def api_ai_usage(
+    user: Union[str, None] = None,
+    model: Union[str, None] = None,
+    current_user: User = Depends(get_current_active_user)
+):
+    log_endpoint_debug('/ai_usage')
+    try:
+        user = get_usage_user(current_user.username, user)
+    except AiUsageForbidden as err:
+        raise HTTPException(status_code=403, detail=str(err))
+    return ai_usage.get_totals(user, model)
+
+
 @api.post("/ai")
 async def ai_post(
     body: Body,
@@ -99,7 +194,12 @@ async def ai_post(
     log_endpoint_debug('/ai POST')
     form_params = dict(body)
     log_debug(f'ai_post: body = {str(form_params)}')
-    api_response = openai_api_with_defaults(form_params)
+    if is_stream_request(form_params):
+        return get_sse_response(
+            openai_api_stream_with_defaults_async(
+                form_params, current_user.username))
+    api_response = await openai_api_with_defaults_async(
+        form_params, current_user.username)
     log_debug(f'ai_post: api_response = {api_response}')
     return api_response
 
@@ -111,11 +211,28 @@ async def ai_get(
 ):
     log_endpoint_debug('/ai GET')
     log_debug(f'ai_get: request = {request.query_params}')
-    api_response = openai_api_with_defaults(request.query_params)
+    if is_stream_request(request.query_params):
+        return get_sse_response(
+            openai_api_stream_with_defaults_async(
+                request.query_params, current_user.username))
+    api_response = await openai_api_with_defaults_async(
+        request.query_params, current_user.username)
     log_debug(f'ai_get: api_response = {api_response}')
     return api_response
 
 
+@api.post("/ai/batch")
+async def ai_batch_post(
+    body: BatchBody,
+    current_user: User = Depends(get_current_active_user)
+):
+    log_endpoint_debug('/ai/batch POST')
+    form_params = dict(body)
+    form_params['items'] = [dict(item) for item in body.items]
+    log_debug(f'ai_batch_post: items = {len(form_params["items"])}')
+    return await openai_api_batch_async(form_params, current_user.username)
+
+
 @api.get("/codex")
 async def codex_get(
     request: Request,
@@ -125,120 +242,158 @@ async def codex_get(
     request_params = dict(request.query_params)
     request_params['m'] = 'code-davinci-002'
     log_debug(f'codex_get: request = {request_params}')
-    api_response = openai_api_with_defaults(request_params)
+    api_response = await openai_api_with_defaults_async(
+        request_params, current_user.username)
     log_debug(f'codex_get: api_response = {api_response}')
     return api_response
 
 
 @api.get("/usdcop")
-def endpoint_usdcop_plain():
+async def endpoint_usdcop_plain():
     log_endpoint_debug('/usdcop')
-    return usdcop(False)
+    return await usdcop_async(False)
 
 
 @api.get("/usdcop/{debug}")
-def endpoint_usdcop(debug: int):
+async def endpoint_usdcop(debug: int):
     log_endpoint_debug(f'/usdcop/{debug}')
-    return usdcop(debug == 1)
+    return await usdcop_async(debug == 1)
 
 
 @api.get("/usdveb")
-def endpoint_usdveb_plain():
+async def endpoint_usdveb_plain():
     log_endpoint_debug('/usdveb')
-    return usdveb(False)
+    return await usdveb_async(False)
 
 
 @api.get("/usdveb/{debug}")
-def endpoint_usdveb(debug: int):
+async def endpoint_usdveb(debug: int):
     log_endpoint_debug(f'/usdveb/{debug}')
-    return usdveb(debug == 1)
+    return await usdveb_async(debug == 1)
 
 
 @api.get("/usdveb_full")
-def endpoint_usdveb_full_plain():
+async def endpoint_usdveb_full_plain():
     log_endpoint_debug('/usdveb_full')
-    return usdveb_full(False)
+    return await usdveb_full_async(False)
 
 
 @api.get("/usdveb_full/{debug}")
-def endpoint_usdveb_full(debug: int):
+async def endpoint_usdveb_full(debug: int):
     log_endpoint_debug(f'/usdveb_full/{debug}')
-    return usdveb_full(str(debug) == "1")
+    return await usdveb_full_async(str(debug) == "1")
 
 
 @api.get("/usdveb_monitor")
-def endpoint_usdveb_monitor_plain():
+async def endpoint_usdveb_monitor_plain():
     log_endpoint_debug('/usdveb_monitor')
-    return usdveb_monitor(False)
+    return await usdveb_monitor_async(False)
 
 
 @api.get("/usdveb_monitor/{debug}")
-def endpoint_usdveb_monitor(debug: int):
+async def endpoint_usdveb_monitor(debug: int):
     log_endpoint_debug(f'/usdveb_monitor/{debug}')
-    return usdveb_monitor(str(debug) == "1")
+    return await usdveb_monitor_async(str(debug) == "1")
 
 
 @api.get("/copveb")
-def endpoint_copveb_plain():
+async def endpoint_copveb_plain():
     log_endpoint_debug('/copveb')
-    return veb_cop('copveb', False)
+    return await veb_cop_async('copveb', False)
 
 
 @api.get("/copveb/{debug}")
-def endpoint_copveb(debug: int):
+async def endpoint_copveb(debug: int):
     log_endpoint_debug(f'/copveb/{debug}')
-    return veb_cop('copveb', debug == 1)
+    return await veb_cop_async('copveb', debug == 1)
 
 
 @api.get("/vebcop")
-def endpoint_vebcop_plain():
+async def endpoint_vebcop_plain():
     log_endpoint_debug('/vebcop')
-    return veb_cop('vebcop', False)
+    return await veb_cop_async('vebcop', False)
 
 
 @api.get("/vebcop/{debug}")
-def endpoint_vebcop(debug: int):
+async def endpoint_vebcop(debug: int):
     log_endpoint_debug(f'/vebcop/{debug}')
-    return veb_cop('vebcop', debug == 1)
+    return await veb_cop_async('vebcop', debug == 1)
 
 
 @api.get("/btc")
-def endpoint_btc_plain():
+async def endpoint_btc_plain():
     log_endpoint_debug('/btc')
-    return crypto('btc', 'usd', False)
+    return await crypto_async('btc', 'usd', False)
 
 
 @api.get("/btc/{debug}")
-def endpoint_btc(debug: int):
+async def endpoint_btc(debug: int):
     log_endpoint_debug(f'/btc/{debug}')
-    return crypto('btc', 'usd', debug == 1)
+    return await crypto_async('btc', 'usd', debug == 1)
 
 
 @api.get("/eth")
-def endpoint_eth_plain():
+async def endpoint_eth_plain():
     log_endpoint_debug('/eth')
-    return crypto('eth', 'usd', False)
+    return await crypto_async('eth', 'usd', False)
 
 
 @api.get("/eth/{debug}")
-def endpoint_eth(debug: int):
+async def endpoint_eth(debug: int):
     log_endpoint_debug(f'/eth/{debug}')
-    return crypto('eth', 'usd', debug == 1)
+    return await crypto_async('eth', 'usd', debug == 1)
 
 
 @api.get("/crypto/{symbol}")
-def endpoint_crypto_plain(symbol: str):
+async def endpoint_crypto_plain(symbol: str):
     log_endpoint_debug(f'/crypto/{symbol}')
-    return crypto(symbol, 'usd', False)
+    return await crypto_async(symbol, 'usd', False)
 
 
 @api.get("/crypto/{symbol}/{debug}")
-def endpoint_crypto(symbol: str, debug: int):
+async def endpoint_crypto(symbol: str, debug: int):
     log_endpoint_debug(f'/crypto/{symbol}/{debug}')
-    return crypto(symbol, 'usd', debug == 1)
+    return await crypto_async(symbol, 'usd', debug == 1)
 
 
 @api.get("/crypto/{symbol}/{currency}/{debug}")
-def endpoint_crypto_curr(symbol: str, currency: str, debug: int):
+async def endpoint_crypto_curr(symbol: str, currency: str, debug: int):
     log_endpoint_debug(f'/crypto/{symbol}/{currency}/{debug}')
-    return crypto(symbol, currency, debug == 1)
+    return await crypto_async(symbol, currency, debug == 1)
+
+
+@api.get("/crypto_batch")
+async def endpoint_crypto_batch(
+    symbols: str,
+    currencies: Union[str, None] = None,
+    formatted: int = 0
+):
+    log_endpoint_debug('/crypto_batch')
+    return await crypto_batch_async(symbols, currencies, formatted == 1)
+
+
+@api.get("/convert/{from_currency}/{to_currency}")
+async def endpoint_convert(
+    from_currency: str,
+    to_currency: str,
+    amount: Union[float, None] = None
+):
+    log_endpoint_debug(f'/convert/{from_currency}/{to_currency}')
+    return await convert_async(from_currency, to_currency, amount)
+
+
+@api.get("/rates_history")
+def endpoint_rates_history_pairs():
+    log_endpoint_debug('/rates_history')
+    return get_rates_history_pairs()
+
+
+@api.get("/rates_history/{pair}")
+def endpoint_rates_history(
+    pair: str,
+    as_of: Union[float, None] = None,
+    start: Union[float, None] = None,
+    end: Union[float, None] = None
+):
+    log_endpoint_debug(f'/rates_history/{pair}')
+    return get_rates_history(pair, as_of, start, end)
@@ -1,11 +1,17 @@
 # from datetime import timedelta
+import copy
+import threading
+import time
+from collections import OrderedDict
 from typing import Union
 
 from pydantic import BaseModel
 
+from chalicelib.settings import settings
 from chalicelib.utility_general import get_default_db_resultset, \
-    get_standard_base_exception_msg, log_debug
+    get_standard_base_exception_msg, log_debug, log_normal, log_warning
 from chalicelib.utility_db import db
+from chalicelib.utility_token_cache import verified_tokens
 
 
 # users_db = {
@@ -56,3 +62,378 @@ def fetch_user_by_entryname(entry_name, entry_value, fields={}):
         resultset['error'] = True
     log_debug(f'** DB ** fetch_user_by_entryname.resultset: {resultset}')
     return resultset
+
+
+def apply_projection(document, fields):
+    """
+    Applies a find() projection (e.g. {'_id': 0} or {'username': 1}) to a
+    cached document.
+    """
+    document = copy.deepcopy(document)
+    if not fields:
+        return document
+    included = [field for field, value in fields.items()
+                if value and field != '_id']
+    if included:
+        document = {
+            field: value for field, value in document.items()
+            if field in included or field == '_id'
+        }
+    for field, value in fields.items():
+        if not value:
+            document.pop(field, None)
+    return document
+
+
+# Change stream listener: max. wait for the next event (so the stop flag is
+# checked), restart backoff cap, and the run time after which a failure
+# no longer counts as consecutive (seconds)
+CHANGE_STREAM_MAX_AWAIT_MS = 1000
+CHANGE_STREAM_MAX_BACKOFF = 60
+CHANGE_STREAM_HEALTHY_SECS = 60
+
+
+class UserRepository:
+    """
+    Read-through per-process cache in front of fetch_user_by_entryname().
+    The whole user document is fetched once per 'ttl' seconds and the
+    callers' projections are applied to the cached copy, so e.g. a login
+    (hashed password check, then the user) costs a single query. Unknown
+    users are cached for 'negative_ttl' seconds. Database errors are
+    never cached.
+
+    The entries are also dropped when the users collection changes: with a
+    change stream listener if the server supports it (replica sets), or
+    else by polling the cached users every USER_CACHE_POLL_INTERVAL
+    seconds.
+    """
+
+    def __init__(self, ttl=None, negative_ttl=None, max_size=None):
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._watcher = None
+        self._watcher_stop = threading.Event()
+        self._invalidation_mode = None
+        self._stats = {'hits': 0, 'misses': 0, 'negative_hits': 0,
+                       'invalidations': 0, 'evictions': 0}
+
+    def get_ttl(self, found=True):
+        if found:
+            return self._ttl if self._ttl is not None \
+                else float(settings.USER_CACHE_TTL)
+        return self._negative_ttl if self._negative_ttl is not None \
+            else float(settings.USER_CACHE_NEGATIVE_TTL)
+
+    def get_max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return int(settings.USER_CACHE_MAX_SIZE)
+
+    def enabled(self):
+        return settings.USER_CACHE_ENABLED == "1" and self.get_max_size() > 0
+
+    def get_user_by_entryname(self, entry_name, entry_value, fields={}):
+        """
+        Same as fetch_user_by_entryname(), served from the cache.
+        """
+        if not self.enabled():
+            return fetch_user_by_entryname(entry_name, entry_value, fields)
+        key = (entry_name, entry_value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] > time.time():
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                if entry['document'] is None:
+                    self._stats['negative_hits'] += 1
+                return self.get_resultset(entry['document'], fields)
+            self._stats['misses'] += 1
+        # The whole document ('{}' would be only the '_id')
+        resultset = fetch_user_by_entryname(entry_name, entry_value, None)
+        if resultset['error']:
+            return resultset
+        self.set(key, resultset['resultset'])
+        self.start_invalidation()
+        return self.get_resultset(resultset['resultset'], fields)
+
+    @staticmethod
+    def get_resultset(document, fields):
+        resultset = get_default_db_resultset()
+        resultset['found'] = document is not None
+        if document is not None:
+            resultset['resultset'] = apply_projection(document, fields)
+        return resultset
+
+    def set(self, key, document):
+        expires_at = time.time() + self.get_ttl(document is not None)
+        with self._lock:
+            self._entries[key] = {
+                'document': copy.deepcopy(document),
+                'expires_at': expires_at,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.get_max_size():
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate(self, entry_name=None, entry_value=None, document_id=None):
+        """
+        Drops the cached entries of a user, by entry name/value (e.g.
+        'username', 'johndoe') or by the document '_id'. Returns the number
+        of dropped entries.
+        """
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items()
+                if key == (entry_name, entry_value) or (
+                    document_id is not None and
+                    entry['document'] is not None and
+                    entry['document'].get('_id') == document_id
+                )
+            ]
+            usernames = set()
+            for key in keys:
+                document = self._entries.pop(key)['document']
+                if key[0] == 'username':
+                    usernames.add(key[1])
+                if document is not None and document.get('username'):
+                    usernames.add(document['username'])
+            self._stats['invalidations'] += len(keys)
+        # The changed users' cached access tokens go too, so e.g. a user
+        # disabled in the database is rejected on the next call
+        for username in usernames:
+            verified_tokens.invalidate_user(username)
+        return len(keys)
+
+    def clear(self, tokens=False):
+        """
+        Drops every cached user, and with 'tokens' every cached access
+        token too (e.g. when some changes could have been missed).
+        """
+        with self._lock:
+            self._entries.clear()
+        if tokens:
+            verified_tokens.clear()
+
+    def on_change(self, change):
+        """
+        Handles a users collection change stream event.
+        """
+        operation_type = change.get('operationType')
+        if operation_type in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            self.clear(tokens=True)
+            return
+        full_document = change.get('fullDocument') or {}
+        document_id = change.get('documentKey', {}).get('_id')
+        if document_id is not None and \
+           not self.invalidate(document_id=document_id) and \
+           operation_type == 'delete':
+            # A deleted user that is not cached: its username is unknown,
+            # so none of the cached access tokens can be trusted
+            verified_tokens.clear()
+        if full_document.get('username'):
+            verified_tokens.invalidate_user(full_document['username'])
+        # A new (or renamed) user could be negatively cached
+        with self._lock:
+            keys = [key for key in self._entries
+                    if full_document.get(key[0]) == key[1]]
+        for entry_name, entry_value in keys:
+            self.invalidate(entry_name, entry_value)
+
+    def poll_once(self):
+        """
+        Compares the cached users with the database and drops the
+        entries that changed. Returns the number of dropped entries.
+        """
+        with self._lock:
+            cached = {
+                key: entry['document']
+                for key, entry in self._entries.items()
+            }
+        values_by_entry_name = {}
+        for entry_name, entry_value in cached:
+            values_by_entry_name.setdefault(entry_name, []).append(
+                entry_value)
+        current = {}
+        for entry_name, values in values_by_entry_name.items():
+            for document in db.users.find({entry_name: {'$in': values}}):
+                current[(entry_name, document.get(entry_name))] = document
+        dropped = 0
+        for (entry_name, entry_value), document in cached.items():
+            if current.get((entry_name, entry_value)) != document:
+                dropped += self.invalidate(entry_name, entry_value)
+        self.poll_token_users(
+            {document.get('username') for document in current.values()})
+        return dropped
+
+    def poll_token_users(self, checked_usernames):
+        """
+        Drops the cached access tokens of the users that are not cached
+        here (so poll_once() didn't check them) and were deleted or
+        disabled.
+        """
+        usernames = [username for username in verified_tokens.usernames()
+                     if username not in checked_usernames]
+        if not usernames:
+            return
+        enabled = {
+            document.get('username')
+            for document in db.users.find(
+                {'username': {'$in': usernames}},
+                projection={'username': 1, 'disabled': 1}
+            )
+            if not document.get('disabled')
+        }
+        for username in usernames:
+            if username not in enabled:
+                verified_tokens.invalidate_user(username)
+
+    def watch_changes(self):
+        """
+        Listens to the users collection change stream until
+        stop_invalidation(). try_next() waits at most
+        CHANGE_STREAM_MAX_AWAIT_MS, so the stop doesn't wait for the next
+        write.
+        """
+        with db.users.watch(
+            full_document='updateLookup',
+            max_await_time_ms=CHANGE_STREAM_MAX_AWAIT_MS,
+        ) as stream:
+            log_normal('UserRepository | change stream listener started')
+            while not self._watcher_stop.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    self.on_change(change)
+
+    def poll_changes(self):
+        log_normal('UserRepository | polling listener started')
+        while not self._watcher_stop.wait(
+            float(settings.USER_CACHE_POLL_INTERVAL)
+        ):
+            try:
+                self.poll_once()
+            except Exception as err:
+                log_warning(f'UserRepository | poll | ERROR: {err}')
+
+    def run_change_stream(self):
+        """
+        Runs the change stream listener, restarting it with an
+        exponential backoff after an error. Returns True when it's
+        stopped, or False after USER_CACHE_WATCH_RETRIES consecutive
+        failures (e.g. a standalone mongod has no change streams).
+        """
+        failures = 0
+        while not self._watcher_stop.is_set():
+            started = time.monotonic()
+            try:
+                self.watch_changes()
+                return True
+            except Exception as err:
+                # The changes while it was failing could be missed
+                self.clear(tokens=True)
+                if time.monotonic() - started > CHANGE_STREAM_HEALTHY_SECS:
+                    failures = 0
+                failures += 1
+                if failures > int(settings.USER_CACHE_WATCH_RETRIES):
+                    log_warning('UserRepository | change stream unavailable,'
+                                f' polling instead: {err}')
+                    return False
+                delay = min(2 ** (failures - 1), CHANGE_STREAM_MAX_BACKOFF)
+                log_warning(f'UserRepository | change stream ERROR: {err}.'
+                            f' Retrying in {delay} seconds')
+                if self._watcher_stop.wait(delay):
+                    return True
+        return True
+
+    def run_invalidation(self):
+        mode = settings.USER_CACHE_INVALIDATION
+        if mode in ('auto', 'change_stream'):
+            self._invalidation_mode = 'change_stream'
+            if self.run_change_stream():
+                return
+        self._invalidation_mode = 'poll'
+        self.poll_changes()
+
+    def start_invalidation(self):
+        """
+        Starts the background invalidation listener, once per process.
+        USER_CACHE_INVALIDATION: 'auto' (change stream, or polling if
+        it's not supported), 'change_stream', 'poll' or 'none'.
+        """
+        if self._watcher is not None or not settings.DB_URI or \
+           settings.USER_CACHE_INVALIDATION not in (
+               'auto', 'change_stream', 'poll'):
+            return
+        with self._lock:
+            if self._watcher is not None:
+                return
+            self._watcher_stop.clear()
+            self._watcher = threading.Thread(
+                target=self.run_invalidation,
+                name='user-cache-invalidation',
+                daemon=True,
+            )
+        self._watcher.start()
+
+    def stop_invalidation(self):
+        self._watcher_stop.set()
+        self._watcher = None
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                size=len(self._entries),
+                invalidation=self._invalidation_mode,
+            )
+
+
+users_repository = UserRepository()
+
+
+def update_user_disabled(username, disabled=True):
+    """
+    Disables (or re-enables) a user. Its cached access tokens are dropped,
+    so a disabled user is rejected on the next call.
+    """
+    resultset = get_default_db_resultset()
+    log_debug(f'** DB ** update_user_disabled: {username} {disabled}')
+    try:
+        result = db.users.update_one(
+            {'username': username},
+            {'$set': {'disabled': disabled}}
+        )
+        resultset['found'] = result.matched_count > 0
+    except BaseException as err:
+        resultset['error_message'] = get_standard_base_exception_msg(
+            err, 'UUD1'
+        )
+        resultset['error'] = True
+    users_repository.invalidate('username', username)
+    verified_tokens.invalidate_user(username)
+    return resultset
+
+
+def update_user_password_hash(username, hashed_password):
+    """
+    Replaces the stored password hash of a user, e.g. when it's rehashed
+    with the current hash parameters.
+    """
+    resultset = get_default_db_resultset()
+    log_debug(f'** DB ** update_user_password_hash: {username}')
+    try:
+        result = db.users.update_one(
+            {'username': username},
+            {'$set': {'hashed_password': hashed_password}}
+        )
+        resultset['found'] = result.matched_count > 0
+    except BaseException as err:
+        resultset['error_message'] = get_standard_base_exception_msg(
+            err, 'UUPH1'
+        )
+        resultset['error'] = True
+    users_repository.invalidate('username', username)
+    return resultset
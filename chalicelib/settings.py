@@ -16,10 +16,179 @@ class settings:
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
     DB_URI = os.environ.get('DB_URI')
     DB_NAME = os.environ.get('DB_NAME')
+    # MongoDB client pool (one client per process)
+    DB_MAX_POOL_SIZE = os.environ.get('DB_MAX_POOL_SIZE', '10')
+    DB_MIN_POOL_SIZE = os.environ.get('DB_MIN_POOL_SIZE', '0')
+    DB_MAX_IDLE_TIME_MS = os.environ.get('DB_MAX_IDLE_TIME_MS', '60000')
+    DB_SERVER_SELECTION_TIMEOUT_MS = os.environ.get(
+        'DB_SERVER_SELECTION_TIMEOUT_MS', '5000'
+    )
+    DB_CONNECT_TIMEOUT_MS = os.environ.get('DB_CONNECT_TIMEOUT_MS', '5000')
+    DB_HEARTBEAT_FREQUENCY_MS = os.environ.get(
+        'DB_HEARTBEAT_FREQUENCY_MS', '10000'
+    )
+    # Seconds between pings before using the client, "0" to disable
+    DB_HEALTH_CHECK_INTERVAL = os.environ.get('DB_HEALTH_CHECK_INTERVAL', '60')
+    # Users read-through cache (seconds), and its invalidation mode:
+    # "auto" (change stream, or polling), "change_stream", "poll" or "none"
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_ENABLED', '1')
+    USER_CACHE_TTL = os.environ.get('USER_CACHE_TTL', '60')
+    USER_CACHE_NEGATIVE_TTL = os.environ.get('USER_CACHE_NEGATIVE_TTL', '10')
+    USER_CACHE_MAX_SIZE = os.environ.get('USER_CACHE_MAX_SIZE', '1024')
+    USER_CACHE_INVALIDATION = os.environ.get(
+        'USER_CACHE_INVALIDATION', 'auto'
+    )
+    USER_CACHE_POLL_INTERVAL = os.environ.get('USER_CACHE_POLL_INTERVAL', '5')
+    USER_CACHE_WATCH_RETRIES = os.environ.get('USER_CACHE_WATCH_RETRIES', '3')
+    # Password hashing process pool ("0" workers runs it inline), max.
+    # operations in flight or queued, and seconds to wait for one
+    PASSWORD_POOL_WORKERS = os.environ.get('PASSWORD_POOL_WORKERS', '2')
+    PASSWORD_POOL_MAX_PENDING = os.environ.get(
+        'PASSWORD_POOL_MAX_PENDING', '16'
+    )
+    PASSWORD_POOL_TIMEOUT = os.environ.get('PASSWORD_POOL_TIMEOUT', '30')
+    # Password hash: "scrypt" or "pbkdf2" calibrated to take the target ms
+    # on this host, or a werkzeug method with parameters, e.g.
+    # "scrypt:32768:8:1", to skip the calibration
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_TARGET_MS = os.environ.get('PASSWORD_HASH_TARGET_MS', '100')
+    PASSWORD_SCRYPT_MAX_MEMORY_PERCENT = os.environ.get(
+        'PASSWORD_SCRYPT_MAX_MEMORY_PERCENT', '5')
     SECRET_KEY = os.environ.get('SECRET_KEY')
     ALGORITHM = os.environ.get('ALGORITHM', "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get(
         'ACCESS_TOKEN_EXPIRE_MINUTES', '30'
     )
     JWT_ENABLED = os.environ.get("JWT_ENABLED", "1")
+    # Verified access tokens cache (max. entries and seconds per token)
+    TOKEN_CACHE_ENABLED = os.environ.get("TOKEN_CACHE_ENABLED", "1")
+    TOKEN_CACHE_MAX_SIZE = os.environ.get("TOKEN_CACHE_MAX_SIZE", "1024")
+    TOKEN_CACHE_MAX_AGE = os.environ.get("TOKEN_CACHE_MAX_AGE", "300")
     AUTH0_ENABLED = os.environ.get("AUTH0_ENABLED", "0")
+    # Auth0 management token cache, refreshed these seconds before it expires
+    AUTH0_TOKEN_CACHE_ENABLED = os.environ.get(
+        "AUTH0_TOKEN_CACHE_ENABLED", "1"
+    )
+    AUTH0_TOKEN_EARLY_REFRESH = os.environ.get(
+        "AUTH0_TOKEN_EARLY_REFRESH", "300"
+    )
+    # Auth0 JWKS cache seconds, and min. seconds between re-fetches when a
+    # token has an unknown key id
+    AUTH0_JWKS_TTL = os.environ.get("AUTH0_JWKS_TTL", "3600")
+    AUTH0_JWKS_MIN_REFRESH_INTERVAL = os.environ.get(
+        "AUTH0_JWKS_MIN_REFRESH_INTERVAL", "60"
+    )
+    # Exchange rates cache (TTL and stale-while-revalidate seconds)
+    RATES_CACHE_ENABLED = os.environ.get("RATES_CACHE_ENABLED", "1")
+    RATES_CACHE_TTL_BCV = os.environ.get("RATES_CACHE_TTL_BCV", "3600")
+    RATES_CACHE_STALE_BCV = os.environ.get("RATES_CACHE_STALE_BCV", "86400")
+    RATES_CACHE_TTL_MONITOR = os.environ.get("RATES_CACHE_TTL_MONITOR", "600")
+    RATES_CACHE_STALE_MONITOR = os.environ.get(
+        "RATES_CACHE_STALE_MONITOR", "3600"
+    )
+    RATES_CACHE_TTL_COP = os.environ.get("RATES_CACHE_TTL_COP", "3600")
+    RATES_CACHE_STALE_COP = os.environ.get("RATES_CACHE_STALE_COP", "86400")
+    RATES_CACHE_TTL_CRYPTO = os.environ.get("RATES_CACHE_TTL_CRYPTO", "60")
+    RATES_CACHE_STALE_CRYPTO = os.environ.get(
+        "RATES_CACHE_STALE_CRYPTO", "300"
+    )
+    # Shared HTTP transport (connection pools and timeouts)
+    HTTP_CONNECT_TIMEOUT = os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05")
+    HTTP_READ_TIMEOUT = os.environ.get("HTTP_READ_TIMEOUT", "30")
+    HTTP_POOL_CONNECTIONS = os.environ.get("HTTP_POOL_CONNECTIONS", "10")
+    HTTP_POOL_MAXSIZE = os.environ.get("HTTP_POOL_MAXSIZE", "10")
+    HTTP_POOL_SIZES = os.environ.get("HTTP_POOL_SIZES", "")
+    HTTP_ASYNC_MAX_CONNECTIONS = os.environ.get(
+        "HTTP_ASYNC_MAX_CONNECTIONS", "100"
+    )
+    OPENAI_READ_TIMEOUT = os.environ.get("OPENAI_READ_TIMEOUT", "120")
+    # OpenAI exact-match response cache (max. entries and seconds)
+    AI_CACHE_ENABLED = os.environ.get("AI_CACHE_ENABLED", "1")
+    AI_CACHE_MAX_SIZE = os.environ.get("AI_CACHE_MAX_SIZE", "256")
+    AI_CACHE_TTL = os.environ.get("AI_CACHE_TTL", "86400")
+    # /ai/batch: max. items per request and concurrent OpenAI calls
+    AI_BATCH_MAX_ITEMS = os.environ.get("AI_BATCH_MAX_ITEMS", "500")
+    AI_BATCH_CONCURRENCY = os.environ.get("AI_BATCH_CONCURRENCY", "8")
+    # OpenAI client-side rate limiter (requests and tokens per minute, by
+    # default learned from the x-ratelimit-* headers) and retries
+    OPENAI_RATE_LIMIT_ENABLED = os.environ.get(
+        "OPENAI_RATE_LIMIT_ENABLED", "1"
+    )
+    OPENAI_RPM = os.environ.get("OPENAI_RPM", "")
+    OPENAI_TPM = os.environ.get("OPENAI_TPM", "")
+    OPENAI_RATE_LIMIT_MAX_WAIT = os.environ.get(
+        "OPENAI_RATE_LIMIT_MAX_WAIT", "30"
+    )
+    OPENAI_MAX_RETRIES = os.environ.get("OPENAI_MAX_RETRIES", "3")
+    OPENAI_RETRY_BASE_DELAY = os.environ.get("OPENAI_RETRY_BASE_DELAY", "0.5")
+    OPENAI_RETRY_MAX_DELAY = os.environ.get("OPENAI_RETRY_MAX_DELAY", "20")
+    # OpenAI prompt pre-flight ("trim", "reject" or "0") and context limits
+    OPENAI_PROMPT_PREFLIGHT = os.environ.get(
+        "OPENAI_PROMPT_PREFLIGHT", "trim"
+    )
+    OPENAI_CONTEXT_LIMITS = os.environ.get("OPENAI_CONTEXT_LIMITS", "")
+    OPENAI_DEFAULT_CONTEXT_LIMIT = os.environ.get(
+        "OPENAI_DEFAULT_CONTEXT_LIMIT", "8192"
+    )
+    # OpenAI tokens usage totals by user and model
+    AI_USAGE_ENABLED = os.environ.get("AI_USAGE_ENABLED", "1")
+    AI_USAGE_MAX_ENTRIES = os.environ.get("AI_USAGE_MAX_ENTRIES", "10000")
+    AI_USAGE_ADMINS = os.environ.get("AI_USAGE_ADMINS", "")
+    # Concurrent fan-out for the composite rate endpoints
+    RATES_FANOUT_ENABLED = os.environ.get("RATES_FANOUT_ENABLED", "1")
+    RATES_FANOUT_WORKERS = os.environ.get("RATES_FANOUT_WORKERS", "8")
+    # Lambda warmup events
+    WARMUP_PRIME_RATES = os.environ.get("WARMUP_PRIME_RATES", "1")
+    # Number of containers to keep warm, each warmup event fans out to
+    # WARMUP_CONCURRENCY - 1 extra concurrent invocations
+    WARMUP_CONCURRENCY = os.environ.get("WARMUP_CONCURRENCY", "1")
+    WARMUP_FANOUT_DELAY = os.environ.get("WARMUP_FANOUT_DELAY", "0.5")
+    # Per-provider circuit breakers
+    CIRCUIT_BREAKER_ENABLED = os.environ.get("CIRCUIT_BREAKER_ENABLED", "1")
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = os.environ.get(
+        "CIRCUIT_BREAKER_FAILURE_THRESHOLD", "3"
+    )
+    CIRCUIT_BREAKER_RESET_TIMEOUT = os.environ.get(
+        "CIRCUIT_BREAKER_RESET_TIMEOUT", "30"
+    )
+    # Crypto batch endpoint limits
+    CRYPTO_BATCH_MAX_SYMBOLS = os.environ.get("CRYPTO_BATCH_MAX_SYMBOLS", "50")
+    CRYPTO_BATCH_MAX_CURRENCIES = os.environ.get(
+        "CRYPTO_BATCH_MAX_CURRENCIES", "20"
+    )
+    # Cross-rate graph crypto nodes (USD prices)
+    RATE_GRAPH_CRYPTO_SYMBOLS = os.environ.get(
+        "RATE_GRAPH_CRYPTO_SYMBOLS", "BTC,ETH,USDT,SOL,BNB"
+    )
+    # Exchange rates history store
+    RATES_HISTORY_ENABLED = os.environ.get("RATES_HISTORY_ENABLED", "1")
+    RATES_HISTORY_DIR = os.environ.get(
+        "RATES_HISTORY_DIR", "/tmp/mediabros_apis/rates_history"
+    )
+    RATES_HISTORY_MIN_INTERVAL = os.environ.get(
+        "RATES_HISTORY_MIN_INTERVAL", "60"
+    )
+    # Background rates refresher (FastAPI long-running servers only)
+    RATES_REFRESHER_ENABLED = os.environ.get("RATES_REFRESHER_ENABLED", "0")
+    RATES_REFRESHER_CRYPTO_PAIRS = os.environ.get(
+        "RATES_REFRESHER_CRYPTO_PAIRS", "BTC-USD,ETH-USD"
+    )
+    RATES_REFRESHER_TTL_RATIO = os.environ.get(
+        "RATES_REFRESHER_TTL_RATIO", "0.8"
+    )
+    RATES_REFRESHER_JITTER = os.environ.get("RATES_REFRESHER_JITTER", "0.1")
+    RATES_REFRESHER_BACKOFF_BASE = os.environ.get(
+        "RATES_REFRESHER_BACKOFF_BASE", "5"
+    )
+    RATES_REFRESHER_INTERVAL_BCV = os.environ.get(
+        "RATES_REFRESHER_INTERVAL_BCV", ""
+    )
+    RATES_REFRESHER_INTERVAL_MONITOR = os.environ.get(
+        "RATES_REFRESHER_INTERVAL_MONITOR", ""
+    )
+    RATES_REFRESHER_INTERVAL_COP = os.environ.get(
+        "RATES_REFRESHER_INTERVAL_COP", ""
+    )
+    RATES_REFRESHER_INTERVAL_CRYPTO = os.environ.get(
+        "RATES_REFRESHER_INTERVAL_CRYPTO", ""
+    )
@@ -0,0 +1,124 @@
+# utility_ai_cache.py
+# Exact-match cache of the OpenAI chat completions responses
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from chalicelib.settings import settings
+
+
+def normalize_messages(messages):
+    """
+    Returns the chat messages with only the fields sent to OpenAI and the
+    content whitespace collapsed, so trivially different repeats of the
+    same question share a cache entry.
+    """
+    return [
+        {
+            'role': message.get('role'),
+            'content': ' '.join(str(message.get('content', '')).split()),
+        }
+        for message in messages
+    ]
+
+
+def get_ai_cache_key(model, messages, temperature, max_tokens):
+    key_data = json.dumps(
+        {
+            'model': model,
+            'messages': normalize_messages(messages),
+            'temperature': float(temperature),
+            'max_tokens': None if max_tokens is None else int(max_tokens),
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+def is_cacheable(temperature, cache_param=None):
+    """
+    Only deterministic requests (temperature 0) are cached, unless the
+    caller opts in ("1") or out ("0") with the 'cache' parameter.
+    """
+    if settings.AI_CACHE_ENABLED != "1":
+        return False
+    if cache_param is not None and str(cache_param) in ('0', '1'):
+        return str(cache_param) == '1'
+    try:
+        return float(temperature) == 0
+    except (TypeError, ValueError):
+        return False
+
+
+class AiResponseCache:
+    """
+    LRU cache with TTL of the OpenAI responses, keyed by
+    get_ai_cache_key().
+    """
+
+    def __init__(self, max_size=None, ttl=None):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                       'saved_tokens': 0}
+
+    def get_max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return int(settings.AI_CACHE_MAX_SIZE)
+
+    def get_ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return float(settings.AI_CACHE_TTL)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires_at'] <= time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            self._stats['saved_tokens'] += \
+                entry['value'].get('usage', {}).get('total_tokens', 0)
+            return json.loads(entry['json'])
+
+    def set(self, key, value):
+        if self.get_max_size() <= 0:
+            return
+        with self._lock:
+            self._entries[key] = {
+                # Serialized, so no caller can change the cached copy
+                'json': json.dumps(value),
+                'value': {'usage': value.get('usage') or {}},
+                'expires_at': time.time() + self.get_ttl(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.get_max_size():
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return dict(
+                self._stats,
+                size=len(self._entries),
+                hit_ratio=round(self._stats['hits'] / lookups, 4)
+                if lookups else None,
+            )
+
+
+ai_response_cache = AiResponseCache()
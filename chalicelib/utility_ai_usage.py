@@ -0,0 +1,110 @@
+# utility_ai_usage.py
+# Per-user and per-model totals of the OpenAI tokens usage
+import threading
+import time
+
+from chalicelib.settings import settings
+
+
+USAGE_FIELDS = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+ANONYMOUS_USER = 'anonymous'
+# The users past AI_USAGE_MAX_ENTRIES (user, model) pairs are added up here
+OTHER_USERS = '*'
+
+
+class AiUsageForbidden(Exception):
+    """
+    Raised when a user that is not in AI_USAGE_ADMINS asks for the usage
+    totals of another user.
+    """
+
+
+class AiUsageMeter:
+    """
+    Totals of the OpenAI responses 'usage' (prompt, completion and total
+    tokens), the requests and the cached answers, by user and model, since
+    the process start. At most 'max_entries' (user, model) pairs are kept
+    apart; the next users are added up as OTHER_USERS.
+    """
+
+    def __init__(self, max_entries=None):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._since = time.time()
+
+    def get_max_entries(self):
+        if self._max_entries is not None:
+            return self._max_entries
+        return int(settings.AI_USAGE_MAX_ENTRIES)
+
+    def record(self, user, model, usage=None, cached=False):
+        """
+        Adds an OpenAI response 'usage' dict, or a 'cached' answer (which
+        used no tokens), to the totals of 'user' and 'model'.
+        """
+        if settings.AI_USAGE_ENABLED != "1":
+            return
+        key = (user or ANONYMOUS_USER, model)
+        with self._lock:
+            if key not in self._totals and \
+               len(self._totals) >= self.get_max_entries():
+                key = (OTHER_USERS, model)
+            totals = self._totals.setdefault(key, dict(
+                {field: 0 for field in USAGE_FIELDS},
+                requests=0, cached_requests=0,
+            ))
+            if cached:
+                totals['cached_requests'] += 1
+                return
+            totals['requests'] += 1
+            for field in USAGE_FIELDS:
+                try:
+                    totals[field] += int((usage or {}).get(field) or 0)
+                except (TypeError, ValueError):
+                    pass
+
+    def get_totals(self, user=None, model=None):
+        """
+        Returns the {user: {model: totals}} usage, optionally only of
+        'user' and/or 'model', and the sum of them in 'totals'.
+        """
+        users = {}
+        with self._lock:
+            for (entry_user, entry_model), totals in self._totals.items():
+                if user is not None and entry_user != user or \
+                   model is not None and entry_model != model:
+                    continue
+                users.setdefault(entry_user, {})[entry_model] = dict(totals)
+        all_totals = {}
+        for models in users.values():
+            for totals in models.values():
+                for field, value in totals.items():
+                    all_totals[field] = all_totals.get(field, 0) + value
+        return {'users': users, 'totals': all_totals, 'since': self._since}
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+            self._since = time.time()
+
+
+ai_usage = AiUsageMeter()
+
+
+def is_usage_admin(username):
+    admins = [admin.strip() for admin in settings.AI_USAGE_ADMINS.split(',')]
+    return bool(username) and username in admins
+
+
+def get_usage_user(username, user=None):
+    """
+    Returns the 'user' filter of the usage totals that the authenticated
+    'username' can read. AI_USAGE_ADMINS can read any user, or all of them
+    with None. Everyone else can only read their own totals.
+    """
+    if is_usage_admin(username):
+        return user
+    if user is not None and user != username:
+        raise AiUsageForbidden('Not allowed to read the usage of other users')
+    return username or ANONYMOUS_USER
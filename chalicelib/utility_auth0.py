@@ -0,0 +1,171 @@
+# utility_auth0.py
+# Auth0 API calls: keep-alive connection and management token cache
+import http.client
+import json
+import os
+import threading
+import time
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_debug, log_warning
+
+
+class KeepAliveConnection:
+    """
+    One keep-alive HTTPS connection per process, re-opened when the host
+    changes, after a fork or when the server closes it. The calls are
+    serialized, as an http.client connection holds a single request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._host = None
+        self._pid = None
+        self._stats = {'requests': 0, 'connections': 0}
+
+    def get_connection(self, host):
+        """
+        Returns the (connection, reused) pair. Must be called with the
+        lock held.
+        """
+        if self._conn is not None and self._host == host and \
+           self._pid == os.getpid():
+            return self._conn, True
+        self.close_connection()
+        self._conn = http.client.HTTPSConnection(host)
+        # connect() and the socket reads use it
+        self._conn.timeout = float(settings.HTTP_READ_TIMEOUT)
+        self._host = host
+        self._pid = os.getpid()
+        self._stats['connections'] += 1
+        return self._conn, False
+
+    def close_connection(self):
+        if self._conn is not None and self._pid == os.getpid():
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def request(self, host, method, url, body=None, headers={}):
+        """
+        Sends the request and returns the (status, response body bytes).
+        A request that fails on a reused connection (the server could have
+        dropped it while idle) is retried once on a new one.
+        """
+        with self._lock:
+            self._stats['requests'] += 1
+            while True:
+                conn, reused = self.get_connection(host)
+                try:
+                    conn.request(method, url, body, headers)
+                    res = conn.getresponse()
+                    data = res.read()
+                except (http.client.HTTPException, OSError) as err:
+                    self.close_connection()
+                    if reused:
+                        log_debug(f'KeepAliveConnection | {host} | {err},'
+                                  ' retrying on a new connection')
+                        continue
+                    raise
+                if res.will_close is True:
+                    self.close_connection()
+                return res.status, data
+
+    def reset(self):
+        with self._lock:
+            self.close_connection()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+auth0_connection = KeepAliveConnection()
+
+
+def get_token(response):
+    """
+    Returns the token dict of an Auth0 /oauth/token response body, or None
+    if it's not a token (e.g. an error).
+    """
+    try:
+        token = json.loads(response)
+        float(token['expires_in'])
+    except (ValueError, KeyError, TypeError):
+        return None
+    return token if token.get('access_token') else None
+
+
+class ManagementTokenCache:
+    """
+    Auth0 client_credentials token responses, kept until 'expires_in'.
+    A token is refreshed AUTH0_TOKEN_EARLY_REFRESH seconds (at most half
+    its lifetime) before it expires; if the refresh fails, the still valid
+    token is served.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+        self._stats = {'hits': 0, 'fetches': 0}
+
+    def get(self, key, fetcher):
+        """
+        Returns the token response dict of 'key'. 'fetcher()' returns the
+        Auth0 /oauth/token response body. If it's not a token (an error),
+        it's returned as a str and not cached.
+        """
+        if settings.AUTH0_TOKEN_CACHE_ENABLED != "1":
+            return fetcher()
+        with self._lock:
+            now = time.time()
+            entry = self._tokens.get(key)
+            if entry is not None and now < entry['refresh_at']:
+                self._stats['hits'] += 1
+                return self.get_response(entry, now)
+            try:
+                response = fetcher()
+                token = get_token(response)
+            except Exception as err:
+                if entry is not None and now < entry['expires_at']:
+                    log_warning('ManagementTokenCache | refresh failed,'
+                                f' serving the current token: {err}')
+                    return self.get_response(entry, now)
+                raise
+            if token is None:
+                if entry is not None and now < entry['expires_at']:
+                    log_warning('ManagementTokenCache | refresh error,'
+                                f' serving the current token: {response}')
+                    return self.get_response(entry, now)
+                return response
+            expires_in = float(token['expires_in'])
+            self._stats['fetches'] += 1
+            early_refresh = min(
+                float(settings.AUTH0_TOKEN_EARLY_REFRESH), expires_in / 2)
+            entry = self._tokens[key] = {
+                'token': token,
+                'expires_at': now + expires_in,
+                'refresh_at': now + expires_in - early_refresh,
+            }
+            return self.get_response(entry, now)
+
+    @staticmethod
+    def get_response(entry, now):
+        return dict(
+            entry['token'],
+            expires_in=max(int(entry['expires_at'] - now), 0),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, tokens=len(self._tokens))
+
+
+management_tokens = ManagementTokenCache()
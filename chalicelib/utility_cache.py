@@ -0,0 +1,288 @@
+# utility_cache.py
+# Process-wide TTL cache with stale-while-revalidate for the rate fetchers
+import asyncio
+import inspect
+import threading
+import time
+from functools import wraps
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_debug, log_warning
+from chalicelib.utility_singleflight import rates_flight
+from chalicelib.utility_circuit_breaker import rates_breakers
+from chalicelib.utility_rate_graph import rate_graph
+
+
+def get_provider_ttls():
+    """
+    Returns the (ttl, stale_ttl) seconds for each exchange rate provider.
+    'ttl' is the fresh lifetime of an entry, 'stale_ttl' is the extra time
+    an expired entry can still be served while it's being refreshed.
+    """
+    return {
+        'bcv': (
+            float(settings.RATES_CACHE_TTL_BCV),
+            float(settings.RATES_CACHE_STALE_BCV),
+        ),
+        'monitor': (
+            float(settings.RATES_CACHE_TTL_MONITOR),
+            float(settings.RATES_CACHE_STALE_MONITOR),
+        ),
+        'cop': (
+            float(settings.RATES_CACHE_TTL_COP),
+            float(settings.RATES_CACHE_STALE_COP),
+        ),
+        'crypto': (
+            float(settings.RATES_CACHE_TTL_CRYPTO),
+            float(settings.RATES_CACHE_STALE_CRYPTO),
+        ),
+    }
+
+
+class TtlCache:
+    """
+    Thread safe TTL cache. Entries are served fresh until 'ttl', then
+    served stale until 'ttl + stale_ttl' while a single background thread
+    refreshes them. Error responses (api_response['error']) and circuit
+    breaker fallbacks (api_response['last_known_good']) are never cached.
+    """
+
+    def __init__(self, provider_ttls=None):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refreshing = set()
+        self._stats = {}
+        self._provider_ttls = provider_ttls
+        # Strong references to the background refresh tasks
+        self._tasks = set()
+
+    def get_ttls(self, provider):
+        provider_ttls = self._provider_ttls
+        if provider_ttls is None:
+            provider_ttls = get_provider_ttls()
+        return provider_ttls.get(provider, (0, 0))
+
+    def _count(self, provider, counter):
+        provider_stats = self._stats.setdefault(provider, {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        })
+        provider_stats[counter] += 1
+
+    def get_entry(self, key):
+        with self._lock:
+            return self._entries.get(key)
+
+    def set(self, key, provider, value):
+        if value.get('error') or value.get('last_known_good'):
+            return
+        with self._lock:
+            self._entries[key] = {
+                'provider': provider,
+                'value': value,
+                'timestamp': time.time(),
+            }
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def lookup(self, key, provider):
+        """
+        Returns a tuple (value, state), where state is 'fresh', 'stale'
+        or 'miss'. The hit/miss counters are updated here.
+        """
+        ttl, stale_ttl = self.get_ttls(provider)
+        with self._lock:
+            entry = self._entries.get(key)
+            age = None if entry is None else time.time() - entry['timestamp']
+            if entry is not None and age < ttl:
+                self._count(provider, 'hits')
+                return entry['value'], 'fresh'
+            if entry is not None and age < ttl + stale_ttl:
+                self._count(provider, 'stale_hits')
+                return entry['value'], 'stale'
+            self._count(provider, 'misses')
+            return None, 'miss'
+
+    def claim_refresh(self, key):
+        """
+        Returns True if the caller must run the refresh for 'key',
+        False when another refresh for the same key is already running.
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def refresh(self, key, provider, fetcher):
+        """
+        Runs the fetcher and stores its value. The caller must own the
+        refresh claim. Returns the fetched value, or None on exception.
+        """
+        value = None
+        try:
+            value = fetcher()
+            with self._lock:
+                self._count(provider, 'refreshes')
+                if value.get('error'):
+                    self._count(provider, 'refresh_errors')
+            self.set(key, provider, value)
+        except Exception as err:
+            with self._lock:
+                self._count(provider, 'refresh_errors')
+            log_warning(f'TtlCache.refresh | {key} | ERROR: {err}')
+        finally:
+            self.release_refresh(key)
+        return value
+
+    def get_or_fetch(self, key, provider, fetcher):
+        value, state = self.lookup(key, provider)
+        if state == 'fresh':
+            return dict(value)
+        if state == 'stale':
+            if self.claim_refresh(key):
+                log_debug(f'TtlCache | background refresh: {key}')
+                threading.Thread(
+                    target=self.refresh,
+                    args=(key, provider, fetcher),
+                    daemon=True,
+                ).start()
+            return dict(value)
+        value = fetcher()
+        self.set(key, provider, value)
+        return value
+
+    async def refresh_async(self, key, provider, coro_func):
+        value = None
+        try:
+            value = await coro_func()
+            with self._lock:
+                self._count(provider, 'refreshes')
+                if value.get('error'):
+                    self._count(provider, 'refresh_errors')
+            self.set(key, provider, value)
+        except Exception as err:
+            with self._lock:
+                self._count(provider, 'refresh_errors')
+            log_warning(f'TtlCache.refresh_async | {key} | ERROR: {err}')
+        finally:
+            self.release_refresh(key)
+        return value
+
+    async def get_or_fetch_async(self, key, provider, coro_func):
+        """
+        asyncio version of get_or_fetch(). The stale entry refresh runs
+        as a task in the running event loop instead of a thread.
+        """
+        value, state = self.lookup(key, provider)
+        if state == 'fresh':
+            return dict(value)
+        if state == 'stale':
+            if self.claim_refresh(key):
+                log_debug(f'TtlCache | background async refresh: {key}')
+                task = asyncio.get_running_loop().create_task(
+                    self.refresh_async(key, provider, coro_func)
+                )
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return dict(value)
+        value = await coro_func()
+        self.set(key, provider, value)
+        return value
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                'providers': {
+                    provider: dict(provider_stats)
+                    for provider, provider_stats in self._stats.items()
+                },
+                'entries': {
+                    key: {
+                        'provider': entry['provider'],
+                        'age': round(now - entry['timestamp'], 3),
+                        'ttl': self.get_ttls(entry['provider'])[0],
+                    }
+                    for key, entry in self._entries.items()
+                },
+            }
+
+
+rates_cache = TtlCache()
+
+
+def get_cache_key(provider, *args):
+    return ':'.join([provider] + [str(arg).upper() for arg in args])
+
+
+def cached_rates(provider, name=None):
+    """
+    Decorator to put a rates fetcher behind the process-wide rates cache.
+    The decorated function arguments are part of the cache key, so a
+    plain fetcher and its 'async def' variant share the same entries.
+    'name' separates fetchers of the same provider with different
+    payloads. The original function is available as 'func.uncached'.
+    """
+    key_prefix = provider if name is None else f'{provider}:{name}'
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args):
+                if settings.RATES_CACHE_ENABLED != "1":
+                    return await func(*args)
+                return await rates_cache.get_or_fetch_async(
+                    get_cache_key(key_prefix, *args),
+                    provider,
+                    lambda: func(*args),
+                )
+            async_wrapper.uncached = func
+            async_wrapper.key_prefix = key_prefix
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args):
+            if settings.RATES_CACHE_ENABLED != "1":
+                return func(*args)
+            return rates_cache.get_or_fetch(
+                get_cache_key(key_prefix, *args),
+                provider,
+                lambda: func(*args),
+            )
+        wrapper.uncached = func
+        wrapper.key_prefix = key_prefix
+        return wrapper
+    return decorator
+
+
+def refresh_cached_rates(provider, func, *args):
+    """
+    Refreshes the cache entry of a 'cached_rates' decorated fetcher ahead
+    of its expiry. Returns the fetched api_response, or None if another
+    refresh of the same entry is already running or the fetch raised.
+    """
+    key = get_cache_key(func.key_prefix, *args)
+    if not rates_cache.claim_refresh(key):
+        return None
+    return rates_cache.refresh(key, provider, lambda: func.uncached(*args))
+
+
+def get_cache_stats():
+    cache_stats = rates_cache.stats()
+    cache_stats['single_flight'] = rates_flight.stats()
+    cache_stats['circuit_breakers'] = rates_breakers.stats()
+    cache_stats['rate_graph'] = rate_graph.stats()
+    return cache_stats
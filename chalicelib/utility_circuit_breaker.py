@@ -0,0 +1,252 @@
+# utility_circuit_breaker.py
+# Per-provider circuit breakers with last-known-good fallback
+import inspect
+import threading
+import time
+from functools import wraps
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import (
+    get_api_standard_response, log_normal, log_warning)
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_upstream_failure(api_response):
+    return bool(api_response.get('error'))
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open circuit breaker for one upstream provider.
+
+    After 'failure_threshold' consecutive failures the circuit opens and
+    the calls fail fast for 'reset_timeout' seconds, serving the last
+    successful api_response of the same key if there's one. Then a single
+    trial call is let through (half-open): success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, provider, failure_threshold=None, reset_timeout=None):
+        self.provider = provider
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._last_good = {}
+        self._stats = {'calls': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def get_failure_threshold(self):
+        if self._failure_threshold is not None:
+            return self._failure_threshold
+        return int(settings.CIRCUIT_BREAKER_FAILURE_THRESHOLD)
+
+    def get_reset_timeout(self):
+        if self._reset_timeout is not None:
+            return self._reset_timeout
+        return float(settings.CIRCUIT_BREAKER_RESET_TIMEOUT)
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def allow_call(self):
+        """
+        Returns True if the upstream can be called now. In the half-open
+        state only one trial call is allowed at a time.
+        """
+        with self._lock:
+            if self._state == OPEN and \
+               time.time() - self._opened_at >= self.get_reset_timeout():
+                self._state = HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == CLOSED:
+                self._stats['calls'] += 1
+                return True
+            if self._state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                self._stats['calls'] += 1
+                return True
+            self._stats['rejected'] += 1
+            return False
+
+    def record_success(self, key=None, api_response=None):
+        """
+        Closes the circuit. 'api_response' becomes the last-known-good
+        payload of 'key'; it's None when the upstream answered but the
+        request itself was wrong.
+        """
+        with self._lock:
+            if api_response is not None:
+                self._last_good[key] = (api_response, time.time())
+            if self._state != CLOSED:
+                log_normal(f'CircuitBreaker | {self.provider} | closed')
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats['failures'] += 1
+            self._failures += 1
+            if self._state == HALF_OPEN or \
+               self._failures >= self.get_failure_threshold():
+                if self._state != OPEN:
+                    self._stats['opened'] += 1
+                    log_warning(f'CircuitBreaker | {self.provider} | open')
+                self._state = OPEN
+                self._opened_at = time.time()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Frees the half-open trial slot of a call that was cancelled.
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def get_fallback(self, key):
+        """
+        Returns a copy of the last successful api_response for 'key',
+        marked with its age, or an error api_response if there's none.
+        """
+        with self._lock:
+            last_good = self._last_good.get(key)
+            state = self._state
+        if last_good is None:
+            api_response = get_api_standard_response()
+            api_response['error'] = True
+            api_response['error_message'] = \
+                f'ERROR: {self.provider} is temporarily unavailable'
+        else:
+            value, timestamp = last_good
+            api_response = dict(value)
+            api_response['last_known_good'] = {
+                'timestamp': timestamp,
+                'age': round(time.time() - timestamp, 3),
+            }
+        api_response['circuit_breaker'] = state
+        return api_response
+
+    def reset(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+            self._last_good.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                state=self._state,
+                consecutive_failures=self._failures,
+                last_known_good_keys=len(self._last_good),
+            )
+
+
+class CircuitBreakers:
+    """
+    Registry of the per-provider circuit breakers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+
+    def get(self, provider):
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = self._breakers[provider] = CircuitBreaker(provider)
+            return breaker
+
+    def reset(self):
+        with self._lock:
+            for breaker in self._breakers.values():
+                breaker.reset()
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            provider: breaker.stats()
+            for provider, breaker in breakers.items()
+        }
+
+
+rates_breakers = CircuitBreakers()
+
+
+def get_breaker_key(key_prefix, *args):
+    return ':'.join([key_prefix] + [str(arg).upper() for arg in args])
+
+
+def circuit_breaker(provider, name=None, is_failure=is_upstream_failure):
+    """
+    Decorator to put a rates fetcher behind its provider circuit breaker.
+    'is_failure(api_response)' tells upstream failures apart from errors
+    caused by the request itself (e.g. an unknown crypto symbol), which
+    must not open the circuit. Works for plain and 'async def' fetchers.
+    """
+    key_prefix = provider if name is None else f'{provider}:{name}'
+
+    def record(breaker, key, api_response):
+        if is_failure(api_response):
+            breaker.record_failure()
+        elif api_response.get('error'):
+            # The upstream answered, so it's up even if the request failed
+            breaker.record_success()
+        else:
+            breaker.record_success(key, api_response)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args):
+                if settings.CIRCUIT_BREAKER_ENABLED != "1":
+                    return await func(*args)
+                breaker = rates_breakers.get(provider)
+                key = get_breaker_key(key_prefix, *args)
+                if not breaker.allow_call():
+                    return breaker.get_fallback(key)
+                try:
+                    api_response = await func(*args)
+                except Exception:
+                    breaker.record_failure()
+                    raise
+                except BaseException:
+                    breaker.release_trial()
+                    raise
+                record(breaker, key, api_response)
+                return api_response
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args):
+            if settings.CIRCUIT_BREAKER_ENABLED != "1":
+                return func(*args)
+            breaker = rates_breakers.get(provider)
+            key = get_breaker_key(key_prefix, *args)
+            if not breaker.allow_call():
+                return breaker.get_fallback(key)
+            try:
+                api_response = func(*args)
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release_trial()
+                raise
+            record(breaker, key, api_response)
+            return api_response
+        return wrapper
+    return decorator
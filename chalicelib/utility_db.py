@@ -1,24 +1,110 @@
+import os
+import threading
+import time
+
 from bson.json_util import dumps
 
 from pymongo import MongoClient
 from werkzeug.local import LocalProxy
 
 from chalicelib.settings import settings
+from chalicelib.utility_general import log_normal, log_warning
 
 
 # ----------------------- Db General -----------------------
 
 
+_client = None
+_client_pid = None
+_client_checked_at = 0.0
+_client_lock = threading.Lock()
+
+
+def new_client():
+    return MongoClient(
+        settings.DB_URI,
+        maxPoolSize=int(settings.DB_MAX_POOL_SIZE),
+        minPoolSize=int(settings.DB_MIN_POOL_SIZE),
+        maxIdleTimeMS=int(settings.DB_MAX_IDLE_TIME_MS),
+        serverSelectionTimeoutMS=int(settings.DB_SERVER_SELECTION_TIMEOUT_MS),
+        connectTimeoutMS=int(settings.DB_CONNECT_TIMEOUT_MS),
+        heartbeatFrequencyMS=int(settings.DB_HEARTBEAT_FREQUENCY_MS),
+        connect=False,
+    )
+
+
+def reset_client(close=True):
+    """
+    Drops the process client, so the next get_client() creates a new one.
+    """
+    global _client, _client_pid, _client_checked_at
+    with _client_lock:
+        client = _client
+        _client = None
+        _client_pid = None
+        _client_checked_at = 0.0
+    if close and client is not None:
+        client.close()
+
+
+def is_client_healthy(client):
+    try:
+        client.admin.command('ping')
+    except Exception as err:
+        log_warning(f'utility_db | health check ERROR: {err}')
+        return False
+    return True
+
+
+def get_client():
+    """
+    Returns the process-wide MongoClient, created on first use and kept
+    across warm lambda invocations. A new client is created after a
+    fork, and when a health check (at most every
+    DB_HEALTH_CHECK_INTERVAL seconds) fails.
+    """
+    global _client, _client_pid, _client_checked_at
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = new_client()
+            _client_pid = os.getpid()
+            _client_checked_at = time.monotonic()
+            log_normal(f'utility_db | new MongoClient (pid {_client_pid})')
+            return _client
+        client = _client
+        interval = float(settings.DB_HEALTH_CHECK_INTERVAL)
+        check_health = interval > 0 and \
+            time.monotonic() - _client_checked_at >= interval
+        if check_health:
+            _client_checked_at = time.monotonic()
+    if check_health and not is_client_healthy(client):
+        reset_client()
+        return get_client()
+    return client
+
+
 # Este método se encarga de configurar la conexión con la base de datos
 def get_db():
-    client = MongoClient(settings.DB_URI)
-    return client.get_database(settings.DB_NAME)
+    return get_client().get_database(settings.DB_NAME)
 
 
 # Use LocalProxy to read the global db instance with just `db`
 db = LocalProxy(get_db)
 
 
+def _reset_client_after_fork():
+    # The lock could have been held by another parent thread at fork time
+    global _client, _client_pid, _client_checked_at, _client_lock
+    _client_lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _client_checked_at = 0.0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+
 def test_connection():
     return dumps(db.list_collection_names())
 
@@ -0,0 +1,175 @@
+# utility_http.py
+# Shared pooled HTTP transport for every outbound call
+import asyncio
+import threading
+import weakref
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from chalicelib.settings import settings
+from chalicelib.utility_lazy_import import LazyModule
+
+
+# Only the FastAPI app uses httpx, keep it out of the Lambda cold start
+httpx = LazyModule('httpx')
+
+_session = None
+_session_lock = threading.Lock()
+# httpx.AsyncClient connection pools are bound to their event loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_timeout(read_timeout=None):
+    """
+    Returns the (connect, read) timeout tuple used by requests.
+    """
+    return (
+        float(settings.HTTP_CONNECT_TIMEOUT),
+        float(read_timeout or settings.HTTP_READ_TIMEOUT),
+    )
+
+
+def get_host_pool_sizes():
+    """
+    Parses the HTTP_POOL_SIZES envvar, e.g.
+    "api.openai.com=20,min-api.cryptocompare.com=10"
+    """
+    pool_sizes = {}
+    for item in settings.HTTP_POOL_SIZES.split(','):
+        if '=' not in item:
+            continue
+        host, size = item.split('=', 1)
+        pool_sizes[host.strip()] = int(size)
+    return pool_sizes
+
+
+def get_adapter(pool_maxsize):
+    return HTTPAdapter(
+        pool_connections=int(settings.HTTP_POOL_CONNECTIONS),
+        pool_maxsize=pool_maxsize,
+        pool_block=False,
+    )
+
+
+def new_session():
+    session = requests.Session()
+    session.headers.update({
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+    default_adapter = get_adapter(int(settings.HTTP_POOL_MAXSIZE))
+    session.mount('https://', default_adapter)
+    session.mount('http://', default_adapter)
+    for host, size in get_host_pool_sizes().items():
+        # Longest prefix wins, so the host adapter overrides the default one
+        session.mount(f'https://{host}', get_adapter(size))
+    return session
+
+
+def get_session():
+    """
+    Returns the process-wide keep-alive session, created on first use so
+    warm Lambda containers reuse the same TCP+TLS connections.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = new_session()
+    return _session
+
+
+def reset_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def http_get(url, read_timeout=None, **kwargs):
+    kwargs.setdefault('timeout', get_timeout(read_timeout))
+    return get_session().get(url, **kwargs)
+
+
+def http_post(url, read_timeout=None, **kwargs):
+    kwargs.setdefault('timeout', get_timeout(read_timeout))
+    return get_session().post(url, **kwargs)
+
+
+@contextmanager
+def http_post_stream(url, read_timeout=None, **kwargs):
+    """
+    POST whose response body is read as it arrives (e.g. server-sent
+    events), released back to the pool on exit.
+    """
+    kwargs.setdefault('timeout', get_timeout(read_timeout))
+    response = get_session().post(url, stream=True, **kwargs)
+    try:
+        yield response
+    finally:
+        response.close()
+
+
+# Async transport (httpx) for the FastAPI app
+
+
+def new_async_client():
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(
+            float(settings.HTTP_READ_TIMEOUT),
+            connect=float(settings.HTTP_CONNECT_TIMEOUT),
+        ),
+        limits=httpx.Limits(
+            max_connections=int(settings.HTTP_ASYNC_MAX_CONNECTIONS),
+            max_keepalive_connections=int(settings.HTTP_POOL_MAXSIZE),
+        ),
+        headers={'Accept-Encoding': 'gzip, deflate'},
+    )
+
+
+def get_async_client():
+    """
+    Returns the keep-alive httpx.AsyncClient of the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = new_async_client()
+    return client
+
+
+async def close_async_client():
+    """
+    Closes the httpx.AsyncClient of the running event loop, if any, e.g.
+    on the FastAPI shutdown. The next call gets a new one.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+def get_async_timeout(read_timeout=None):
+    connect_timeout, read_timeout = get_timeout(read_timeout)
+    return httpx.Timeout(read_timeout, connect=connect_timeout)
+
+
+async def async_http_get(url, read_timeout=None, **kwargs):
+    kwargs.setdefault('timeout', get_async_timeout(read_timeout))
+    return await get_async_client().get(url, **kwargs)
+
+
+async def async_http_post(url, read_timeout=None, **kwargs):
+    kwargs.setdefault('timeout', get_async_timeout(read_timeout))
+    return await get_async_client().post(url, **kwargs)
+
+
+def async_http_post_stream(url, read_timeout=None, **kwargs):
+    """
+    Returns the 'async with' context of a POST whose response body is read
+    as it arrives, e.g. with aiter_lines().
+    """
+    kwargs.setdefault('timeout', get_async_timeout(read_timeout))
+    return get_async_client().stream('POST', url, **kwargs)
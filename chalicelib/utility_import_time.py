@@ -0,0 +1,94 @@
+# utility_import_time.py
+# On demand import-time report (per-module cumulative ms)
+#
+# Usage:
+#   python -m chalicelib.utility_import_time [module] [--top N]
+#       [--budget MS]
+#
+# E.g.
+#   python -m chalicelib.utility_import_time app --top 20 --budget 400
+import argparse
+import subprocess
+import sys
+
+
+def parse_import_time(output):
+    """
+    Parses the 'python -X importtime' stderr lines:
+    "import time: self [us] | cumulative | imported package"
+    Returns a list of dicts with the module name, the self and cumulative
+    milliseconds and the nesting depth.
+    """
+    report = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '[us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, module = \
+                line[len('import time:'):].split('|', 2)
+            report.append({
+                'module': module.strip(),
+                'self_ms': int(self_us) / 1000,
+                'cumulative_ms': int(cumulative_us) / 1000,
+                'depth': (len(module) - len(module.lstrip()) - 1) // 2,
+            })
+        except ValueError:
+            continue
+    return report
+
+
+def get_import_time_report(module='app', top=None):
+    """
+    Imports 'module' in a fresh interpreter with '-X importtime' and
+    returns the per-module report sorted by cumulative ms.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(
+            f'Cannot import {module}:\n{process.stderr.splitlines()[-1]}'
+        )
+    report = sorted(
+        parse_import_time(process.stderr),
+        key=lambda item: item['cumulative_ms'],
+        reverse=True,
+    )
+    return report[:top] if top else report
+
+
+def get_total_ms(report, module):
+    return next(
+        (item['cumulative_ms'] for item in report
+         if item['module'] == module),
+        0
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Per-module cumulative import time report'
+    )
+    parser.add_argument('module', nargs='?', default='app')
+    parser.add_argument('--top', type=int, default=30)
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Max. import ms of the module, exits with 1'
+                             ' if exceeded')
+    params = parser.parse_args(args)
+    report = get_import_time_report(params.module)
+    total_ms = get_total_ms(report, params.module)
+    print(f'{"cumulative ms":>14} {"self ms":>10}  module')
+    for item in report[:params.top]:
+        print(f"{item['cumulative_ms']:14.1f} {item['self_ms']:10.1f}  " +
+              '  ' * item['depth'] + item['module'])
+    print(f'\n{params.module} import time: {total_ms:.1f} ms')
+    if params.budget is not None and total_ms > params.budget:
+        print(f'ERROR: over the {params.budget:.1f} ms budget')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# utility_jwks.py
+# Auth0 JWKS cache: pre-parsed signing keys indexed by kid
+import threading
+import time
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_debug, log_warning
+from chalicelib.utility_lazy_import import LazyModule
+
+
+jwk = LazyModule('jose.jwk')
+
+JWK_FIELDS = ('kty', 'kid', 'use', 'n', 'e')
+DEFAULT_ALGORITHM = 'RS256'
+
+
+def parse_jwk(key, algorithm=None):
+    """
+    Returns the jose Key of a JWKS entry, so the RSA public key is built
+    once instead of on every token verification. If it cannot be built,
+    the JWK dict is returned and jose will report the error on decode.
+    """
+    jwk_dict = {field: key[field] for field in JWK_FIELDS if field in key}
+    try:
+        return jwk.construct(
+            jwk_dict, key.get('alg') or algorithm or DEFAULT_ALGORITHM
+        )
+    except Exception as err:
+        log_warning(f'parse_jwk | kid: {key.get("kid")} | ERROR: {err}')
+        return jwk_dict
+
+
+def get_jwks_keys(jwks, algorithm=None):
+    """
+    Returns the {kid: key} signing keys of a JWKS.
+    """
+    return {
+        key['kid']: parse_jwk(key, algorithm)
+        for key in jwks.get('keys', [])
+        if key.get('kid') and key.get('use', 'sig') == 'sig'
+    }
+
+
+class JwksCache:
+    """
+    In-memory JWKS with TTL. 'fetcher()' returns the JWKS dict (or
+    raises). The keys are re-fetched when the TTL expires, and once when a
+    token has an unknown kid (keys rotation), but never more often than
+    every 'min_refresh_interval' seconds, so bogus kids cannot hammer the
+    JWKS endpoint. If a re-fetch fails, the previous keys are kept.
+    """
+
+    def __init__(self, fetcher, ttl=None, min_refresh_interval=None,
+                 algorithm=None):
+        self._fetcher = fetcher
+        self._ttl = ttl
+        self._min_refresh_interval = min_refresh_interval
+        self._algorithm = algorithm
+        self._lock = threading.Lock()
+        self._jwks = None
+        self._keys = {}
+        self._fetched_at = None
+        self._attempted_at = None
+        self._stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'errors': 0}
+
+    def get_ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return float(settings.AUTH0_JWKS_TTL)
+
+    def get_min_refresh_interval(self):
+        if self._min_refresh_interval is not None:
+            return self._min_refresh_interval
+        return float(settings.AUTH0_JWKS_MIN_REFRESH_INTERVAL)
+
+    def _can_refetch(self, now):
+        return self._attempted_at is None or \
+            now - self._attempted_at >= self.get_min_refresh_interval()
+
+    def _fetch(self, now):
+        """
+        Must be called with the lock held.
+        """
+        self._attempted_at = now
+        try:
+            jwks = self._fetcher()
+        except Exception:
+            self._stats['errors'] += 1
+            if self._jwks is None:
+                raise
+            log_warning('JwksCache | re-fetch failed, keeping the old keys')
+            return
+        self._jwks = jwks
+        self._keys = get_jwks_keys(jwks, self._algorithm)
+        self._fetched_at = now
+        self._stats['fetches'] += 1
+        log_debug(f'JwksCache | fetched kids: {list(self._keys)}')
+
+    def get_jwks(self, refresh=False):
+        """
+        Returns the raw JWKS, fetching it if it's not cached, expired or
+        'refresh' is True.
+        """
+        with self._lock:
+            now = time.time()
+            if refresh or self._jwks is None or (
+                now - self._fetched_at >= self.get_ttl() and
+                self._can_refetch(now)
+            ):
+                self._fetch(now)
+            return self._jwks
+
+    def get_key(self, kid):
+        """
+        Returns the pre-parsed key of 'kid', or None if it's unknown even
+        after the (rate limited) re-fetch.
+        """
+        self.get_jwks()
+        with self._lock:
+            key = self._keys.get(kid)
+            if key is not None:
+                self._stats['hits'] += 1
+                return key
+            self._stats['misses'] += 1
+            if self._can_refetch(time.time()):
+                self._fetch(time.time())
+            return self._keys.get(kid)
+
+    def clear(self):
+        with self._lock:
+            self._jwks = None
+            self._keys = {}
+            self._fetched_at = None
+            self._attempted_at = None
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                kids=list(self._keys),
+                fetched_at=self._fetched_at,
+            )
@@ -1,4 +1,3 @@
-import asyncio
 import datetime
 from typing import Union
 from pydantic import BaseModel
@@ -7,10 +6,15 @@ from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
-from chalicelib.model_users import fetch_user_by_entryname, User, UserInDB
+from chalicelib.model_users import (
+    users_repository, update_user_password_hash, User, UserInDB)
 from chalicelib.settings import settings
-from chalicelib.utility_password import verify_password
-from chalicelib.utility_general import log_debug, log_warning
+from chalicelib.utility_password import (
+    PasswordServiceBusy, get_hash_method_async, get_password_hash,
+    get_password_hash_async, needs_rehash, verify_password,
+    verify_password_async)
+from chalicelib.utility_token_cache import verified_tokens
+from chalicelib.utility_general import log_debug, log_normal, log_warning
 
 
 class Token(BaseModel):
@@ -29,7 +33,8 @@ def get_user(username: str):
     log_debug(f'>>> get_user({username})')
     try:
         fields = {'_id': 0}
-        resultset = fetch_user_by_entryname('username', username, fields)
+        resultset = users_repository.get_user_by_entryname(
+            'username', username, fields)
         if not resultset['error'] and resultset['found']:
             log_debug('get_user is OK and will return User(**)')
             return User(**resultset['resultset'])
@@ -41,7 +46,8 @@ def get_user_hashed_password(username: str):
     try:
         # fields = {'username': 1, 'hashed_password': 1, '_id': 0}
         fields = {'_id': 0}
-        resultset = fetch_user_by_entryname('username', username, fields)
+        resultset = users_repository.get_user_by_entryname(
+            'username', username, fields)
         if not resultset['error'] and resultset['found']:
             log_debug(
                 'get_user_hashed_password.resultset:' +
@@ -57,6 +63,19 @@ def get_user_hashed_password(username: str):
         log_debug(f'get_user_hashed_password ERROR: {str(err)}')
 
 
+def rehash_user_password(user: UserInDB, hashed_password):
+    """
+    Persists the new hash of a user whose stored hash has other
+    parameters than the current ones.
+    """
+    log_normal(f'Rehashing the password of: {user.username}')
+    resultset = update_user_password_hash(user.username, hashed_password)
+    if resultset['error']:
+        log_warning(f'rehash_user_password ERROR: {resultset}')
+        return
+    user.hashed_password = hashed_password
+
+
 def authenticate_user(username: str, password: str):
     log_debug(f'authenticate_user.username: {username}, password: {password}')
     try:
@@ -67,11 +86,44 @@ def authenticate_user(username: str, password: str):
         if not verify_password(password, user.hashed_password):
             return False
         log_debug('authenticate_user: ALL CLEAR OK')
+        if needs_rehash(user.hashed_password):
+            try:
+                rehash_user_password(user, get_password_hash(password))
+            except Exception as err:
+                # A failed rehash never fails the login
+                log_warning(f'authenticate_user rehash ERROR: {err}')
         return user
+    except PasswordServiceBusy:
+        raise
     except Exception as err:
         log_debug(f'authenticate_user ERROR: {str(err)}')
 
 
+async def authenticate_user_async(username: str, password: str):
+    """
+    Same as authenticate_user(), verifying the password without blocking
+    the event loop.
+    """
+    try:
+        user = get_user_hashed_password(username)
+        if not user:
+            return False
+        if not await verify_password_async(password, user.hashed_password):
+            return False
+        if needs_rehash(user.hashed_password,
+                        await get_hash_method_async()):
+            try:
+                rehash_user_password(
+                    user, await get_password_hash_async(password))
+            except Exception as err:
+                log_warning(f'authenticate_user_async rehash ERROR: {err}')
+        return user
+    except PasswordServiceBusy:
+        raise
+    except Exception as err:
+        log_debug(f'authenticate_user_async ERROR: {str(err)}')
+
+
 def create_access_token(
     data: dict,
     expires_delta: Union[datetime.timedelta, None] = None
@@ -90,12 +142,22 @@ def create_access_token(
     return encoded_jwt
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def get_credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def get_user_from_token(token: str):
+    """
+    Sync auth core: returns the User of a valid access token, or raises
+    the credentials HTTPException.
+    """
+    user = verified_tokens.get(token)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(
             token,
@@ -104,27 +166,44 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         )
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            raise get_credentials_exception()
         token_data = TokenData(username=username)
     except JWTError:
-        raise credentials_exception
+        raise get_credentials_exception()
     user = get_user(username=token_data.username)
     if user is None:
-        raise credentials_exception
+        raise get_credentials_exception()
+    verified_tokens.set(token, user, user.username, payload.get("exp"))
     return user
 
 
-async def get_current_active_user(
-    current_user: User = Depends(get_current_user)
-):
+def check_active_user(current_user: User):
+    """
+    Sync auth core: returns the user, or raises an HTTPException if it's
+    disabled.
+    """
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return get_user_from_token(token)
+
+
+async def get_current_active_user(
+    current_user: User = Depends(get_current_user)
+):
+    return check_active_user(current_user)
+
+
 def get_current_active_user_chalice(token):
+    """
+    Returns the active User of the access token, or the HTTPException
+    to respond with.
+    """
     try:
-        current_user = asyncio.run(get_current_user(token))
+        current_user = check_active_user(get_user_from_token(token))
     except HTTPException as http_err:
         log_debug(
             '>>>> get_current_active_user_chalice.HTTP_ERR:' +
@@ -139,14 +218,18 @@ def get_current_active_user_chalice(token):
         '>>>> get_current_active_user_chalice.' +
         f'get_current_active_user.current_user: {current_user}'
     )
-    return asyncio.run(get_current_active_user(current_user))
+    return current_user
 
 
-def login_for_access_token(
-    form_data: OAuth2PasswordRequestForm = Depends()
-):
-    log_debug(f'login_for_access_token.form_data = {form_data}')
-    user = authenticate_user(form_data.username, form_data.password)
+def get_password_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login requests, please retry later",
+        headers={"Retry-After": "1"},
+    )
+
+
+def get_access_token_response(user):
     if not user:
         log_warning("ERROR on login: Incorrect username or password")
         raise HTTPException(
@@ -168,3 +251,25 @@ def login_for_access_token(
         return response
     except Exception as err:
         log_debug(f'login_for_access_token ERROR: {str(err)}')
+
+
+def login_for_access_token(
+    form_data: OAuth2PasswordRequestForm = Depends()
+):
+    log_debug(f'login_for_access_token.form_data = {form_data}')
+    try:
+        user = authenticate_user(form_data.username, form_data.password)
+    except PasswordServiceBusy:
+        raise get_password_busy_exception()
+    return get_access_token_response(user)
+
+
+async def login_for_access_token_async(
+    form_data: OAuth2PasswordRequestForm = Depends()
+):
+    try:
+        user = await authenticate_user_async(
+            form_data.username, form_data.password)
+    except PasswordServiceBusy:
+        raise get_password_busy_exception()
+    return get_access_token_response(user)
@@ -0,0 +1,52 @@
+# utility_lazy_import.py
+# Deferred imports of heavy dependencies, to keep the Lambda cold start short
+import importlib
+
+
+class LazyModule:
+    """
+    Module proxy that imports the module on the first attribute access,
+    e.g. jwt = LazyModule('jose.jwt'); jwt.decode(...)
+    Setting an attribute sets it in the real module, so mock.patch()
+    works the same as with a plain import.
+    """
+
+    def __init__(self, module_name):
+        object.__setattr__(self, '_module_name', module_name)
+        object.__setattr__(self, '_module', None)
+
+    def _load(self):
+        if self._module is None:
+            object.__setattr__(
+                self, '_module', importlib.import_module(self._module_name)
+            )
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._load(), name)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._module_name} ({state})>'
+
+
+def lazy_function(module_name, function_name):
+    """
+    Returns a function that imports 'module_name' on its first call and
+    then calls 'function_name' from it.
+    """
+    def wrapper(*args, **kwargs):
+        module = importlib.import_module(module_name)
+        return getattr(module, function_name)(*args, **kwargs)
+    wrapper.__name__ = function_name
+    wrapper.__qualname__ = function_name
+    wrapper.__doc__ = f'Lazy {module_name}.{function_name}()'
+    return wrapper
@@ -1,9 +1,362 @@
 
 """
 Password Encryption module
+
+The 'scrypt' hashing and verification are deliberately memory and CPU
+hard, so they run in a bounded process pool (PasswordService) instead of
+the FastAPI event loop or the Chalice request threads.
 """
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, \
+    TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_normal, log_warning
+
+
+class PasswordServiceBusy(Exception):
+    """
+    Raised when there are already PASSWORD_POOL_MAX_PENDING password
+    operations in flight or queued.
+    """
+
+
+# Cost bounds of the calibration. The floors are werkzeug's defaults, so
+# a fast host never gets weaker hashes than the uncalibrated ones
+SCRYPT_MIN_N = 2**15
+SCRYPT_MAX_N = 2**20
+# Ceiling when the host memory is unknown
+SCRYPT_DEFAULT_MAX_N = 2**17
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_HASH_NAME = 'sha256'
+PBKDF2_MIN_ITERATIONS = 100000
+PBKDF2_SAMPLE_ITERATIONS = 20000
+
+
+def get_hash_params(method):
+    """
+    Returns the (algorithm, cost, extra params) of a werkzeug hash method,
+    e.g. 'scrypt:32768:8:1' -> ('scrypt', 32768, ('8', '1')),
+    'pbkdf2:sha256:600000' -> ('pbkdf2', 600000, ('sha256',)).
+    The hash method is the part of a hashed password before the first '$'.
+    """
+    algorithm, *args = method.split('$', 1)[0].split(':')
+    if algorithm == 'scrypt':
+        n, r, p = args if args else (2**15, SCRYPT_R, SCRYPT_P)
+        return algorithm, int(n), (str(r), str(p))
+    if algorithm == 'pbkdf2':
+        hash_name = args[0] if args else PBKDF2_HASH_NAME
+        iterations = args[1] if len(args) > 1 else 1000000
+        return algorithm, int(iterations), (hash_name,)
+    return algorithm, 0, tuple(args)
+
+
+def measure_ms(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000
+
+
+def get_memory_bytes():
+    """
+    Returns the memory of this host (or the AWS Lambda function memory
+    size), or None if it's unknown.
+    """
+    lambda_memory_mb = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    if lambda_memory_mb:
+        return int(lambda_memory_mb) * 1024 * 1024
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_scrypt_max_n():
+    """
+    Returns the largest scrypt N (a power of 2) whose hash fits in
+    PASSWORD_SCRYPT_MAX_MEMORY_PERCENT of the memory, between SCRYPT_MIN_N
+    and SCRYPT_MAX_N. A scrypt hash needs 128 * N * r * p bytes.
+    """
+    memory_bytes = get_memory_bytes()
+    if memory_bytes is None:
+        return SCRYPT_DEFAULT_MAX_N
+    max_bytes = memory_bytes * \
+        float(settings.PASSWORD_SCRYPT_MAX_MEMORY_PERCENT) / 100
+    n = SCRYPT_MIN_N
+    while n < SCRYPT_MAX_N and 128 * 2 * n * SCRYPT_R * SCRYPT_P <= max_bytes:
+        n *= 2
+    return n
+
+
+def calibrate_scrypt(target_ms):
+    """
+    Returns the scrypt method with the smallest N (a power of 2) that takes
+    at least 'target_ms' to hash on this host, never below SCRYPT_MIN_N nor
+    above the memory bound of get_scrypt_max_n().
+    """
+    n = SCRYPT_MIN_N
+    max_n = get_scrypt_max_n()
+    while n < max_n:
+        elapsed_ms = measure_ms(
+            hashlib.scrypt, b'calibration', salt=b'calibration', n=n,
+            r=SCRYPT_R, p=SCRYPT_P, maxmem=132 * n * SCRYPT_R * SCRYPT_P,
+        )
+        if elapsed_ms >= target_ms:
+            break
+        n *= 2
+    return f'scrypt:{n}:{SCRYPT_R}:{SCRYPT_P}'
+
+
+def calibrate_pbkdf2(target_ms):
+    """
+    Returns the pbkdf2 method with the iterations that take about
+    'target_ms' to hash on this host.
+    """
+    elapsed_ms = measure_ms(
+        hashlib.pbkdf2_hmac, PBKDF2_HASH_NAME, b'calibration',
+        b'calibration', PBKDF2_SAMPLE_ITERATIONS,
+    )
+    iterations = int(
+        PBKDF2_SAMPLE_ITERATIONS * target_ms / max(elapsed_ms, 0.001)
+    ) // 1000 * 1000
+    return f'pbkdf2:{PBKDF2_HASH_NAME}:' + \
+        str(max(iterations, PBKDF2_MIN_ITERATIONS))
+
+
+_hash_method = {}
+_hash_method_lock = threading.Lock()
+
+
+def get_hash_method():
+    """
+    Returns the werkzeug hash method (with its cost parameters) for the new
+    password hashes: PASSWORD_HASH_METHOD if it has them, or the one
+    calibrated once per process for PASSWORD_HASH_TARGET_MS.
+    """
+    method = settings.PASSWORD_HASH_METHOD
+    if ':' in method:
+        return method
+    with _hash_method_lock:
+        if method not in _hash_method:
+            target_ms = float(settings.PASSWORD_HASH_TARGET_MS)
+            if method == 'pbkdf2':
+                _hash_method[method] = calibrate_pbkdf2(target_ms)
+            else:
+                _hash_method[method] = calibrate_scrypt(target_ms)
+            log_normal(f'Password hash method for {target_ms} ms:'
+                       f' {_hash_method[method]}')
+        return _hash_method[method]
+
+
+async def get_hash_method_async():
+    """
+    Same as get_hash_method(), for the FastAPI app: the first call runs
+    the calibration in a worker thread instead of the event loop.
+    """
+    method = settings.PASSWORD_HASH_METHOD
+    if ':' in method or method in _hash_method:
+        return get_hash_method()
+    return await asyncio.to_thread(get_hash_method)
+
+
+def needs_rehash(hashed_password, method=None):
+    """
+    Returns True if a stored hash has another algorithm or parameters than
+    the current hash method, or a cost off by more than 2x. The tolerance
+    keeps the hosts with a slightly different calibration from rehashing
+    each other's hashes on every login.
+    """
+    target = get_hash_params(method or get_hash_method())
+    try:
+        stored = get_hash_params(hashed_password)
+    except ValueError:
+        return True
+    if stored[0] != target[0] or stored[2] != target[2]:
+        return True
+    return not (target[1] / 2 <= stored[1] <= target[1] * 2)
+
+
+def hash_password(password, method='scrypt'):
+    """
+    Encrypts a password using the 'method' (runs in the pool).
+    """
+    return generate_password_hash(
+        password,
+        method=method,
+    )
+
+
+class PasswordService:
+    """
+    Runs the password operations in a process pool of 'workers' processes
+    ("0" runs them inline, e.g. where there's no multiprocessing support
+    like AWS Lambda without /dev/shm). At most 'max_pending' operations can
+    be running or queued; the next ones fail fast with PasswordServiceBusy,
+    so a burst of logins cannot pile up.
+    """
+
+    def __init__(self, workers=None, max_pending=None, timeout=None):
+        self._workers = workers
+        self._max_pending = max_pending
+        self._timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+        self._inline = False
+        self._pending = 0
+        self._stats = {'calls': 0, 'rejected': 0, 'pool_errors': 0}
+
+    def get_workers(self):
+        if self._workers is not None:
+            return self._workers
+        return int(settings.PASSWORD_POOL_WORKERS)
+
+    def get_max_pending(self):
+        if self._max_pending is not None:
+            return self._max_pending
+        return int(settings.PASSWORD_POOL_MAX_PENDING)
+
+    def get_timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return float(settings.PASSWORD_POOL_TIMEOUT)
+
+    def get_executor(self):
+        """
+        Returns the process pool, created on first use, or None to run
+        inline.
+        """
+        with self._lock:
+            if self._executor is not None or self._inline:
+                return self._executor
+            if self.get_workers() <= 0:
+                self._inline = True
+                return None
+            try:
+                # 'spawn': the workers must not inherit the parent threads
+                # and locks (HTTP pools, Mongo client)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.get_workers(),
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            except (OSError, NotImplementedError, ImportError) as err:
+                log_warning('PasswordService | no process pool, running'
+                            f' inline: {err}')
+                self._inline = True
+            return self._executor
+
+    def acquire(self):
+        with self._lock:
+            if self._pending >= self.get_max_pending():
+                self._stats['rejected'] += 1
+                raise PasswordServiceBusy(
+                    'Too many password operations in progress')
+            self._pending += 1
+            self._stats['calls'] += 1
+
+    def release(self, *args):
+        with self._lock:
+            self._pending -= 1
+
+    def reset_executor(self, executor):
+        with self._lock:
+            self._stats['pool_errors'] += 1
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, func, *args):
+        """
+        Submits func(*args) to the pool. Returns the future, or None if
+        it must run inline.
+        """
+        executor = self.get_executor()
+        if executor is None:
+            return None
+        try:
+            return executor.submit(func, *args)
+        except (BrokenProcessPool, RuntimeError) as err:
+            log_warning(f'PasswordService | pool error: {err}')
+            self.reset_executor(executor)
+            return None
+
+    def run(self, func, *args):
+        """
+        Sync facade: runs func(*args) in the pool and waits for it.
+        """
+        future = self.start(func, *args)
+        if future is None:
+            try:
+                return func(*args)
+            finally:
+                self.release()
+        try:
+            return future.result(timeout=self.get_timeout())
+        except FutureTimeoutError:
+            # Unless it's still queued, the job keeps its slot until done
+            future.cancel()
+            raise
+
+    async def run_async(self, func, *args):
+        """
+        Async facade: awaits func(*args) in the pool without blocking the
+        event loop.
+        """
+        future = self.start(func, *args)
+        if future is None:
+            try:
+                return await asyncio.to_thread(func, *args)
+            finally:
+                self.release()
+        # A timeout cancels the wrapper, and the job if it's still queued
+        return await asyncio.wait_for(
+            asyncio.wrap_future(future), self.get_timeout())
+
+    def start(self, func, *args):
+        """
+        Takes a pending slot and submits func(*args) to the pool. The slot
+        of a pool job is released when the job is done (not when the
+        caller stops waiting for it), so a timed out job still counts
+        against PASSWORD_POOL_MAX_PENDING. Returns None (with the slot
+        taken) if it must run inline.
+        """
+        self.acquire()
+        try:
+            future = self.submit(func, *args)
+        except BaseException:
+            self.release()
+            raise
+        if future is not None:
+            future.add_done_callback(self.release)
+        return future
+
+    def shutdown(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+            self._inline = False
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                pending=self._pending,
+                workers=0 if self._inline else self.get_workers(),
+            )
+
+
+password_service = PasswordService()
+
 
 def verify_password(plain_password, hashed_password):
     """
@@ -13,7 +366,19 @@ def verify_password(plain_password, hashed_password):
     :param plain_password: The password entered by the user.
     :return: True if the passwords match, False otherwise.
     """
-    return check_password_hash(
+    return password_service.run(
+        check_password_hash,
+        hashed_password,
+        plain_password
+    )
+
+
+async def verify_password_async(plain_password, hashed_password):
+    """
+    Same as verify_password(), for the FastAPI app.
+    """
+    return await password_service.run_async(
+        check_password_hash,
         hashed_password,
         plain_password
     )
@@ -21,11 +386,17 @@ def verify_password(plain_password, hashed_password):
 
 def get_password_hash(password):
     """
-    Encrypts a password using the 'scrypt' method.
+    Encrypts a password using the current hash method (scrypt by default,
+    with the cost calibrated for this host).
     :param password: The password to encrypt.
     :return: The encrypted password.
     """
-    return generate_password_hash(
-        password,
-        method='scrypt',
-    )
+    return password_service.run(hash_password, password, get_hash_method())
+
+
+async def get_password_hash_async(password):
+    """
+    Same as get_password_hash(), for the FastAPI app.
+    """
+    return await password_service.run_async(
+        hash_password, password, await get_hash_method_async())
@@ -0,0 +1,130 @@
+# utility_rate_graph.py
+# Cross-rate graph engine: any currency pair from the known base rates
+import threading
+import time
+
+from chalicelib.utility_lazy_import import LazyModule
+
+
+np = LazyModule('numpy')
+
+HUB_CURRENCY = 'USD'
+
+
+def get_pair_nodes(pair):
+    """
+    Returns the (from, to) graph nodes of a rates pair name, e.g.
+    'USD-VES' -> ('USD', 'VES'). The extra parts of the name are the
+    rate source, which is a node of its own, e.g.
+    'USD-COP-GOOGLE' -> ('USD', 'COP_GOOGLE').
+    """
+    parts = pair.upper().split('-')
+    return parts[0], '_'.join(parts[1:])
+
+
+def get_valid_rates(base_rates):
+    valid_rates = {}
+    for pair, value in base_rates.items():
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            valid_rates[pair.upper()] = value
+    return valid_rates
+
+
+class RateGraph:
+    """
+    Currency graph with the base rates as edges. matrix[i, j] is the
+    number of units of currency j for one unit of currency i, 0 if there's
+    no known path between them. The derived pairs are computed once per
+    update() with vectorized path products, so a conversion is a lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._base_rates = {}
+        self._currencies = []
+        self._index = {}
+        self._matrix = None
+        self._updated_at = None
+        self._builds = 0
+
+    def update(self, base_rates):
+        """
+        Rebuilds the graph if the base rates changed since the last build.
+        Returns True if it was rebuilt.
+        """
+        base_rates = get_valid_rates(base_rates)
+        with self._lock:
+            if base_rates == self._base_rates:
+                return False
+        currencies, matrix = self.build(base_rates)
+        with self._lock:
+            self._base_rates = base_rates
+            self._currencies = currencies
+            self._index = {
+                currency: position
+                for position, currency in enumerate(currencies)
+            }
+            self._matrix = matrix
+            self._updated_at = time.time()
+            self._builds += 1
+        return True
+
+    @staticmethod
+    def build(base_rates):
+        """
+        Returns the (currencies, matrix) with every derived pair. The hub
+        currency is the first node, so the paths through it are found
+        first.
+        """
+        nodes = set()
+        for pair in base_rates:
+            nodes.update(get_pair_nodes(pair))
+        nodes.discard(HUB_CURRENCY)
+        currencies = [HUB_CURRENCY] + sorted(nodes)
+        index = {currency: position
+                 for position, currency in enumerate(currencies)}
+        matrix = np.zeros((len(currencies), len(currencies)))
+        for pair, value in base_rates.items():
+            from_node, to_node = get_pair_nodes(pair)
+            matrix[index[from_node], index[to_node]] = value
+            matrix[index[to_node], index[from_node]] = 1 / value
+        np.fill_diagonal(matrix, 1.0)
+        # Path products closure: an unknown i -> j rate becomes
+        # i -> k * k -> j when both legs are known
+        for k in range(len(currencies)):
+            via_k = np.outer(matrix[:, k], matrix[k, :])
+            matrix = np.where(matrix == 0, via_k, matrix)
+        return currencies, matrix
+
+    def rate(self, from_currency, to_currency):
+        """
+        Returns the from -> to rate, or None if any of the currencies is
+        unknown or there's no path between them.
+        """
+        with self._lock:
+            from_index = self._index.get(from_currency.upper())
+            to_index = self._index.get(to_currency.upper())
+            if from_index is None or to_index is None:
+                return None
+            value = float(self._matrix[from_index, to_index])
+        return value or None
+
+    def currencies(self):
+        with self._lock:
+            return list(self._currencies)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'currencies': len(self._currencies),
+                'base_rates': len(self._base_rates),
+                'builds': self._builds,
+                'updated_at': self._updated_at,
+            }
+
+
+rate_graph = RateGraph()
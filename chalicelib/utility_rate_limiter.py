@@ -0,0 +1,288 @@
+# utility_rate_limiter.py
+# Client-side OpenAI rate limits: per-model request and token buckets
+import email.utils
+import random
+import re
+import threading
+import time
+from collections.abc import Mapping
+
+from chalicelib.settings import settings
+
+
+RETRY_STATUS_CODES = (429, 500, 502, 503)
+RATE_LIMIT_KINDS = ('requests', 'tokens')
+DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+DURATION_RE = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a call would have to wait more than
+    OPENAI_RATE_LIMIT_MAX_WAIT seconds for its turn.
+    """
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_duration(value):
+    """
+    Returns the seconds of an OpenAI 'x-ratelimit-reset-*' header, e.g.
+    "1s", "6m0s", "20ms" or "0.5", or None if it's not a duration.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    seconds = to_float(value)
+    if seconds is not None:
+        return seconds
+    parts = DURATION_RE.findall(value)
+    if not parts or ''.join(number + unit for number, unit in parts) \
+            != value:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit]
+               for number, unit in parts)
+
+
+def parse_retry_after(headers):
+    """
+    Returns the seconds of the 'retry-after-ms' or 'Retry-After' (seconds
+    or HTTP date) headers, or None.
+    """
+    retry_after_ms = to_float(headers.get('retry-after-ms'))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    seconds = to_float(retry_after)
+    if seconds is not None:
+        return seconds
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+def get_response_headers(http_response):
+    """
+    requests and httpx headers are case-insensitive mappings.
+    """
+    headers = getattr(http_response, 'headers', None)
+    return headers if isinstance(headers, Mapping) else {}
+
+
+def is_quota_error(http_response):
+    """
+    A 429 "insufficient_quota" is a billing error: retrying cannot help.
+    """
+    try:
+        return http_response.json()['error']['code'] == 'insufficient_quota'
+    except Exception:
+        return False
+
+
+class TokenBucket:
+    """
+    Budget of 'capacity' units per minute, refilled continuously. The
+    reservations can take the level below zero: that debt is the queue,
+    and every caller waits until its share is refilled, so a burst is paced
+    at the limit instead of failing. No capacity means no known limit.
+    """
+
+    def __init__(self, capacity=None, now=0):
+        self.capacity = capacity
+        self.level = capacity
+        self.updated_at = now
+
+    def refill(self, now):
+        if self.capacity is not None:
+            self.level = min(
+                self.capacity,
+                self.level + (now - self.updated_at) * self.capacity / 60,
+            )
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """
+        Takes 'amount' units and returns the seconds to wait for them.
+        """
+        if self.capacity is None:
+            return 0
+        self.refill(now)
+        self.level -= amount
+        return 0 if self.level >= 0 else -self.level * 60 / self.capacity
+
+    def refund(self, amount):
+        if self.capacity is not None:
+            self.level = min(self.capacity, self.level + amount)
+
+    def set_limit(self, limit, remaining, now):
+        """
+        Adopts the provider's limit and remaining budget. The level never
+        goes up from the headers: a response can be older than the
+        reservations made since it was sent.
+        """
+        self.refill(now)
+        self.capacity = limit
+        self.level = remaining if self.level is None \
+            else min(self.level, remaining)
+
+
+class RateLimitScheduler:
+    """
+    Paces the OpenAI calls per model with a requests and a tokens bucket.
+    The limits are OPENAI_RPM / OPENAI_TPM, or learned from the
+    'x-ratelimit-*' response headers. A 429 blocks the model for every
+    caller until its 'Retry-After' (or the rate limit reset), and the
+    retries use exponential backoff with jitter, so a burst doesn't turn
+    into an error storm.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._models = {}
+        self._stats = {'requests': 0, 'delayed': 0, 'wait_seconds': 0.0,
+                       'throttled': 0, 'retries': 0, 'rejected': 0}
+
+    def enabled(self):
+        return settings.OPENAI_RATE_LIMIT_ENABLED == "1"
+
+    def get_model(self, model, now):
+        """
+        Must be called with the lock held.
+        """
+        if model not in self._models:
+            self._models[model] = {
+                'requests': TokenBucket(to_float(settings.OPENAI_RPM), now),
+                'tokens': TokenBucket(to_float(settings.OPENAI_TPM), now),
+                'blocked_until': now,
+            }
+        return self._models[model]
+
+    def reserve(self, model, tokens):
+        """
+        Reserves a call of 'model' with about 'tokens' tokens. Returns the
+        seconds to wait before sending it, or raises RateLimitExceeded if
+        it's more than OPENAI_RATE_LIMIT_MAX_WAIT.
+        """
+        if not self.enabled():
+            return 0
+        with self._lock:
+            now = self._clock()
+            state = self.get_model(model, now)
+            wait = max(
+                state['requests'].reserve(1, now),
+                state['tokens'].reserve(tokens, now),
+                state['blocked_until'] - now,
+                0,
+            )
+            if wait > float(settings.OPENAI_RATE_LIMIT_MAX_WAIT):
+                state['requests'].refund(1)
+                state['tokens'].refund(tokens)
+                self._stats['rejected'] += 1
+                raise RateLimitExceeded(
+                    f'OpenAI rate limit for {model}: the next slot is in'
+                    f' {wait:.1f} seconds')
+            self._stats['requests'] += 1
+            if wait > 0:
+                self._stats['delayed'] += 1
+                self._stats['wait_seconds'] += wait
+            return wait
+
+    def get_backoff_delay(self, attempt, retry_after=None):
+        """
+        "Full jitter" exponential backoff, or the provider's 'retry_after'
+        plus a jitter that spreads the queued callers.
+        """
+        base_delay = float(settings.OPENAI_RETRY_BASE_DELAY)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, base_delay)
+        return random.uniform(0, min(
+            float(settings.OPENAI_RETRY_MAX_DELAY),
+            base_delay * 2 ** attempt,
+        ))
+
+    def get_retry_after(self, headers):
+        """
+        Retry-After, or the reset of the exhausted rate limits.
+        """
+        retry_after = parse_retry_after(headers)
+        if retry_after is not None:
+            return retry_after
+        resets = [
+            parse_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+            for kind in RATE_LIMIT_KINDS
+            if to_float(headers.get(f'x-ratelimit-remaining-{kind}')) == 0
+        ]
+        resets = [reset for reset in resets if reset is not None]
+        return max(resets) if resets else None
+
+    def get_retry_delay(self, model, http_response, attempt):
+        """
+        Records the rate limit headers of a response. Returns the seconds
+        to wait before retrying it (attempt 'attempt', from 0), or None if
+        it must not be retried: not a 429/5xx, a quota error, too many
+        retries or a Retry-After beyond OPENAI_RATE_LIMIT_MAX_WAIT.
+        """
+        if not self.enabled():
+            return None
+        headers = get_response_headers(http_response)
+        status_code = http_response.status_code
+        with self._lock:
+            now = self._clock()
+            state = self.get_model(model, now)
+            for kind in RATE_LIMIT_KINDS:
+                limit = to_float(headers.get(f'x-ratelimit-limit-{kind}'))
+                remaining = to_float(
+                    headers.get(f'x-ratelimit-remaining-{kind}'))
+                if limit and remaining is not None:
+                    state[kind].set_limit(limit, remaining, now)
+            if status_code not in RETRY_STATUS_CODES:
+                return None
+            if status_code == 429:
+                self._stats['throttled'] += 1
+            if attempt >= int(settings.OPENAI_MAX_RETRIES) or \
+               (status_code == 429 and is_quota_error(http_response)):
+                return None
+            retry_after = self.get_retry_after(headers) \
+                if status_code == 429 else parse_retry_after(headers)
+            delay = self.get_backoff_delay(attempt, retry_after)
+            if delay > float(settings.OPENAI_RATE_LIMIT_MAX_WAIT):
+                return None
+            if status_code == 429:
+                # Everyone waits, not only this caller
+                state['blocked_until'] = max(
+                    state['blocked_until'], now + delay)
+            self._stats['retries'] += 1
+            return delay
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                models={
+                    model: {
+                        kind: {
+                            'limit': state[kind].capacity,
+                            'level': state[kind].level,
+                        }
+                        for kind in RATE_LIMIT_KINDS
+                    }
+                    for model, state in self._models.items()
+                },
+            )
+
+
+openai_rate_limiter = RateLimitScheduler()
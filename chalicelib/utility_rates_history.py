@@ -0,0 +1,257 @@
+# utility_rates_history.py
+# Append-only memory-mapped exchange rates history store
+import inspect
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from functools import wraps
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import (
+    get_api_standard_response, log_debug, log_warning)
+
+
+# Each record is a little endian (timestamp, value) pair of float64
+RECORD = struct.Struct('<dd')
+
+
+class RatesHistory:
+    """
+    Columnar history store with one append-only file per currency pair.
+    Records are fixed width and timestamps never decrease, so lookups are
+    binary searches over the memory-mapped file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._last_records = {}
+
+    def get_pair_filename(self, pair):
+        pair = re.sub(r'[^A-Z0-9_\-]', '_', str(pair).upper())
+        return os.path.join(self.directory, f'{pair}.bin')
+
+    def get_last_record(self, pair):
+        if pair not in self._last_records:
+            records = self.read_records(pair, -1, None)
+            self._last_records[pair] = records[0] if records else None
+        return self._last_records[pair]
+
+    def append(self, pair, value, timestamp=None, min_interval=0):
+        """
+        Appends a (timestamp, value) record for the pair. Repeated values
+        within 'min_interval' seconds of the last record are skipped.
+        Returns True if the record was written.
+        """
+        pair = str(pair).upper()
+        value = float(value)
+        timestamp = time.time() if timestamp is None else float(timestamp)
+        with self._lock:
+            last_record = self.get_last_record(pair)
+            if last_record is not None:
+                last_timestamp, last_value = last_record
+                if last_value == value and \
+                   timestamp - last_timestamp < min_interval:
+                    return False
+                # Keep the file sorted by timestamp for the binary search
+                timestamp = max(timestamp, last_timestamp)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.get_pair_filename(pair), 'ab') as history_file:
+                history_file.write(RECORD.pack(timestamp, value))
+            self._last_records[pair] = (timestamp, value)
+        return True
+
+    def _map(self, pair):
+        filename = self.get_pair_filename(pair)
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return None
+        with open(filename, 'rb') as history_file:
+            return mmap.mmap(
+                history_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+    @staticmethod
+    def _count(mapped):
+        return len(mapped) // RECORD.size
+
+    @staticmethod
+    def _timestamp_at(mapped, index):
+        return RECORD.unpack_from(mapped, index * RECORD.size)[0]
+
+    def _bisect_right(self, mapped, timestamp):
+        """
+        Returns the index of the first record with a timestamp greater
+        than 'timestamp'.
+        """
+        low, high = 0, self._count(mapped)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp_at(mapped, middle) <= timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _bisect_left(self, mapped, timestamp):
+        low, high = 0, self._count(mapped)
+        while low < high:
+            middle = (low + high) // 2
+            if self._timestamp_at(mapped, middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def read_records(self, pair, start_index, end_index):
+        mapped = self._map(pair)
+        if mapped is None:
+            return []
+        try:
+            count = self._count(mapped)
+            start_index = max(0, count + start_index) if start_index < 0 \
+                else start_index
+            end_index = count if end_index is None else min(end_index, count)
+            return [
+                RECORD.unpack_from(mapped, index * RECORD.size)
+                for index in range(start_index, end_index)
+            ]
+        finally:
+            mapped.close()
+
+    def as_of(self, pair, timestamp):
+        """
+        Returns the last (timestamp, value) record observed at or before
+        'timestamp', or None if there's no such record.
+        """
+        mapped = self._map(pair)
+        if mapped is None:
+            return None
+        try:
+            index = self._bisect_right(mapped, float(timestamp)) - 1
+            if index < 0:
+                return None
+            return RECORD.unpack_from(mapped, index * RECORD.size)
+        finally:
+            mapped.close()
+
+    def range(self, pair, start=None, end=None):
+        """
+        Returns the (timestamp, value) records with
+        start <= timestamp <= end.
+        """
+        mapped = self._map(pair)
+        if mapped is None:
+            return []
+        try:
+            start_index = 0 if start is None \
+                else self._bisect_left(mapped, float(start))
+            end_index = self._count(mapped) if end is None \
+                else self._bisect_right(mapped, float(end))
+            return [
+                RECORD.unpack_from(mapped, index * RECORD.size)
+                for index in range(start_index, end_index)
+            ]
+        finally:
+            mapped.close()
+
+    def pairs(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            filename[:-len('.bin')]
+            for filename in os.listdir(self.directory)
+            if filename.endswith('.bin')
+        )
+
+
+rates_history = RatesHistory(settings.RATES_HISTORY_DIR)
+
+
+def record_rates(rates, timestamp=None):
+    """
+    Records the observed rates, a dict {pair: value}. Never raises, so
+    a history store failure doesn't break the rates endpoints.
+    """
+    if settings.RATES_HISTORY_ENABLED != "1":
+        return
+    for pair, value in rates.items():
+        try:
+            rates_history.append(
+                pair,
+                value,
+                timestamp,
+                float(settings.RATES_HISTORY_MIN_INTERVAL),
+            )
+        except Exception as err:
+            log_warning(f'record_rates | {pair} | ERROR: {err}')
+    log_debug(f'record_rates | {rates}')
+
+
+def recorded_rates(get_rates):
+    """
+    Decorator to record the rates of every upstream fetch, stamped with
+    the fetch time. 'get_rates(data, *args)' returns the {pair: value}
+    rates of the api_response 'data' fetched with 'args'. It goes below
+    cached_rates and single_flight, so cache hits and coalesced callers
+    don't record the same rates again, and above circuit_breaker, whose
+    last-known-good fallbacks are skipped. Works for plain and
+    'async def' fetchers.
+    """
+    def record(api_response, timestamp, args):
+        if api_response.get('error') or api_response.get('last_known_good'):
+            return
+        try:
+            rates = get_rates(api_response['data'], *args)
+        except Exception as err:
+            log_warning(f'recorded_rates | ERROR: {err}')
+            return
+        record_rates(rates, timestamp)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args):
+                api_response = await func(*args)
+                record(api_response, time.time(), args)
+                return api_response
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args):
+            api_response = func(*args)
+            record(api_response, time.time(), args)
+            return api_response
+        return wrapper
+    return decorator
+
+
+def get_rates_history(pair, as_of=None, start=None, end=None):
+    """
+    Returns the history records of a currency pair from the local store,
+    without any network call. With 'as_of', returns the rate in effect at
+    that unix timestamp, otherwise the records between 'start' and 'end'.
+    """
+    response = get_api_standard_response()
+    response['pair'] = str(pair).upper()
+    try:
+        if as_of is not None:
+            record = rates_history.as_of(pair, as_of)
+            records = [] if record is None else [record]
+        else:
+            records = rates_history.range(pair, start, end)
+    except Exception as err:
+        response['error'] = True
+        response['error_message'] = f'ERROR reading the rates history: {err}'
+        return response
+    response['data'] = [
+        {'timestamp': timestamp, 'value': value}
+        for timestamp, value in records
+    ]
+    return response
+
+
+def get_rates_history_pairs():
+    return {'pairs': rates_history.pairs()}
@@ -0,0 +1,133 @@
+# utility_rates_refresher.py
+# Background rates refresher scheduler for long-running servers
+import asyncio
+import random
+import time
+
+from chalicelib.settings import settings
+from chalicelib.utility_cache import get_provider_ttls, refresh_cached_rates
+from chalicelib.utility_general import log_debug, log_normal, log_warning
+from chalicelib.api_currency_exchange import (
+    veb_bcv_api, veb_monitor_api, cop_api, crypto_api)
+
+
+def get_refresh_interval(provider):
+    """
+    Returns the refresh interval seconds for a provider. Defaults to
+    RATES_REFRESHER_TTL_RATIO of the provider cache TTL, so entries are
+    refreshed ahead of their expiry.
+    """
+    interval = getattr(
+        settings, f'RATES_REFRESHER_INTERVAL_{provider.upper()}', ''
+    )
+    if interval:
+        return float(interval)
+    ttl = get_provider_ttls()[provider][0]
+    return ttl * float(settings.RATES_REFRESHER_TTL_RATIO)
+
+
+def get_refresh_jobs():
+    jobs = [
+        ('bcv', veb_bcv_api, ()),
+        ('monitor', veb_monitor_api, ()),
+        ('cop', cop_api, ()),
+    ]
+    for crypto_pair in settings.RATES_REFRESHER_CRYPTO_PAIRS.split(','):
+        if '-' not in crypto_pair:
+            continue
+        symbol, currency = crypto_pair.strip().upper().split('-', 1)
+        jobs.append(('crypto', crypto_api, (symbol, currency)))
+    return jobs
+
+
+def get_next_delay(interval, failures):
+    """
+    Returns the seconds to wait before the next refresh: the interval
+    with +/- RATES_REFRESHER_JITTER ratio, or an exponential backoff
+    after failures, capped to the interval.
+    """
+    jitter = float(settings.RATES_REFRESHER_JITTER)
+    if failures:
+        delay = min(
+            float(settings.RATES_REFRESHER_BACKOFF_BASE) * 2 ** (failures - 1),
+            interval,
+        )
+    else:
+        delay = interval
+    return max(delay * random.uniform(1 - jitter, 1 + jitter), 1)
+
+
+class RatesRefresher:
+    """
+    asyncio scheduler that keeps the rates cache warm. Each job refreshes
+    one cached fetcher in the default executor, so the event loop is
+    never blocked by the scrapers.
+    """
+
+    def __init__(self):
+        self._tasks = []
+        self._status = {}
+
+    def is_running(self):
+        return any(not task.done() for task in self._tasks)
+
+    def start(self):
+        if self.is_running():
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self.run_job(provider, func, args))
+            for provider, func, args in get_refresh_jobs()
+        ]
+        log_normal(f'RatesRefresher started with {len(self._tasks)} jobs')
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_job(self, provider, func, args):
+        job_name = ':'.join((provider,) + args)
+        interval = get_refresh_interval(provider)
+        status = self._status[job_name] = {
+            'interval': interval,
+            'failures': 0,
+            'last_refresh': None,
+            'next_refresh': None,
+        }
+        # Small random delay so the jobs don't hit the upstreams together
+        delay = random.uniform(0, float(settings.RATES_REFRESHER_JITTER) * 10)
+        while True:
+            status['next_refresh'] = time.time() + delay
+            await asyncio.sleep(delay)
+            try:
+                api_response = await asyncio.to_thread(
+                    refresh_cached_rates, provider, func, *args
+                )
+            except Exception as err:
+                log_warning(f'RatesRefresher | {job_name} | ERROR: {err}')
+                api_response = None
+            if api_response is not None and not api_response['error']:
+                status['failures'] = 0
+                status['last_refresh'] = time.time()
+                log_debug(f'RatesRefresher | {job_name} | refreshed')
+            elif api_response is not None:
+                status['failures'] += 1
+                log_warning(
+                    f'RatesRefresher | {job_name} | ERROR: ' +
+                    f"{api_response['error_message']}"
+                )
+            delay = get_next_delay(interval, status['failures'])
+
+    def status(self):
+        return {
+            'running': self.is_running(),
+            'jobs': {
+                job_name: dict(job_status)
+                for job_name, job_status in self._status.items()
+            },
+        }
+
+
+rates_refresher = RatesRefresher()
@@ -0,0 +1,143 @@
+# utility_singleflight.py
+# Single-flight coalescing of identical in-flight upstream requests
+import asyncio
+import inspect
+import threading
+from functools import wraps
+
+from chalicelib.utility_general import log_debug
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Result of a cancelled async leader: its followers retry the call
+_LEADER_CANCELLED = object()
+
+
+class SingleFlight:
+    """
+    Concurrent callers with the same key wait on one in-flight call and
+    share its result (or its exception). The result object is shared, so
+    callers must not mutate it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats['coalesced'] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats['calls'] += 1
+                leader = True
+        if not leader:
+            log_debug(f'SingleFlight | waiting for in-flight call: {key}')
+            call.event.wait()
+        else:
+            try:
+                call.result = func()
+            except BaseException as err:
+                call.error = err
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, coro_func):
+        # Futures are bound to their event loop, so the loop is part of
+        # the key (e.g. asyncio.run() in tests vs. the uvicorn loop).
+        loop = asyncio.get_running_loop()
+        loop_key = (id(loop), key)
+        while True:
+            with self._lock:
+                future = self._async_calls.get(loop_key)
+                if future is not None:
+                    self._stats['coalesced'] += 1
+                    leader = False
+                else:
+                    future = self._async_calls[loop_key] = \
+                        loop.create_future()
+                    self._stats['calls'] += 1
+                    leader = True
+            if leader:
+                break
+            log_debug(f'SingleFlight | awaiting in-flight call: {key}')
+            result = await asyncio.shield(future)
+            if result is not _LEADER_CANCELLED:
+                return result
+            # Nothing cancelled this caller: one of the followers becomes
+            # the new leader
+            log_debug(f'SingleFlight | leader cancelled, retrying: {key}')
+        try:
+            result = await coro_func()
+        except asyncio.CancelledError:
+            future.set_result(_LEADER_CANCELLED)
+            raise
+        except BaseException as err:
+            future.set_exception(err)
+            # Mark the exception as retrieved in case there are no waiters
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._async_calls.pop(loop_key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                in_flight=len(self._calls) + len(self._async_calls),
+            )
+
+
+rates_flight = SingleFlight()
+
+
+def get_flight_key(key_prefix, *args):
+    return ':'.join([key_prefix] + [str(arg).upper() for arg in args])
+
+
+def single_flight(provider, name=None):
+    """
+    Decorator to coalesce concurrent calls to a rates fetcher with the same
+    provider (and 'name') and arguments. Works for plain and 'async def'
+    fetchers.
+    """
+    key_prefix = provider if name is None else f'{provider}:{name}'
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args):
+                return await rates_flight.do_async(
+                    get_flight_key(key_prefix, *args),
+                    lambda: func(*args),
+                )
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args):
+            return rates_flight.do(
+                get_flight_key(key_prefix, *args),
+                lambda: func(*args),
+            )
+        return wrapper
+    return decorator
@@ -2,30 +2,55 @@
 # Telegram error reporting
 import os
 import sys
-import requests
 
 from chalicelib.settings import settings
 from chalicelib.utility_general import log_normal
+from chalicelib.utility_http import http_get, async_http_get
 
 
-def send_tg_message(user_id, message):
+def get_tg_message_url(user_id, message):
     bot_token = settings.TELEGRAM_BOT_TOKEN
-    # Send the message
-    url = 'https://api.telegram.org/bot' + bot_token + \
+    return 'https://api.telegram.org/bot' + bot_token + \
         '/sendMessage?chat_id=' + user_id + \
         '&text=' + str(message)
-    response = requests.get(url)
+
+
+def send_tg_message(user_id, message):
+    # Send the message
+    response = http_get(get_tg_message_url(user_id, message))
     log_normal(response.content)
     return response
 
 
-def report_error_to_tg_group(api_response):
-    if not api_response['error']:
-        return
-    return send_tg_message(os.environ['TELEGRAM_CHAT_ID'], {
+async def send_tg_message_async(user_id, message):
+    response = await async_http_get(get_tg_message_url(user_id, message))
+    log_normal(response.content)
+    return response
+
+
+def get_error_report(api_response, calling_func):
+    return {
         'type': 'ERROR in a Mediabros API',
         'app_name': settings.APP_NAME,
         'server_name': settings.SERVER_NAME,
-        'calling_func': sys._getframe(1).f_code.co_name,
+        'calling_func': calling_func,
         'error_message': api_response['error_message'],
-    })
+    }
+
+
+def report_error_to_tg_group(api_response):
+    if not api_response['error']:
+        return
+    return send_tg_message(
+        os.environ['TELEGRAM_CHAT_ID'],
+        get_error_report(api_response, sys._getframe(1).f_code.co_name)
+    )
+
+
+async def report_error_to_tg_group_async(api_response):
+    if not api_response['error']:
+        return
+    return await send_tg_message_async(
+        os.environ['TELEGRAM_CHAT_ID'],
+        get_error_report(api_response, sys._getframe(1).f_code.co_name)
+    )
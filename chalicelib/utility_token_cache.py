@@ -0,0 +1,116 @@
+# utility_token_cache.py
+# Bounded LRU cache of verified JWT access tokens
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from chalicelib.settings import settings
+
+
+def get_token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+class TokenCache:
+    """
+    Verified access tokens, keyed by the token SHA-256 digest (the tokens
+    themselves are never kept), with the resolved user as the value.
+    An entry lives until the token 'exp' or 'max_age' seconds, whatever
+    comes first, so repeat calls with the same token skip the JWT decode
+    and the user lookup. The least recently used entry is evicted when
+    there are 'max_size' entries.
+    """
+
+    def __init__(self, max_size=None, max_age=None):
+        self._max_size = max_size
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                       'invalidations': 0}
+
+    def get_max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return int(settings.TOKEN_CACHE_MAX_SIZE)
+
+    def get_max_age(self):
+        if self._max_age is not None:
+            return self._max_age
+        return float(settings.TOKEN_CACHE_MAX_AGE)
+
+    def enabled(self):
+        return settings.TOKEN_CACHE_ENABLED == "1" and \
+            self.get_max_size() > 0
+
+    def get(self, token):
+        """
+        Returns the cached user of 'token', or None if it's not cached
+        or expired.
+        """
+        if not self.enabled():
+            return None
+        digest = get_token_digest(token)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry['expires_at'] <= time.time():
+                if entry is not None:
+                    del self._entries[digest]
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._stats['hits'] += 1
+            return entry['user']
+
+    def set(self, token, user, username, exp=None):
+        """
+        Caches the 'user' resolved from 'token'. 'exp' is the token
+        expiration (epoch seconds) from its verified payload.
+        """
+        if not self.enabled():
+            return
+        expires_at = time.time() + self.get_max_age()
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        digest = get_token_digest(token)
+        with self._lock:
+            self._entries[digest] = {
+                'user': user,
+                'username': username,
+                'expires_at': expires_at,
+            }
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.get_max_size():
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def invalidate_user(self, username):
+        """
+        Drops every cached token of 'username', e.g. when the user is
+        disabled. Returns the number of dropped tokens.
+        """
+        with self._lock:
+            digests = [
+                digest for digest, entry in self._entries.items()
+                if entry['username'] == username
+            ]
+            for digest in digests:
+                del self._entries[digest]
+            self._stats['invalidations'] += len(digests)
+        return len(digests)
+
+    def usernames(self):
+        with self._lock:
+            return {entry['username'] for entry in self._entries.values()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+
+verified_tokens = TokenCache()
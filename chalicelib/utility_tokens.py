@@ -0,0 +1,172 @@
+# utility_tokens.py
+# Prompt token counting and context window pre-flight for the OpenAI calls
+import importlib
+import json
+import threading
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_debug, log_warning
+
+
+# Context window (prompt + answer tokens) by model name prefix. The longest
+# matching prefix wins, e.g. "gpt-4o-mini" -> "gpt-4o"
+MODEL_CONTEXT_LIMITS = {
+    'gpt-3.5-turbo': 16385,
+    'gpt-4': 8192,
+    'gpt-4-32k': 32768,
+    'gpt-4-turbo': 128000,
+    'gpt-4-1106': 128000,
+    'gpt-4-0125': 128000,
+    'gpt-4o': 128000,
+    'gpt-4.1': 1047576,
+    'gpt-5': 400000,
+    'o1': 200000,
+    'o3': 200000,
+    'o4-mini': 200000,
+    'code-davinci-002': 8001,
+}
+# Chat format overhead: tokens per message, per 'name' and the answer
+# priming ("<|start|>assistant<|message|>")
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_NAME = 1
+REPLY_TOKENS = 3
+# Estimate when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = 'o200k_base'
+
+
+class PromptTooLong(Exception):
+    """
+    Raised when a prompt doesn't fit in the model context window, even
+    after trimming it.
+    """
+
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def load_encoding(model):
+    """
+    Returns the tiktoken encoding of 'model', or None if tiktoken (an
+    optional dependency) is not installed or cannot load it.
+    """
+    try:
+        tiktoken = importlib.import_module('tiktoken')
+    except ImportError:
+        log_debug('load_encoding | tiktoken not installed, estimating the'
+                  ' tokens')
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as err:
+        log_warning(f'load_encoding | {model} | ERROR: {err}')
+        return None
+
+
+def get_encoding(model):
+    with _encodings_lock:
+        if model not in _encodings:
+            _encodings[model] = load_encoding(model)
+        return _encodings[model]
+
+
+def count_text_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message, model):
+    tokens = TOKENS_PER_MESSAGE
+    for key, value in message.items():
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            # e.g. the content parts list of a multimodal message
+            value = json.dumps(value)
+        tokens += count_text_tokens(value, model)
+        if key == 'name':
+            tokens += TOKENS_PER_NAME
+    return tokens
+
+
+def count_prompt_tokens(messages, model):
+    return sum(count_message_tokens(message, model)
+               for message in messages) + REPLY_TOKENS
+
+
+def get_context_limits():
+    """
+    MODEL_CONTEXT_LIMITS with the OPENAI_CONTEXT_LIMITS envvar overrides,
+    e.g. "gpt-4=8192,my-fine-tuned-model=16385"
+    """
+    context_limits = dict(MODEL_CONTEXT_LIMITS)
+    for item in settings.OPENAI_CONTEXT_LIMITS.split(','):
+        if '=' not in item:
+            continue
+        model, limit = item.split('=', 1)
+        context_limits[model.strip()] = int(limit)
+    return context_limits
+
+
+def get_context_limit(model):
+    context_limits = get_context_limits()
+    prefixes = [prefix for prefix in context_limits
+                if str(model).startswith(prefix)]
+    if not prefixes:
+        return int(settings.OPENAI_DEFAULT_CONTEXT_LIMIT)
+    return context_limits[max(prefixes, key=len)]
+
+
+def fit_prompt(messages, model, max_tokens=None, default_max_tokens=2048,
+               min_max_tokens=10):
+    """
+    Pre-flight of a chat completions request: counts the prompt tokens and
+    makes room in the 'model' context window for the answer, 'max_tokens'
+    or up to 'default_max_tokens'. With OPENAI_PROMPT_PREFLIGHT "trim",
+    an oversized conversation loses its oldest messages (the system ones
+    and the last one are kept); with "reject" or if it still doesn't fit,
+    PromptTooLong is raised.
+    Returns a dict with the (trimmed) 'messages', 'prompt_tokens', the
+    derived 'max_tokens' and the number of 'trimmed' messages.
+    """
+    context_limit = get_context_limit(model)
+    if max_tokens is not None:
+        reserved = max(int(max_tokens), min_max_tokens)
+    else:
+        reserved = max(min(int(default_max_tokens), context_limit // 2),
+                       min_max_tokens)
+    budget = context_limit - reserved
+    counts = [count_message_tokens(message, model) for message in messages]
+    prompt_tokens = sum(counts) + REPLY_TOKENS
+    trimmed = 0
+    if prompt_tokens > budget and settings.OPENAI_PROMPT_PREFLIGHT == 'trim':
+        keep = [True] * len(messages)
+        for index, message in enumerate(messages[:-1]):
+            if prompt_tokens <= budget:
+                break
+            if message.get('role') == 'system':
+                continue
+            keep[index] = False
+            prompt_tokens -= counts[index]
+            trimmed += 1
+        messages = [message for message, kept in zip(messages, keep)
+                    if kept]
+    if prompt_tokens > budget:
+        raise PromptTooLong(
+            f'The prompt has {prompt_tokens} tokens and the {model} context'
+            f' limit is {context_limit}, with {reserved} for the answer')
+    if trimmed:
+        log_debug(f'fit_prompt | {model} | trimmed {trimmed} messages')
+    return {
+        'messages': messages,
+        'prompt_tokens': prompt_tokens,
+        'max_tokens': reserved if max_tokens is not None
+        else min(int(default_max_tokens), context_limit - prompt_tokens),
+        'trimmed': trimmed,
+    }
@@ -0,0 +1,169 @@
+# utility_warmup.py
+# Lambda warmup events: open the connection pools and prime the caches
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from chalicelib.settings import settings
+from chalicelib.utility_general import log_normal, log_warning
+from chalicelib.utility_http import get_session
+from chalicelib.utility_lazy_import import LazyModule
+
+
+boto3 = LazyModule('boto3')
+
+WARMUP_SOURCE = 'serverless-plugin-warmup'
+
+
+def is_warmup_event(event):
+    return isinstance(event, dict) and 'warmup' in event and \
+        event.get('source') == WARMUP_SOURCE
+
+
+def run_step(report, step_name, func, *args):
+    """
+    Runs one warmup step. A failed step is reported and logged, but
+    never fails the warmup.
+    """
+    start = time.monotonic()
+    try:
+        result = func(*args)
+    except Exception as err:
+        log_warning(f'warmup | {step_name} | ERROR: {err}')
+        result = f'ERROR: {err}'
+    report[step_name] = {
+        'result': result,
+        'ms': round((time.monotonic() - start) * 1000, 1),
+    }
+
+
+def warm_http():
+    get_session()
+    return 'ok'
+
+
+def warm_mongo():
+    if not settings.DB_URI:
+        return 'skipped'
+    from chalicelib.utility_db import db
+    db.command('ping')
+    return 'ok'
+
+
+def warm_jwks(jwks_fetcher):
+    if settings.AUTH0_ENABLED != "1" or jwks_fetcher is None:
+        return 'skipped'
+    jwks_fetcher(refresh=True)
+    return 'ok'
+
+
+def warm_password_hash():
+    """
+    Calibrates the password hash cost for this host ahead of the first
+    login.
+    """
+    if settings.JWT_ENABLED != "1":
+        return 'skipped'
+    from chalicelib.utility_password import get_hash_method
+    return get_hash_method()
+
+
+def prime_rates():
+    """
+    Calls every cached rates fetcher the background refresher knows,
+    plus the /convert cross-rate graph, so the first real request is a
+    cache hit. The upstreams are fetched concurrently and through the
+    same HTTP pools the requests use.
+    """
+    if settings.WARMUP_PRIME_RATES != "1":
+        return 'skipped'
+    from chalicelib.api_currency_exchange import convert, fetch_concurrently
+    from chalicelib.utility_rates_refresher import get_refresh_jobs
+    jobs = {
+        ':'.join((provider,) + args): partial(func, *args)
+        for provider, func, args in get_refresh_jobs()
+    }
+    jobs['rate_graph'] = partial(convert, 'USD', 'VES')
+    results = fetch_concurrently(*jobs.values())
+    return {
+        job_name: api_response['error_message'] or 'ok'
+        for job_name, api_response in zip(jobs, results)
+    }
+
+
+def get_concurrency(event):
+    return max(int(event.get('concurrency', settings.WARMUP_CONCURRENCY)), 1)
+
+
+def fan_out(event, context):
+    """
+    Invokes this function 'concurrency - 1' more times at the same time,
+    so that many containers are warm. Returns the invocation futures.
+    """
+    concurrency = get_concurrency(event)
+    if concurrency <= 1 or event.get('fanout_child') or context is None:
+        return []
+    client = boto3.client('lambda')
+    payload = json.dumps({
+        'source': WARMUP_SOURCE,
+        'warmup': True,
+        'fanout_child': True,
+    })
+    executor = ThreadPoolExecutor(max_workers=concurrency - 1)
+    futures = [
+        executor.submit(
+            client.invoke,
+            FunctionName=context.invoked_function_arn,
+            InvocationType='RequestResponse',
+            Payload=payload,
+        )
+        for _ in range(concurrency - 1)
+    ]
+    executor.shutdown(wait=False)
+    return futures
+
+
+def get_fan_out_result(futures):
+    invoked = 0
+    for future in futures:
+        try:
+            response = future.result()
+        except Exception as err:
+            log_warning(f'warmup | fan_out | ERROR: {err}')
+            continue
+        if response.get('StatusCode') == 200 and \
+           not response.get('FunctionError'):
+            invoked += 1
+    return {'requested': len(futures), 'invoked': invoked}
+
+
+def warmup(event, context=None, jwks_fetcher=None):
+    """
+    Handles a lambda warmup event: opens the pooled HTTP and Mongo
+    connections, fetches the Auth0 JWKS, calibrates the password hash
+    cost, primes the rates caches and, if the event 'concurrency' (or
+    WARMUP_CONCURRENCY) is N > 1, warms N containers at once. Returns the
+    per-step report.
+    """
+    start = time.monotonic()
+    report = {}
+    try:
+        futures = fan_out(event, context)
+    except Exception as err:
+        log_warning(f'warmup | fan_out | ERROR: {err}')
+        futures = []
+    run_step(report, 'http', warm_http)
+    run_step(report, 'mongo', warm_mongo)
+    run_step(report, 'jwks', warm_jwks, jwks_fetcher)
+    run_step(report, 'password_hash', warm_password_hash)
+    run_step(report, 'rates', prime_rates)
+    if event.get('fanout_child'):
+        # Keep this container busy while the siblings are invoked, so
+        # each invocation lands on a different container
+        time.sleep(float(settings.WARMUP_FANOUT_DELAY))
+    if futures:
+        report['fan_out'] = get_fan_out_result(futures)
+    report['ms'] = round((time.monotonic() - start) * 1000, 1)
+    log_normal(f'warmup | report: {report}')
+    return report
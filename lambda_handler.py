@@ -1,5 +1,6 @@
 import logging
-from app import app
+from app import app, get_jwks
+from chalicelib.utility_warmup import is_warmup_event, warmup
 
 
 # Configure logging
@@ -11,13 +12,14 @@ def lambda_handler(event, context):
     try:
         logger.info(f"Event: {event}")
 
-        # Add a check for warm-up events
-        if 'warmup' in event and \
-           event.get('source') == 'serverless-plugin-warmup':
+        # Warm-up events open the connection pools and prime the caches
+        if is_warmup_event(event):
+            report = warmup(event, context, get_jwks)
             logger.info("WarmUp - Lambda is warm!")
             return {
                 'statusCode': 200,
-                'body': 'Warmed up!'
+                'body': 'Warmed up!',
+                'warmup': report,
             }
 
         # Process the request through Chalice
@@ -222,7 +222,7 @@ def mock_auth_settings_globally():
     # Patching app.settings ensures that the settings instance
     # used by app.py is modified.
     with mock.patch(
-            'chalicelib.utility_jwt.fetch_user_by_entryname',
+            'chalicelib.model_users.fetch_user_by_entryname',
             return_value={
                 'error': False,
                 'found': True,
@@ -254,6 +254,115 @@ def mock_auth_settings_globally():
         yield
 
 
+@pytest.fixture(autouse=True)
+def reset_rates_circuit_breakers():
+    """
+    The circuit breakers are process-wide: a test with a failing upstream
+    must not make the next tests fail fast.
+    """
+    from chalicelib.utility_circuit_breaker import rates_breakers
+    rates_breakers.reset()
+    yield
+    rates_breakers.reset()
+
+
+@pytest.fixture(autouse=True)
+def isolate_rates_history_and_cache(tmp_path):
+    """
+    The mocked rates must not reach the real rates history files (read
+    back by later runs and local servers), nor stay in the process-wide
+    rates cache for the next tests.
+    """
+    from chalicelib import utility_rates_history
+    from chalicelib.utility_cache import rates_cache
+    rates_cache.invalidate()
+    with mock.patch.object(
+            utility_rates_history, 'rates_history',
+            utility_rates_history.RatesHistory(
+                str(tmp_path / 'rates_history'))):
+        yield
+    rates_cache.invalidate()
+
+
+@pytest.fixture(autouse=True)
+def reset_users_repository():
+    """
+    The users documents are cached per process.
+    """
+    from chalicelib.model_users import users_repository
+    users_repository.clear()
+    yield
+    users_repository.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_verified_tokens():
+    """
+    The verified access tokens are cached per process.
+    """
+    from chalicelib.utility_token_cache import verified_tokens
+    verified_tokens.clear()
+    yield
+    verified_tokens.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_auth0_connection():
+    """
+    The Auth0 connection and management tokens are kept per process.
+    """
+    from chalicelib.utility_auth0 import auth0_connection, management_tokens
+    auth0_connection.reset()
+    management_tokens.clear()
+    yield
+    auth0_connection.reset()
+    management_tokens.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_ai_response_cache():
+    """
+    The OpenAI responses are cached per process.
+    """
+    from chalicelib.utility_ai_cache import ai_response_cache
+    ai_response_cache.clear()
+    yield
+    ai_response_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_openai_rate_limiter():
+    """
+    The OpenAI rate limits are learned per process.
+    """
+    from chalicelib.utility_rate_limiter import openai_rate_limiter
+    openai_rate_limiter.clear()
+    yield
+    openai_rate_limiter.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_ai_usage():
+    """
+    The OpenAI usage totals are kept per process.
+    """
+    from chalicelib.utility_ai_usage import ai_usage
+    ai_usage.clear()
+    yield
+    ai_usage.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_jwks_cache():
+    """
+    The Auth0 JWKS is cached per process (per lambda container).
+    """
+    from app import jwks_cache
+    jwks_cache.clear()
+    yield
+    jwks_cache.clear()
+
+
 @pytest.fixture
 def mock_requires_auth():
     """Fixture to mock the requires_auth decorator."""
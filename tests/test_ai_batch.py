@@ -0,0 +1,139 @@
+"""
+/ai/batch test
+"""
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_openai
+from chalicelib.api_openai import (
+    openai_api_batch, openai_api_batch_async, get_openai_error)
+from chalicelib.settings import settings
+
+
+class ConcurrencyTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.calls = []
+
+    def start(self, request):
+        with self.lock:
+            self.calls.append(request)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+
+    def end(self):
+        with self.lock:
+            self.running -= 1
+
+
+def get_answer(request):
+    if request['q'] == 'fail':
+        return get_openai_error('OAI-040', 'Status Code: 429')
+    if request['q'] == 'raise':
+        raise RuntimeError('boom')
+    return f"{request['q']}:{request.get('p')}"
+
+
+@pytest.fixture
+def tracker():
+    tracker = ConcurrencyTracker()
+
+    def openai_api_with_defaults(request, user=None):
+        tracker.start(request)
+        try:
+            # The first item is the slowest, so it ends last
+            time.sleep(0.05 if request['q'] == 'q1' else 0.01)
+            return get_answer(request)
+        finally:
+            tracker.end()
+
+    async def openai_api_with_defaults_async(request, user=None):
+        tracker.start(request)
+        try:
+            await asyncio.sleep(0.01)
+            return get_answer(request)
+        finally:
+            tracker.end()
+
+    with mock.patch.object(api_openai, 'openai_api_with_defaults',
+                           openai_api_with_defaults), \
+         mock.patch.object(api_openai, 'openai_api_with_defaults_async',
+                           openai_api_with_defaults_async):
+        yield tracker
+
+
+def test_results_in_order_with_defaults(tracker):
+    response = openai_api_batch({
+        'items': [{'q': f'q{index}'} for index in range(1, 7)] +
+                 [{'q': 'q7', 'p': 'title_suggestion'}],
+        'p': 'eng_fr_translation',
+    })
+    assert response['error'] is False
+    assert response['errors'] == 0
+    assert [result['data'] for result in response['data']] == [
+        f'q{index}:eng_fr_translation' for index in range(1, 7)
+    ] + ['q7:title_suggestion']
+    assert tracker.max_running > 1
+
+
+def test_concurrency_cap(tracker):
+    with mock.patch.object(settings, 'AI_BATCH_CONCURRENCY', '3'):
+        openai_api_batch({'items': [{'q': f'q{index}'}
+                                    for index in range(9)]})
+        assert tracker.max_running <= 3
+        tracker.max_running = 0
+        openai_api_batch({'items': [{'q': f'q{index}'}
+                                    for index in range(9)],
+                          'concurrency': 50})
+        assert tracker.max_running <= 3
+
+
+def test_per_item_errors(tracker):
+    response = openai_api_batch({
+        'items': [{'q': 'ok'}, {'q': 'fail'}, {'q': 'raise'}, 'bad']
+    })
+    assert response['error'] is False
+    assert response['errors'] == 3
+    results = response['data']
+    assert results[0]['data'] == 'ok:None'
+    assert 'OAI-040' in results[1]['error_message']
+    assert 'boom' in results[2]['error_message']
+    assert 'OAI-090' in results[3]['error_message']
+
+
+def test_invalid_batch(tracker):
+    assert 'OAI-080' in openai_api_batch({})['error_message']
+    with mock.patch.object(settings, 'AI_BATCH_MAX_ITEMS', '2'):
+        response = openai_api_batch({'items': [{'q': 'a'}] * 3})
+    assert 'OAI-085' in response['error_message']
+    assert tracker.calls == []
+
+
+def test_async_batch(tracker):
+    with mock.patch.object(settings, 'AI_BATCH_CONCURRENCY', '2'):
+        response = asyncio.run(openai_api_batch_async({
+            'items': [{'q': f'q{index}'} for index in range(6)] +
+                     [{'q': 'fail'}],
+            'm': 'gpt-4o',
+        }))
+    assert [result['data'] for result in response['data'][:6]] == [
+        f'q{index}:None' for index in range(6)
+    ]
+    assert response['errors'] == 1
+    assert tracker.max_running == 2
+    assert all(call['m'] == 'gpt-4o' for call in tracker.calls)
+
+
+def test_chalice_ai_batch(client, mock_requires_auth):
+    with mock.patch('app.openai_api_batch',
+                    return_value={'error': False, 'data': []}) as mock_batch:
+        response = client.post('/ai/batch', json={'items': [{'q': 'a'}]})
+    assert response.status_code == 200
+    mock_batch.assert_called_once_with({'items': [{'q': 'a'}]}, 'mock_user')
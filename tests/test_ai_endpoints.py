@@ -33,4 +33,4 @@ def test_codex_get_endpoint(client, mock_requires_auth, mock_openai_api):
     mock_requires_auth.assert_called_once()
     # Check that the 'm' parameter was correctly added for codex
     mock_openai_api.assert_called_once_with({
-        'q': 'test query', 'm': 'code-davinci-002'})
+        'q': 'test query', 'm': 'code-davinci-002'}, 'mock_user')
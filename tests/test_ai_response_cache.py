@@ -0,0 +1,98 @@
+"""
+OpenAI exact-match response cache test
+"""
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_openai
+from chalicelib.api_openai import (
+    openai_api_general, openai_api_general_async, openai_api_with_defaults)
+from chalicelib.utility_ai_cache import (
+    AiResponseCache, ai_response_cache, get_ai_cache_key)
+
+
+OPENAI_RESPONSE = {
+    'choices': [{'message': {'role': 'assistant', 'content': 'Hello!'}}],
+    'usage': {'total_tokens': 12},
+}
+
+
+def get_http_response(status_code=200, body=OPENAI_RESPONSE):
+    http_response = mock.MagicMock()
+    http_response.status_code = status_code
+    http_response.json.side_effect = lambda: {
+        key: value for key, value in body.items()}
+    http_response.text = str(body)
+    return http_response
+
+
+@pytest.fixture
+def mock_http_post():
+    with mock.patch.object(api_openai, 'http_post',
+                           return_value=get_http_response()) as mock_post:
+        yield mock_post
+
+
+def test_temperature_zero_is_cached(mock_http_post):
+    start_stats = ai_response_cache.stats()
+    assert openai_api_general('Hola', temperature='0') == 'Hello!'
+    assert openai_api_general(' Hola ', temperature='0.0') == 'Hello!'
+    mock_http_post.assert_called_once()
+    stats = ai_response_cache.stats()
+    assert stats['hits'] - start_stats['hits'] == 1
+    assert stats['saved_tokens'] - start_stats['saved_tokens'] == 12
+
+
+def test_non_deterministic_requests_are_not_cached(mock_http_post):
+    openai_api_general('Hola', temperature='1')
+    openai_api_general('Hola', temperature='1')
+    assert mock_http_post.call_count == 2
+    assert ai_response_cache.stats()['size'] == 0
+
+
+def test_opt_in_and_opt_out(mock_http_post):
+    openai_api_with_defaults({'q': 'Hola', 'cache': '1'})
+    debug_response = openai_api_with_defaults(
+        {'q': 'Hola', 'cache': '1', 'debug': '1'})
+    assert debug_response['data']['cached'] is True
+    openai_api_with_defaults({'q': 'Hola', 't': '0', 'cache': '0'})
+    assert mock_http_post.call_count == 2
+
+
+def test_errors_are_not_cached(mock_http_post):
+    mock_http_post.return_value = get_http_response(400, {'error': 'x'})
+    for _ in range(2):
+        assert openai_api_general('Hola', temperature='0')['error']
+    assert mock_http_post.call_count == 2
+
+
+def test_async_shares_the_cache(mock_http_post):
+    openai_api_general('Hola', temperature='0')
+    with mock.patch.object(api_openai, 'async_http_post') as mock_async_post:
+        assert asyncio.run(
+            openai_api_general_async('Hola', temperature='0')) == 'Hello!'
+    mock_async_post.assert_not_called()
+
+
+def test_key_depends_on_model_and_max_tokens():
+    messages = [{'role': 'user', 'content': 'Hola'}]
+    key = get_ai_cache_key('gpt-4', messages, '0', None)
+    assert key == get_ai_cache_key('gpt-4', messages, 0, None)
+    assert key != get_ai_cache_key('gpt-4o', messages, '0', None)
+    assert key != get_ai_cache_key('gpt-4', messages, '0', '100')
+
+
+def test_lru_and_ttl_eviction():
+    cache = AiResponseCache(max_size=2, ttl=60)
+    cache.set('a', {'answer': 'a'})
+    cache.set('b', {'answer': 'b'})
+    assert cache.get('a') == {'answer': 'a'}
+    cache.set('c', {'answer': 'c'})
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+    with mock.patch('chalicelib.utility_ai_cache.time.time',
+                    return_value=10**12):
+        assert cache.get('a') is None
@@ -0,0 +1,175 @@
+"""
+/ai streaming (server-sent events) test
+"""
+
+import asyncio
+import json
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_openai
+from chalicelib.api_openai import (
+    get_stream_delta, openai_api_stream, openai_api_stream_async,
+    openai_api_general)
+from chalicelib.utility_ai_cache import ai_response_cache
+
+
+def get_chunk(content):
+    return 'data: ' + json.dumps(
+        {'choices': [{'delta': {'content': content}}]})
+
+
+STREAM_LINES = [
+    'data: ' + json.dumps({'choices': [{'delta': {'role': 'assistant'}}]}),
+    '',
+    get_chunk('Hel'),
+    get_chunk('lo!'),
+    'data: [DONE]',
+]
+
+
+def get_stream_response(status_code=200, lines=STREAM_LINES):
+    http_response = mock.MagicMock()
+    http_response.status_code = status_code
+    http_response.text = 'bad request'
+    http_response.iter_lines.return_value = iter(lines)
+    return http_response
+
+
+@pytest.fixture
+def mock_http_post_stream():
+    """
+    Yields the mock: its 'calls' are the http_post_stream() kwargs and its
+    'response' is the streamed response.
+    """
+    stream_mock = mock.MagicMock(calls=[], response=get_stream_response())
+
+    @contextmanager
+    def http_post_stream(url, **kwargs):
+        stream_mock.calls.append(kwargs)
+        yield stream_mock.response
+
+    with mock.patch.object(api_openai, 'http_post_stream', http_post_stream):
+        yield stream_mock
+
+
+def get_events(events):
+    return [event for event in ''.join(events).split('\n\n') if event]
+
+
+def test_get_stream_delta():
+    assert get_stream_delta(get_chunk('Hi')) == 'Hi'
+    assert get_stream_delta(STREAM_LINES[0]) == ''
+    assert get_stream_delta(': keep-alive') == ''
+    assert get_stream_delta('data: [DONE]') is None
+
+
+def test_stream_forwards_the_deltas(mock_http_post_stream):
+    events = get_events(openai_api_stream('Hola'))
+    assert events == [
+        'data: {"delta": "Hel"}',
+        'data: {"delta": "lo!"}',
+        'data: [DONE]',
+    ]
+    request_data = json.loads(mock_http_post_stream.calls[0]['data'])
+    assert request_data['stream'] is True
+
+
+def test_stream_error_event(mock_http_post_stream):
+    mock_http_post_stream.response = get_stream_response(400)
+    events = get_events(openai_api_stream('Hola'))
+    assert len(events) == 1
+    assert events[0].startswith('event: error\n')
+    assert 'OAI-040' in events[0]
+
+
+def test_stream_no_question():
+    events = get_events(openai_api_stream(None))
+    assert 'OAI-010' in events[0]
+
+
+def test_streamed_answer_is_cached(mock_http_post_stream):
+    hits = ai_response_cache.stats()['hits']
+    get_events(openai_api_stream('Hola', temperature='0'))
+    with mock.patch.object(api_openai, 'http_post') as mock_http_post:
+        assert openai_api_general('Hola', temperature='0') == 'Hello!'
+        assert get_events(openai_api_stream('Hola', temperature='0')) == [
+            'data: {"delta": "Hello!"}',
+            'data: [DONE]',
+        ]
+    mock_http_post.assert_not_called()
+    assert len(mock_http_post_stream.calls) == 1
+    assert ai_response_cache.stats()['hits'] - hits == 2
+
+
+def test_streamed_answer_is_cached_as_a_chat_completion(
+    mock_http_post_stream
+):
+    usage = {'prompt_tokens': 9, 'completion_tokens': 3, 'total_tokens': 12}
+    mock_http_post_stream.response = get_stream_response(lines=[
+        'data: ' + json.dumps({
+            'id': 'chatcmpl-1', 'created': 1700000000, 'model': 'gpt-4',
+            'choices': [{'delta': {'role': 'assistant'}}]}),
+        get_chunk('Hel'),
+        'data: ' + json.dumps({
+            'id': 'chatcmpl-1',
+            'choices': [{'delta': {'content': 'lo!'},
+                         'finish_reason': 'stop'}]}),
+        'data: ' + json.dumps({'id': 'chatcmpl-1', 'choices': [],
+                               'usage': usage}),
+        'data: [DONE]',
+    ])
+    saved_tokens = ai_response_cache.stats()['saved_tokens']
+    get_events(openai_api_stream('Hola', temperature='0'))
+    with mock.patch.object(api_openai, 'http_post') as mock_http_post:
+        openai_response = openai_api_general(
+            'Hola', temperature='0', debug=True)['data']
+    mock_http_post.assert_not_called()
+    assert openai_response['id'] == 'chatcmpl-1'
+    assert openai_response['object'] == 'chat.completion'
+    assert openai_response['model'] == 'gpt-4'
+    assert openai_response['usage'] == usage
+    assert openai_response['choices'][0] == {
+        'index': 0,
+        'message': {'role': 'assistant', 'content': 'Hello!'},
+        'finish_reason': 'stop',
+    }
+    assert ai_response_cache.stats()['saved_tokens'] - saved_tokens == 12
+
+
+def test_async_stream_forwards_the_deltas():
+    http_response = get_stream_response()
+
+    async def aiter_lines():
+        for line in STREAM_LINES:
+            yield line
+
+    http_response.aiter_lines = aiter_lines
+    stream_context = mock.MagicMock()
+    stream_context.__aenter__ = mock.AsyncMock(return_value=http_response)
+    stream_context.__aexit__ = mock.AsyncMock(return_value=False)
+
+    async def collect():
+        return [event async for event in openai_api_stream_async('Hola')]
+
+    with mock.patch.object(api_openai, 'async_http_post_stream',
+                           return_value=stream_context):
+        events = get_events(asyncio.run(collect()))
+    assert events[-1] == 'data: [DONE]'
+    assert events[:-1] == ['data: {"delta": "Hel"}', 'data: {"delta": "lo!"}']
+    stream_context.__aexit__.assert_awaited_once()
+
+
+def test_chalice_ai_stream(client, mock_requires_auth):
+    events = ['data: {"delta": "Hi"}\n\n', 'data: [DONE]\n\n']
+    with mock.patch('app.openai_api_stream_with_defaults',
+                    return_value=iter(events)) as mock_stream, \
+         mock.patch('app.openai_api_with_defaults') as mock_openai_api:
+        response = client.get('/ai?q=test+query&stream=1')
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'text/event-stream'
+    assert response.text == ''.join(events)
+    mock_stream.assert_called_once()
+    mock_openai_api.assert_not_called()
@@ -38,7 +38,8 @@ from app import (
     handle_auth_error,
     get_token_auth_header,
     requires_auth,
-    auth0_api_call
+    auth0_api_call,
+    jwks_cache,
 )
 
 from tests.conftest import (
@@ -366,9 +367,8 @@ def test_requires_auth_auth0_success(
 
         mock_jwt_decode.assert_called_with(
             'valid_token',
-            # mock.ANY,   # The key fetched from JWKS
-            # The key fetched from JWKS
-            jwks_key,
+            # The key fetched from JWKS, pre-parsed once by the JWKS cache
+            jwks_cache.get_key(unverified_header_kid),
             # From local patch on app.settings
             algorithms=['RS256'],
             # From local patch on app.settings
@@ -376,6 +376,8 @@ def test_requires_auth_auth0_success(
             # From local patch on app.settings
             issuer='https://' + AUTH0_DOMAIN_FIXTURE + '/'
         )
+        assert mock_jwt_decode.call_args.args[1].to_dict()['n'] == \
+            jwks_key['n']
 
 
 @mock.patch('app.get_token_auth_header')
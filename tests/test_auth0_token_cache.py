@@ -0,0 +1,102 @@
+"""
+Auth0 keep-alive connection and management token cache test
+"""
+
+import http.client
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from app import auth0_api_call
+from chalicelib import utility_auth0
+from chalicelib.utility_auth0 import auth0_connection, management_tokens
+
+
+def get_response(body, will_close=False):
+    response = mock.MagicMock()
+    response.status = 200
+    response.will_close = will_close
+    response.read.return_value = json.dumps(body).encode('utf-8')
+    return response
+
+
+def test_connection_is_reused():
+    stats = auth0_connection.stats()
+    with mock.patch('http.client.HTTPSConnection') as mock_conn_class:
+        mock_conn_class.return_value.getresponse.return_value = \
+            get_response({'key': 'value'})
+        for _ in range(3):
+            assert json.loads(auth0_api_call('/api/v2/users', {})) == \
+                {'key': 'value'}
+    mock_conn_class.assert_called_once_with('fixture.auth0.com')
+    mock_conn_class.return_value.close.assert_not_called()
+    assert auth0_connection.stats() == {
+        'requests': stats['requests'] + 3,
+        'connections': stats['connections'] + 1,
+    }
+
+
+def test_dropped_keep_alive_connection_is_retried():
+    with mock.patch('http.client.HTTPSConnection'):
+        conn = auth0_connection.get_connection('fixture.auth0.com')[0]
+    conn.request.side_effect = http.client.RemoteDisconnected('idle')
+    with mock.patch.object(http.client, 'HTTPSConnection') as new_conn_class:
+        new_conn_class.return_value.getresponse.return_value = \
+            get_response({'key': 'value'})
+        assert json.loads(auth0_api_call('/api/v2/users', {})) == \
+            {'key': 'value'}
+    conn.close.assert_called_once()
+    new_conn_class.assert_called_once_with('fixture.auth0.com')
+
+
+@pytest.fixture
+def mock_token_fetch():
+    with mock.patch('app.auth0_api_call') as mock_call, \
+         mock.patch.dict(os.environ, {'AUTH0_MAPI_API_TOKEN': '',
+                                      'AUTH0_MAPI_CLIENT_ID': 'client_id'}):
+        mock_call.return_value = json.dumps({
+            'access_token': 'mapi_token',
+            'expires_in': 86400,
+            'token_type': 'Bearer',
+        })
+        yield mock_call
+
+
+def test_login_token_is_cached(client, mock_token_fetch):
+    for _ in range(3):
+        response = client.get('/login')
+        assert response.status_code == 200
+        assert response.json_body['access_token'] == 'mapi_token'
+        assert response.json_body['expires_in'] <= 86400
+    mock_token_fetch.assert_called_once()
+    assert management_tokens.stats()['hits'] == 2
+
+
+def test_client_grant_uses_the_cached_token(client, mock_token_fetch):
+    client.get('/login')
+    client.get('/auth0_client_grant')
+    assert mock_token_fetch.call_count == 2
+    endpoint_suffix, _, headers = mock_token_fetch.call_args.args
+    assert endpoint_suffix == '/api/v2/client-grants'
+    assert headers == {'Authorization': 'Bearer mapi_token'}
+
+
+def test_early_refresh_and_error_fallback(mock_token_fetch):
+    fetcher = mock.MagicMock(side_effect=[
+        mock_token_fetch.return_value,
+        json.dumps({'error': 'access_denied'}),
+    ])
+    token = management_tokens.get('key', fetcher)
+    now = utility_auth0.time.time()
+    # Inside the early refresh window: the refresh fails, the current
+    # token is still valid
+    with mock.patch.object(utility_auth0.time, 'time',
+                           return_value=now + 86400 - 10):
+        assert management_tokens.get('key', fetcher)['access_token'] == \
+            token['access_token']
+    assert fetcher.call_count == 2
+    # Errors are not cached
+    assert management_tokens.get('other_key', lambda: '{"error": "x"}') == \
+        '{"error": "x"}'
@@ -0,0 +1,42 @@
+"""
+Sync auth core test: the Chalice path runs no event loops
+"""
+
+import asyncio
+import datetime
+from unittest import mock
+
+from fastapi import HTTPException
+
+from chalicelib.utility_jwt import (
+    create_access_token, get_current_active_user,
+    get_current_active_user_chalice, get_current_user)
+
+
+def get_token(username='mock_user'):
+    return create_access_token(
+        data={'sub': username},
+        expires_delta=datetime.timedelta(minutes=30)
+    )
+
+
+def test_chalice_auth_runs_no_event_loop():
+    with mock.patch('asyncio.run') as mock_asyncio_run, \
+         mock.patch('asyncio.new_event_loop') as mock_new_event_loop:
+        user = get_current_active_user_chalice(get_token())
+    assert user.username == 'mock_user'
+    mock_asyncio_run.assert_not_called()
+    mock_new_event_loop.assert_not_called()
+
+
+def test_chalice_auth_returns_the_http_exception():
+    response = get_current_active_user_chalice('invalid_token')
+    assert isinstance(response, HTTPException)
+    assert response.status_code == 401
+
+
+def test_fastapi_dependencies_use_the_same_core():
+    async def get_active_user(token):
+        return await get_current_active_user(await get_current_user(token))
+    user = asyncio.run(get_active_user(get_token()))
+    assert user.username == 'mock_user'
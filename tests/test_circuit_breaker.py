@@ -0,0 +1,113 @@
+"""
+Per-provider circuit breaker test
+"""
+
+import asyncio
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_currency_exchange
+from chalicelib.api_currency_exchange import (
+    crypto, is_crypto_upstream_failure)
+from chalicelib.utility_cache import cached_rates, rates_cache
+from chalicelib.utility_circuit_breaker import (
+    CircuitBreaker, circuit_breaker, rates_breakers,
+    CLOSED, OPEN, HALF_OPEN)
+
+
+OK_RESPONSE = {'error': False, 'error_message': '', 'data': {'USD': 1.5}}
+ERROR_RESPONSE = {'error': True, 'error_message': 'ERROR: down', 'data': {}}
+
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+    rates_cache.invalidate()
+    yield
+    rates_cache.invalidate()
+
+
+def test_breaker_states():
+    breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=10)
+    with mock.patch('time.time', return_value=1000.0):
+        assert breaker.allow_call()
+        breaker.record_success('test:A', OK_RESPONSE)
+        for _ in range(2):
+            assert breaker.allow_call()
+            breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow_call()
+    with mock.patch('time.time', return_value=1012.0):
+        fallback = breaker.get_fallback('test:A')
+        assert fallback['data'] == OK_RESPONSE['data']
+        assert fallback['last_known_good']['age'] == 12.0
+        assert breaker.get_fallback('test:B')['error']
+        # Half-open: a single trial call at a time
+        assert breaker.allow_call()
+        assert breaker.state == HALF_OPEN
+        assert not breaker.allow_call()
+        breaker.record_failure()
+        assert breaker.state == OPEN
+    with mock.patch('time.time', return_value=1030.0):
+        assert breaker.allow_call()
+        breaker.record_success('test:A', OK_RESPONSE)
+        assert breaker.state == CLOSED
+    assert breaker.stats()['opened'] == 2
+
+
+def test_decorated_fetcher_fails_fast():
+    upstream = mock.MagicMock(return_value=dict(OK_RESPONSE))
+
+    @cached_rates('test_provider')
+    @circuit_breaker('test_provider')
+    def fake_api(symbol):
+        return upstream()
+
+    with mock.patch.object(api_currency_exchange.settings,
+                           'CIRCUIT_BREAKER_FAILURE_THRESHOLD', '2'), \
+         mock.patch.object(api_currency_exchange.settings,
+                           'RATES_CACHE_ENABLED', '0'):
+        assert fake_api('btc') == OK_RESPONSE
+        upstream.return_value = dict(ERROR_RESPONSE)
+        assert fake_api('btc')['error']
+        assert fake_api('btc')['error']
+        upstream.side_effect = AssertionError('upstream called while open')
+        api_response = fake_api('btc')
+    assert api_response['data'] == OK_RESPONSE['data']
+    assert api_response['circuit_breaker'] == OPEN
+    assert 'age' in api_response['last_known_good']
+    assert upstream.call_count == 3
+    # The last known good fallback is never cached as a fresh value
+    rates_cache.set('test_provider:BTC', 'test_provider', api_response)
+    assert rates_cache.get_entry('test_provider:BTC') is None
+
+
+def test_async_decorated_fetcher():
+    @circuit_breaker('test_async')
+    async def fake_api_async():
+        raise ValueError('upstream down')
+
+    with mock.patch.object(api_currency_exchange.settings,
+                           'CIRCUIT_BREAKER_FAILURE_THRESHOLD', '1'):
+        with pytest.raises(ValueError):
+            asyncio.run(fake_api_async())
+        api_response = asyncio.run(fake_api_async())
+    assert api_response['error']
+    assert rates_breakers.get('test_async').state == OPEN
+
+
+def test_crypto_request_errors_dont_open_the_circuit():
+    invalid_symbol = dict(ERROR_RESPONSE, data={
+        'Response': 'Error', 'Message': 'fsym is a required param.'})
+    assert not is_crypto_upstream_failure(invalid_symbol)
+    assert is_crypto_upstream_failure(ERROR_RESPONSE)
+
+
+def test_crypto_message_shows_last_known_good_age():
+    api_response = dict(OK_RESPONSE, last_known_good={
+        'timestamp': 1000.0, 'age': 125.4})
+    with mock.patch.object(api_currency_exchange, 'crypto_api',
+                           return_value=api_response):
+        response_message = crypto('btc', 'usd', False)
+    assert 'The BTC to USD exchange rate is: 1.50' in response_message
+    assert 'last known value from 125 seconds ago' in response_message
@@ -0,0 +1,90 @@
+"""
+CRYPTO BATCH endpoint test
+"""
+
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+
+from chalicelib import api_currency_exchange
+from chalicelib.api_currency_exchange import crypto_batch_async
+from chalicelib.utility_cache import rates_cache
+
+
+# http://127.0.0.1:5001/crypto_batch?symbols=BTC,ETH&currencies=USD,EUR
+#
+# Returns:
+# {"error": false, "error_message": "",
+#  "data": {"BTC": {"USD": 109437.64, "EUR": 96420.1},
+#           "ETH": {"USD": 2561.3, "EUR": 2256.8}},
+#  "missing": []}
+
+
+PRICEMULTI_RESPONSE = {
+    'BTC': {'USD': 109437.64, 'EUR': 96420.1},
+    'ETH': {'USD': 2561.3, 'EUR': 2256.8},
+}
+
+
+@pytest.fixture
+def mock_pricemulti():
+    rates_cache.invalidate()
+    with mock.patch('chalicelib.api_currency_exchange.http_get') \
+            as mock_http_get:
+        mock_http_get.return_value.status_code = 200
+        mock_http_get.return_value.json.return_value = PRICEMULTI_RESPONSE
+        yield mock_http_get
+    rates_cache.invalidate()
+
+
+def test_crypto_batch(client, mock_pricemulti):
+    response = client.get('/crypto_batch?symbols=btc,eth,btc1'
+                          '&currencies=USD,EUR')
+    assert response.status_code == 200
+    assert response.json_body['error'] is False
+    assert response.json_body['data'] == {
+        'BTC': {'USD': 109437.64, 'EUR': 96420.1},
+        'ETH': {'USD': 2561.3, 'EUR': 2256.8},
+        'BTC1': {},
+    }
+    assert response.json_body['missing'] == ['BTC1-USD', 'BTC1-EUR']
+    assert 'messages' not in response.json_body
+    # One upstream call for the whole matrix
+    mock_pricemulti.assert_called_once_with(
+        'https://min-api.cryptocompare.com/data/pricemulti?'
+        'fsyms=BTC,ETH,BTC1&tsyms=USD,EUR')
+
+
+def test_crypto_batch_formatted(client, mock_pricemulti):
+    response = client.get('/crypto_batch?symbols=BTC,ETH&formatted=1')
+    assert response.status_code == 200
+    assert response.json_body['messages']['BTC']['USD'] == \
+        'The BTC to USD exchange rate is: 109437.64'
+    assert response.json_body['messages']['ETH']['USD'] == \
+        'The ETH to USD exchange rate is: 2561.30'
+
+
+def test_crypto_batch_no_symbols(client, mock_pricemulti):
+    response = client.get('/crypto_batch')
+    assert response.status_code == 200
+    assert response.json_body['error'] is True
+    assert response.json_body['error_message'] == \
+        'ERROR: no symbols supplied'
+    mock_pricemulti.assert_not_called()
+
+
+def test_crypto_batch_async(mock_pricemulti):
+    async def fake_get(url, **kwargs):
+        return httpx.Response(200, json=PRICEMULTI_RESPONSE)
+
+    with mock.patch.object(api_currency_exchange, 'async_http_get',
+                           side_effect=fake_get) as mock_get:
+        api_response = asyncio.run(crypto_batch_async('BTC,ETH', 'usd', True))
+    assert api_response['data'] == {
+        'BTC': {'USD': 109437.64}, 'ETH': {'USD': 2561.3}}
+    assert api_response['messages']['ETH']['USD'] == \
+        'The ETH to USD exchange rate is: 2561.30'
+    mock_get.assert_called_once()
+    mock_pricemulti.assert_not_called()
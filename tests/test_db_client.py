@@ -0,0 +1,57 @@
+"""
+Process-wide pooled MongoClient test
+"""
+
+from unittest import mock
+
+import pytest
+
+from chalicelib import utility_db
+from chalicelib.utility_db import db, get_client, reset_client
+
+
+@pytest.fixture
+def mock_mongo_client():
+    reset_client(close=False)
+    with mock.patch.object(utility_db, 'MongoClient') as mock_client_class, \
+         mock.patch.object(utility_db.settings, 'DB_URI',
+                           'mongodb://localhost:27017'), \
+         mock.patch.object(utility_db.settings, 'DB_NAME', 'test_db'):
+        mock_client_class.side_effect = lambda *args, **kwargs: \
+            mock.MagicMock()
+        yield mock_client_class
+    reset_client(close=False)
+
+
+def test_client_is_reused(mock_mongo_client):
+    assert get_client() is get_client()
+    db.users.find_one({'username': 'mock_user'})
+    db.users.find_one({'username': 'mock_user'})
+    mock_mongo_client.assert_called_once()
+    kwargs = mock_mongo_client.call_args.kwargs
+    assert kwargs['maxPoolSize'] == 10
+    assert kwargs['serverSelectionTimeoutMS'] == 5000
+    get_client().get_database.assert_called_with('test_db')
+
+
+def test_new_client_after_fork(mock_mongo_client):
+    client = get_client()
+    with mock.patch('os.getpid', return_value=-1):
+        assert get_client() is not client
+    utility_db._reset_client_after_fork()
+    assert get_client() is not client
+    assert mock_mongo_client.call_count == 3
+
+
+def test_unhealthy_client_is_replaced(mock_mongo_client):
+    client = get_client()
+    client.admin.command.side_effect = Exception('connection reset')
+    with mock.patch.object(utility_db.settings,
+                           'DB_HEALTH_CHECK_INTERVAL', '0.000001'):
+        new_client = get_client()
+    assert new_client is not client
+    client.close.assert_called_once()
+    with mock.patch.object(utility_db.settings,
+                           'DB_HEALTH_CHECK_INTERVAL', '0'):
+        assert get_client() is new_client
+    new_client.admin.command.assert_not_called()
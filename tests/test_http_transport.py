@@ -0,0 +1,88 @@
+"""
+Shared HTTP transport test
+"""
+
+import asyncio
+from unittest import mock
+
+import httpx
+
+from chalicelib import utility_http, api_currency_exchange
+from chalicelib.api_currency_exchange import crypto_api_async
+from chalicelib.utility_cache import rates_cache
+from chalicelib.utility_http import (
+    get_session, reset_session, http_get, get_timeout, get_async_client,
+    close_async_client)
+
+
+def test_session_is_reused():
+    reset_session()
+    assert get_session() is get_session()
+    assert 'gzip' in get_session().headers['Accept-Encoding']
+    reset_session()
+
+
+def test_host_pool_sizes():
+    with mock.patch.object(utility_http.settings, 'HTTP_POOL_SIZES',
+                           'api.openai.com=20, bad_item'):
+        reset_session()
+        adapter = get_session().get_adapter(
+            'https://api.openai.com/v1/chat/completions')
+        assert adapter._pool_maxsize == 20
+        default_adapter = get_session().get_adapter('https://example.com')
+        assert default_adapter._pool_maxsize == 10
+    reset_session()
+
+
+def test_http_get_sets_timeouts():
+    with mock.patch.object(utility_http, 'get_session') as mock_session:
+        http_get('https://example.com')
+        mock_session.return_value.get.assert_called_once_with(
+            'https://example.com', timeout=get_timeout())
+        assert get_timeout(5)[1] == 5.0
+
+
+def test_async_client_is_reused_per_loop():
+    async def get_clients():
+        return get_async_client(), get_async_client()
+
+    first, second = asyncio.run(get_clients())
+    assert first is second
+    assert asyncio.run(get_clients())[0] is not first
+
+
+def test_async_client_is_closed():
+    async def close_client():
+        client = get_async_client()
+        await close_async_client()
+        new_client = get_async_client()
+        assert new_client is not client and not new_client.is_closed
+        await close_async_client()
+        return client
+
+    assert asyncio.run(close_client()).is_closed
+
+
+def test_lifespan_closes_the_async_client():
+    from chalicelib.index import api, lifespan
+
+    async def run_lifespan():
+        async with lifespan(api):
+            client = get_async_client()
+        return client
+
+    assert asyncio.run(run_lifespan()).is_closed
+
+
+def test_crypto_api_async_is_cached():
+    async def fake_get(url, **kwargs):
+        return httpx.Response(200, json={'USD': 65000.0})
+
+    rates_cache.invalidate()
+    with mock.patch.object(api_currency_exchange, 'async_http_get',
+                           side_effect=fake_get) as mock_get:
+        for _ in range(2):
+            api_response = asyncio.run(crypto_api_async('btc', 'usd'))
+            assert api_response['data'] == {'USD': 65000.0}
+    mock_get.assert_called_once()
+    rates_cache.invalidate()
@@ -0,0 +1,79 @@
+"""
+Auth0 JWKS cache test
+"""
+
+from unittest import mock
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jose.backends.base import Key
+
+from chalicelib.utility_jwks import JwksCache
+
+
+def get_signing_key(kid):
+    private_key = rsa.generate_private_key(
+        public_exponent=65537, key_size=2048)
+    public_jwk = jwk.construct(
+        private_key.public_key(), 'RS256').to_dict()
+    public_jwk.update({'kid': kid, 'use': 'sig'})
+    return private_key, public_jwk
+
+
+@pytest.fixture
+def signing_key():
+    return get_signing_key('kid_1')
+
+
+def test_keys_are_pre_parsed_and_verify_locally(signing_key):
+    private_key, public_jwk = signing_key
+    fetcher = mock.MagicMock(return_value={'keys': [public_jwk]})
+    cache = JwksCache(fetcher, ttl=3600, min_refresh_interval=60)
+    token = jwt.encode({'sub': 'mock_user'}, private_key, algorithm='RS256',
+                       headers={'kid': 'kid_1'})
+    for _ in range(3):
+        key = cache.get_key(jwt.get_unverified_header(token)['kid'])
+        assert isinstance(key, Key)
+        assert jwt.decode(token, key, algorithms=['RS256']) == \
+            {'sub': 'mock_user'}
+    fetcher.assert_called_once()
+    assert cache.stats()['hits'] == 3
+
+
+def test_unknown_kid_refetch_is_rate_limited(signing_key):
+    _, public_jwk = signing_key
+    _, rotated_jwk = get_signing_key('kid_2')
+    fetcher = mock.MagicMock(side_effect=[
+        {'keys': [public_jwk]},
+        {'keys': [public_jwk, rotated_jwk]},
+    ])
+    cache = JwksCache(fetcher, ttl=3600, min_refresh_interval=60)
+    cache.get_jwks()
+    with mock.patch('chalicelib.utility_jwks.time.time',
+                    return_value=cache.stats()['fetched_at'] + 61):
+        # Keys rotation: one re-fetch finds the new kid
+        assert cache.get_key('kid_2') is not None
+        # A bogus kid right after cannot trigger another re-fetch
+        assert cache.get_key('bogus_kid') is None
+    assert fetcher.call_count == 2
+
+
+def test_expired_jwks_refetch_failure_keeps_old_keys(signing_key):
+    _, public_jwk = signing_key
+    fetcher = mock.MagicMock(side_effect=[
+        {'keys': [public_jwk]},
+        Exception('JWKS endpoint down'),
+    ])
+    cache = JwksCache(fetcher, ttl=0, min_refresh_interval=0)
+    assert cache.get_key('kid_1') is not None
+    assert cache.get_key('kid_1') is not None
+    assert fetcher.call_count == 2
+    assert cache.stats()['errors'] == 1
+
+
+def test_first_fetch_failure_raises():
+    fetcher = mock.MagicMock(side_effect=Exception('JWKS endpoint down'))
+    cache = JwksCache(fetcher)
+    with pytest.raises(Exception):
+        cache.get_key('kid_1')
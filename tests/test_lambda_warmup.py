@@ -0,0 +1,79 @@
+"""
+Lambda warmup events test
+"""
+
+from unittest import mock
+
+import pytest
+
+from chalicelib import utility_warmup
+from lambda_handler import lambda_handler
+
+
+WARMUP_EVENT = {'source': 'serverless-plugin-warmup', 'warmup': True}
+
+
+@pytest.fixture
+def mock_rates():
+    api_response = {'error': False, 'error_message': '', 'data': {}}
+    fetcher = mock.MagicMock(return_value=api_response)
+    jobs = [('bcv', fetcher, ()), ('crypto', fetcher, ('BTC', 'USD'))]
+    with mock.patch('chalicelib.utility_rates_refresher.get_refresh_jobs',
+                    return_value=jobs), \
+         mock.patch('chalicelib.api_currency_exchange.convert',
+                    return_value=api_response) as mock_convert:
+        yield fetcher, mock_convert
+
+
+def test_warmup_event_primes_the_caches(mock_rates):
+    fetcher, mock_convert = mock_rates
+    response = lambda_handler(WARMUP_EVENT, None)
+    assert response['statusCode'] == 200
+    report = response['warmup']
+    assert report['rates']['result'] == {
+        'bcv': 'ok', 'crypto:BTC:USD': 'ok', 'rate_graph': 'ok'}
+    assert report['http']['result'] == 'ok'
+    assert report['mongo']['result'] == 'skipped'
+    assert report['jwks']['result'] == 'skipped'
+    assert report['password_hash']['result'].startswith('scrypt:')
+    fetcher.assert_has_calls([mock.call(), mock.call('BTC', 'USD')],
+                             any_order=True)
+    mock_convert.assert_called_once_with('USD', 'VES')
+
+
+def test_warmup_fetches_jwks(mock_rates):
+    jwks_fetcher = mock.MagicMock()
+    with mock.patch.object(utility_warmup.settings, 'AUTH0_ENABLED', '1'):
+        report = utility_warmup.warmup(WARMUP_EVENT, None, jwks_fetcher)
+    jwks_fetcher.assert_called_once_with(refresh=True)
+    assert report['jwks']['result'] == 'ok'
+
+
+def test_warmup_step_errors_dont_fail(mock_rates):
+    with mock.patch.object(utility_warmup, 'warm_http',
+                           side_effect=ValueError('no network')):
+        report = utility_warmup.warmup(WARMUP_EVENT)
+    assert report['http']['result'] == 'ERROR: no network'
+    assert report['rates']['result']['bcv'] == 'ok'
+
+
+def test_warmup_fan_out(mock_rates):
+    context = mock.MagicMock(
+        invoked_function_arn='arn:aws:lambda:us-east-1:1:function:api')
+    mock_boto3 = mock.MagicMock()
+    mock_boto3.client.return_value.invoke.return_value = {'StatusCode': 200}
+    with mock.patch.object(utility_warmup, 'boto3', mock_boto3), \
+         mock.patch.object(utility_warmup.settings,
+                           'WARMUP_FANOUT_DELAY', '0'):
+        report = utility_warmup.warmup(
+            dict(WARMUP_EVENT, concurrency=3), context)
+        # The fanned out invocations don't fan out again
+        child_report = utility_warmup.warmup(
+            dict(WARMUP_EVENT, concurrency=3, fanout_child=True), context)
+    assert report['fan_out'] == {'requested': 2, 'invoked': 2}
+    assert 'fan_out' not in child_report
+    invoke = mock_boto3.client.return_value.invoke
+    assert invoke.call_count == 2
+    assert invoke.call_args.kwargs['FunctionName'] == \
+        context.invoked_function_arn
+    assert '"fanout_child": true' in invoke.call_args.kwargs['Payload']
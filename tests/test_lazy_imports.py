@@ -0,0 +1,57 @@
+"""
+Lazy imports and import-time report test
+"""
+
+import subprocess
+import sys
+from unittest import mock
+
+from chalicelib.utility_import_time import parse_import_time
+from chalicelib.utility_lazy_import import LazyModule, lazy_function
+
+
+HEAVY_MODULES = [
+    'boto3', 'jose', 'fastapi', 'pydantic', 'openai', 'pymongo', 'numpy',
+    'httpx', 'werkzeug',
+]
+
+
+def test_app_import_skips_heavy_modules():
+    process = subprocess.run(
+        [sys.executable, '-c',
+         'import sys, app; print(",".join(sorted(sys.modules)))'],
+        capture_output=True, text=True, check=True,
+    )
+    loaded_modules = process.stdout.splitlines()[-1].split(',')
+    assert [module for module in HEAVY_MODULES
+            if module in loaded_modules] == []
+
+
+def test_lazy_module():
+    lazy_json = LazyModule('json')
+    assert 'not loaded' in repr(lazy_json)
+    assert lazy_json.loads('[1]') == [1]
+    with mock.patch.object(lazy_json, 'loads', return_value='patched'):
+        import json
+        assert json.loads('[1]') == 'patched'
+    assert lazy_json.loads('[1]') == [1]
+
+
+def test_lazy_function():
+    dumps = lazy_function('json', 'dumps')
+    assert dumps.__name__ == 'dumps'
+    assert dumps({'a': 1}) == '{"a": 1}'
+
+
+def test_parse_import_time():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |     chalicelib.settings',
+        'import time:      2500 |      10500 |   app',
+    ])
+    assert parse_import_time(output) == [
+        {'module': 'chalicelib.settings', 'self_ms': 0.12,
+         'cumulative_ms': 0.12, 'depth': 2},
+        {'module': 'app', 'self_ms': 2.5, 'cumulative_ms': 10.5,
+         'depth': 1},
+    ]
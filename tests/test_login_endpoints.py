@@ -21,7 +21,7 @@ def mock_auth_settings_globally():
     # used by app.py is modified.
 
     with mock.patch(
-            'chalicelib.utility_jwt.fetch_user_by_entryname',
+            'chalicelib.model_users.fetch_user_by_entryname',
             return_value={
                 'error': False,
                 'found': True,
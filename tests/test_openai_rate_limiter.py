@@ -0,0 +1,219 @@
+"""
+OpenAI rate limit scheduler test
+"""
+
+import asyncio
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_openai
+from chalicelib.api_openai import openai_api_general, openai_api_stream
+from chalicelib.settings import settings
+from chalicelib.utility_rate_limiter import (
+    RateLimitExceeded, RateLimitScheduler, openai_rate_limiter,
+    parse_duration, parse_retry_after)
+
+
+OPENAI_RESPONSE = {
+    'choices': [{'message': {'role': 'assistant', 'content': 'Hello!'}}],
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def get_http_response(status_code=200, headers=None, body=OPENAI_RESPONSE):
+    http_response = mock.MagicMock()
+    http_response.status_code = status_code
+    http_response.headers = headers or {}
+    http_response.json.return_value = body
+    http_response.text = str(body)
+    return http_response
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock):
+    return RateLimitScheduler(clock=clock)
+
+
+@pytest.fixture
+def no_sleep():
+    with mock.patch.object(api_openai.time, 'sleep') as mock_sleep:
+        yield mock_sleep
+
+
+def test_parse_headers():
+    assert parse_duration('1s') == 1
+    assert parse_duration('6m0s') == 360
+    assert parse_duration('20ms') == 0.02
+    assert parse_duration('1h2m3.5s') == 3723.5
+    assert parse_duration('0.5') == 0.5
+    assert parse_duration('soon') is None
+    assert parse_retry_after({'retry-after': '2'}) == 2
+    assert parse_retry_after({'retry-after-ms': '250'}) == 0.25
+    assert parse_retry_after({}) is None
+
+
+def test_requests_bucket_paces_a_burst(scheduler, clock):
+    with mock.patch.object(settings, 'OPENAI_RPM', '60'):
+        waits = [scheduler.reserve('gpt-4', 0) for _ in range(62)]
+    assert waits[:60] == [0] * 60
+    assert waits[60:] == [1, 2]
+    clock.now += 2
+    assert scheduler.reserve('gpt-4', 0) == 1
+    # Other models have their own budget
+    assert scheduler.reserve('gpt-4o', 0) == 0
+
+
+def test_tokens_bucket(scheduler):
+    with mock.patch.object(settings, 'OPENAI_TPM', '6000'):
+        assert scheduler.reserve('gpt-4', 5000) == 0
+        assert scheduler.reserve('gpt-4', 2000) == 10
+
+
+def test_limits_learned_from_headers(scheduler):
+    assert scheduler.reserve('gpt-4', 100) == 0
+    scheduler.get_retry_delay('gpt-4', get_http_response(200, {
+        'x-ratelimit-limit-requests': '10',
+        'x-ratelimit-remaining-requests': '0',
+        'x-ratelimit-limit-tokens': '60000',
+        'x-ratelimit-remaining-tokens': '59000',
+    }), 0)
+    assert scheduler.reserve('gpt-4', 100) == 6
+    assert scheduler.stats()['models']['gpt-4']['requests']['limit'] == 10
+
+
+def test_max_wait_rejects_and_refunds(scheduler):
+    with mock.patch.object(settings, 'OPENAI_RPM', '1'), \
+         mock.patch.object(settings, 'OPENAI_RATE_LIMIT_MAX_WAIT', '30'):
+        assert scheduler.reserve('gpt-4', 0) == 0
+        with pytest.raises(RateLimitExceeded):
+            scheduler.reserve('gpt-4', 0)
+        with pytest.raises(RateLimitExceeded):
+            scheduler.reserve('gpt-4', 0)
+    assert scheduler.stats()['rejected'] == 2
+
+
+def test_429_blocks_every_caller(scheduler):
+    delay = scheduler.get_retry_delay(
+        'gpt-4', get_http_response(429, {'retry-after': '2'}), 0)
+    assert 2 <= delay <= 2 + float(settings.OPENAI_RETRY_BASE_DELAY)
+    assert scheduler.reserve('gpt-4', 0) == pytest.approx(delay)
+    assert scheduler.stats()['throttled'] == 1
+
+
+def test_429_waits_for_the_exhausted_limit_reset(scheduler):
+    delay = scheduler.get_retry_delay('gpt-4', get_http_response(429, {
+        'x-ratelimit-remaining-requests': '5',
+        'x-ratelimit-reset-requests': '1s',
+        'x-ratelimit-remaining-tokens': '0',
+        'x-ratelimit-reset-tokens': '7s',
+    }), 0)
+    assert delay >= 7
+
+
+def test_retry_limits(scheduler):
+    with mock.patch.object(settings, 'OPENAI_MAX_RETRIES', '2'):
+        assert scheduler.get_retry_delay(
+            'gpt-4', get_http_response(503), 1) is not None
+        assert scheduler.get_retry_delay(
+            'gpt-4', get_http_response(503), 2) is None
+    assert scheduler.get_retry_delay(
+        'gpt-4', get_http_response(400), 0) is None
+    assert scheduler.get_retry_delay('gpt-4', get_http_response(
+        429, body={'error': {'code': 'insufficient_quota'}}), 0) is None
+    assert scheduler.get_retry_delay(
+        'gpt-4', get_http_response(429, {'retry-after': '3600'}), 0) is None
+
+
+def test_backoff_has_jitter(scheduler):
+    delays = {scheduler.get_backoff_delay(3) for _ in range(20)}
+    assert len(delays) > 1
+    assert all(0 <= delay <= 8 * float(settings.OPENAI_RETRY_BASE_DELAY)
+               for delay in delays)
+
+
+def test_openai_api_general_retries_429(no_sleep):
+    with mock.patch.object(api_openai, 'http_post', side_effect=[
+        get_http_response(429, {'retry-after': '1'}),
+        get_http_response(200),
+    ]) as mock_http_post:
+        assert openai_api_general('Hola') == 'Hello!'
+    assert mock_http_post.call_count == 2
+    assert any(call.args[0] >= 1 for call in no_sleep.call_args_list)
+    assert openai_rate_limiter.stats()['retries'] == 1
+
+
+def test_retries_reserve_the_tokens_once(no_sleep):
+    reserve = mock.Mock(wraps=openai_rate_limiter.reserve)
+    with mock.patch.object(openai_rate_limiter, 'reserve', reserve), \
+         mock.patch.object(api_openai, 'http_post', side_effect=[
+             get_http_response(429), get_http_response(503),
+             get_http_response(200),
+         ]):
+        assert openai_api_general('Hola', max_tokens='100') == 'Hello!'
+    tokens = [call.args[1] for call in reserve.call_args_list]
+    assert tokens[0] > 100
+    assert tokens[1:] == [0, 0]
+
+
+def test_openai_api_general_gives_up(no_sleep):
+    with mock.patch.object(settings, 'OPENAI_MAX_RETRIES', '1'), \
+         mock.patch.object(api_openai, 'http_post',
+                           return_value=get_http_response(503)) \
+            as mock_http_post:
+        assert 'OAI-040' in openai_api_general('Hola')['error_message']
+    assert mock_http_post.call_count == 2
+
+
+def test_openai_api_general_rate_limit_error(no_sleep):
+    with mock.patch.object(settings, 'OPENAI_RPM', '1'), \
+         mock.patch.object(api_openai, 'http_post',
+                           return_value=get_http_response(200)) \
+            as mock_http_post:
+        assert openai_api_general('Hola') == 'Hello!'
+        response = openai_api_general('Hola')
+    assert 'OAI-045' in response['error_message']
+    mock_http_post.assert_called_once()
+
+
+def test_stream_retries_429(no_sleep):
+    stream_response = get_http_response(200)
+    stream_response.iter_lines.return_value = iter([
+        'data: {"choices": [{"delta": {"content": "Hi"}}]}',
+        'data: [DONE]',
+    ])
+    responses = iter([get_http_response(429), stream_response])
+
+    @contextmanager
+    def http_post_stream(url, **kwargs):
+        yield next(responses)
+
+    with mock.patch.object(api_openai, 'http_post_stream', http_post_stream):
+        events = ''.join(openai_api_stream('Hola'))
+    assert events == 'data: {"delta": "Hi"}\n\ndata: [DONE]\n\n'
+
+
+def test_async_retries_server_errors():
+    async def no_sleep(delay):
+        pass
+
+    with mock.patch.object(api_openai.asyncio, 'sleep', no_sleep), \
+         mock.patch.object(api_openai, 'async_http_post', side_effect=[
+             get_http_response(500), get_http_response(200),
+         ]) as mock_async_post:
+        assert asyncio.run(
+            api_openai.openai_api_general_async('Hola')) == 'Hello!'
+    assert mock_async_post.await_count == 2
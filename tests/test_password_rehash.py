@@ -0,0 +1,120 @@
+"""
+Password hash cost calibration and rehash on login test
+"""
+
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from chalicelib import utility_jwt, utility_password
+from chalicelib.utility_password import (
+    calibrate_pbkdf2, calibrate_scrypt, get_hash_method,
+    get_hash_method_async, get_hash_params, get_scrypt_max_n,
+    needs_rehash)
+
+
+@pytest.fixture(autouse=True)
+def reset_hash_method():
+    utility_password._hash_method.clear()
+    yield
+    utility_password._hash_method.clear()
+
+
+def test_get_hash_params():
+    assert get_hash_params('scrypt:32768:8:1$salt$hash') == \
+        ('scrypt', 32768, ('8', '1'))
+    assert get_hash_params('pbkdf2:sha256:600000$salt$hash') == \
+        ('pbkdf2', 600000, ('sha256',))
+
+
+def test_calibration_has_floors_and_scales():
+    assert calibrate_scrypt(0) == 'scrypt:32768:8:1'
+    assert calibrate_pbkdf2(0) == 'pbkdf2:sha256:100000'
+    n = get_hash_params(calibrate_scrypt(100))[1]
+    assert n >= 2**15 and n & (n - 1) == 0
+
+
+def test_scrypt_cost_is_capped_by_the_memory():
+    with mock.patch.dict('os.environ',
+                         {'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': '1024'}):
+        with mock.patch.object(utility_password.settings,
+                               'PASSWORD_SCRYPT_MAX_MEMORY_PERCENT', '25'):
+            # 256 MiB: N = 2^18 needs 256 MiB with r = 8
+            assert get_scrypt_max_n() == 2**18
+        # 51 MiB: the 32 MiB floor
+        assert get_scrypt_max_n() == 2**15
+        # Even if no N reaches the target time
+        assert calibrate_scrypt(10**9) == 'scrypt:32768:8:1'
+    with mock.patch.object(utility_password, 'get_memory_bytes',
+                           return_value=None):
+        assert get_scrypt_max_n() == 2**17
+
+
+def test_calibrated_method_is_recorded_in_the_hash():
+    with mock.patch.object(utility_password.settings,
+                           'PASSWORD_HASH_METHOD', 'pbkdf2'), \
+         mock.patch.object(utility_password, 'calibrate_pbkdf2',
+                           return_value='pbkdf2:sha256:123000'
+                           ) as mock_calibrate:
+        assert get_hash_method() == 'pbkdf2:sha256:123000'
+        with mock.patch.object(utility_password.password_service,
+                               'get_workers', return_value=0):
+            password_hash = utility_password.get_password_hash('secret')
+        assert get_hash_method() == 'pbkdf2:sha256:123000'
+    mock_calibrate.assert_called_once()
+    assert password_hash.startswith('pbkdf2:sha256:123000$')
+
+
+def test_async_calibration_runs_off_the_event_loop():
+    threads = []
+
+    def calibrate_scrypt(target_ms):
+        threads.append(threading.get_ident())
+        return 'scrypt:32768:8:1'
+
+    with mock.patch.object(utility_password.settings,
+                           'PASSWORD_HASH_METHOD', 'scrypt'), \
+         mock.patch.object(utility_password, 'calibrate_scrypt',
+                           calibrate_scrypt):
+        assert asyncio.run(get_hash_method_async()) == 'scrypt:32768:8:1'
+        # Already calibrated: no worker thread
+        assert asyncio.run(get_hash_method_async()) == 'scrypt:32768:8:1'
+    assert len(threads) == 1
+    assert threads[0] != threading.get_ident()
+
+
+def test_needs_rehash_tolerance():
+    method = 'scrypt:32768:8:1'
+    assert not needs_rehash('scrypt:32768:8:1$s$h', method)
+    assert not needs_rehash('scrypt:16384:8:1$s$h', method)
+    assert needs_rehash('scrypt:8192:8:1$s$h', method)
+    assert needs_rehash('scrypt:32768:16:1$s$h', method)
+    assert needs_rehash('pbkdf2:sha256:600000$s$h', method)
+    assert needs_rehash('plain_text', method)
+
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_login_rehashes_and_persists(use_async):
+    old_hash = generate_password_hash('secret', method='pbkdf2:sha256:1000')
+    user = utility_jwt.UserInDB(username='mock_user',
+                                hashed_password=old_hash)
+    with mock.patch.object(utility_jwt, 'get_user_hashed_password',
+                           return_value=user), \
+         mock.patch.object(utility_password.settings,
+                           'PASSWORD_HASH_METHOD', 'scrypt:16384:8:1'), \
+         mock.patch.object(utility_password.password_service,
+                           'get_workers', return_value=0), \
+         mock.patch.object(utility_jwt, 'update_user_password_hash',
+                           return_value={'error': False}) as mock_update:
+        if use_async:
+            result = asyncio.run(
+                utility_jwt.authenticate_user_async('mock_user', 'secret'))
+        else:
+            result = utility_jwt.authenticate_user('mock_user', 'secret')
+    assert result is user
+    new_hash = mock_update.call_args.args[1]
+    assert new_hash.startswith('scrypt:16384:8:1$')
+    assert user.hashed_password == new_hash
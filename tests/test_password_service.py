@@ -0,0 +1,85 @@
+"""
+Password hashing process pool test
+"""
+
+import asyncio
+from concurrent.futures import Future, TimeoutError
+from unittest import mock
+
+import pytest
+from fastapi import HTTPException
+
+from chalicelib import utility_password
+from chalicelib.utility_jwt import login_for_access_token
+from chalicelib.utility_password import (
+    PasswordService, PasswordServiceBusy, hash_password)
+from werkzeug.security import check_password_hash
+
+
+@pytest.fixture
+def pool_service():
+    service = PasswordService(workers=1, max_pending=4, timeout=30)
+    yield service
+    service.shutdown()
+
+
+def test_pool_sync_and_async_facades(pool_service):
+    password_hash = pool_service.run(hash_password, 'secret')
+    assert password_hash.startswith('scrypt:')
+    assert pool_service.run(check_password_hash, password_hash, 'secret')
+    assert asyncio.run(pool_service.run_async(
+        check_password_hash, password_hash, 'secret'))
+    assert not asyncio.run(pool_service.run_async(
+        check_password_hash, password_hash, 'wrong'))
+    assert pool_service.stats() == {
+        'calls': 4, 'rejected': 0, 'pool_errors': 0, 'pending': 0,
+        'workers': 1}
+
+
+def test_queue_depth_limit():
+    service = PasswordService(workers=0, max_pending=1)
+
+    def nested_call():
+        return service.run(hash_password, 'secret')
+
+    with pytest.raises(PasswordServiceBusy):
+        service.run(nested_call)
+    assert service.stats()['rejected'] == 1
+    assert service.stats()['pending'] == 0
+    assert service.run(hash_password, 'secret').startswith('scrypt:')
+
+
+def get_running_future():
+    future = Future()
+    future.set_running_or_notify_cancel()
+    return future
+
+
+@pytest.mark.parametrize('run_async', [False, True])
+def test_timed_out_job_keeps_its_slot(run_async):
+    service = PasswordService(workers=1, max_pending=1, timeout=0.01)
+    future = get_running_future()
+    executor = mock.MagicMock()
+    executor.submit.return_value = future
+    with mock.patch.object(service, 'get_executor', return_value=executor):
+        with pytest.raises(TimeoutError):
+            if run_async:
+                asyncio.run(service.run_async(hash_password, 'secret'))
+            else:
+                service.run(hash_password, 'secret')
+        # The job is still running in the pool
+        assert service.stats()['pending'] == 1
+        with pytest.raises(PasswordServiceBusy):
+            service.run(hash_password, 'secret')
+        future.set_result('mock_hash')
+        assert service.stats()['pending'] == 0
+
+
+def test_busy_login_is_a_503():
+    form_data = mock.MagicMock(username='mock_user', password='secret')
+    with mock.patch.object(
+        utility_password.password_service, 'acquire',
+        side_effect=PasswordServiceBusy('busy')
+    ), pytest.raises(HTTPException) as http_err:
+        login_for_access_token(form_data)
+    assert http_err.value.status_code == 503
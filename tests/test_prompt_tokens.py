@@ -0,0 +1,246 @@
+"""
+OpenAI prompt pre-flight (token counting, trimming, max_tokens) and usage
+totals test
+"""
+
+import json
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+
+from chalicelib import api_openai, utility_tokens
+from chalicelib.api_openai import (
+    get_openai_request, openai_api_general, openai_api_stream)
+from chalicelib.settings import settings
+from chalicelib.utility_ai_usage import AiUsageMeter, ai_usage
+from chalicelib.utility_tokens import (
+    PromptTooLong, count_prompt_tokens, fit_prompt, get_context_limit)
+
+
+OPENAI_RESPONSE = {
+    'choices': [{'message': {'role': 'assistant', 'content': 'Hello!'}}],
+    'usage': {'prompt_tokens': 9, 'completion_tokens': 2,
+              'total_tokens': 11},
+}
+
+
+class WordsEncoding:
+    """
+    One token per word, instead of the tiktoken encoding.
+    """
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+@pytest.fixture
+def words_encoding():
+    with mock.patch.object(utility_tokens, 'get_encoding',
+                           return_value=WordsEncoding()):
+        yield
+
+
+def get_http_response(body=OPENAI_RESPONSE):
+    http_response = mock.MagicMock()
+    http_response.status_code = 200
+    http_response.headers = {}
+    http_response.json.side_effect = lambda: json.loads(json.dumps(body))
+    return http_response
+
+
+def get_messages(*contents):
+    return [{'role': 'user', 'content': content} for content in contents]
+
+
+def test_count_prompt_tokens(words_encoding):
+    messages = [
+        {'role': 'system', 'content': 'You are helpful'},
+        {'role': 'user', 'content': 'Hola', 'name': 'carlos'},
+    ]
+    # (3 per message + 1 role + 3) + (3 + 1 + 1 + 1 name + 1) + 3 reply
+    assert count_prompt_tokens(messages, 'gpt-4') == 17
+
+
+def test_estimate_without_tiktoken():
+    with mock.patch.object(utility_tokens, 'get_encoding',
+                           return_value=None):
+        assert utility_tokens.count_text_tokens('x' * 9, 'gpt-4') == 3
+
+
+def test_context_limits():
+    assert get_context_limit('gpt-4') == 8192
+    assert get_context_limit('gpt-4-32k-0613') == 32768
+    assert get_context_limit('gpt-4o-mini') == 128000
+    assert get_context_limit('unknown-model') == \
+        int(settings.OPENAI_DEFAULT_CONTEXT_LIMIT)
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS',
+                           'unknown-model=1000,gpt-4=9000'):
+        assert get_context_limit('unknown-model') == 1000
+        assert get_context_limit('gpt-4-0613') == 9000
+
+
+def test_max_tokens_is_derived(words_encoding):
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'):
+        fitted = fit_prompt(get_messages('one two'), 'tiny',
+                            default_max_tokens=2048)
+        assert fitted['prompt_tokens'] == 9
+        assert fitted['max_tokens'] == 91
+        fitted = fit_prompt(get_messages('one two'), 'gpt-4', max_tokens='50')
+        assert fitted['max_tokens'] == 50
+
+
+def test_oversized_conversation_is_trimmed(words_encoding):
+    messages = [{'role': 'system', 'content': 'be brief'}] + \
+        get_messages('a ' * 40, 'b ' * 40, 'last question')
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'):
+        fitted = fit_prompt(messages, 'tiny', max_tokens=50)
+    assert fitted['trimmed'] == 2
+    assert [message['content'] for message in fitted['messages']] == [
+        'be brief', 'last question']
+    assert fitted['prompt_tokens'] == 15
+
+
+def test_oversized_prompt_is_rejected(words_encoding):
+    messages = get_messages('a ' * 40, 'last question')
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'), \
+         mock.patch.object(settings, 'OPENAI_PROMPT_PREFLIGHT', 'reject'):
+        with pytest.raises(PromptTooLong):
+            fit_prompt(messages, 'tiny', max_tokens=50)
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'):
+        # The last message alone doesn't fit
+        with pytest.raises(PromptTooLong):
+            fit_prompt(get_messages('a ' * 80), 'tiny', max_tokens=40)
+
+
+def test_openai_request(words_encoding):
+    request = get_openai_request('Hola', '', 'gpt-4', '1', None, stream=True)
+    data = json.loads(request['data'])
+    # The derived answer room is only used for the pre-flight
+    assert 'max_tokens' not in data
+    assert data['stream_options'] == {'include_usage': True}
+    assert request['prompt_tokens'] == 8
+    request = get_openai_request(
+        '[{"role": "system", "content": "be brief"},'
+        ' {"role": "user", "content": "Hola"}]', '', 'gpt-4', '1', None)
+    assert json.loads(request['data'])['messages'] == [
+        {'role': 'system', 'content': 'be brief'},
+        {'role': 'user', 'content': 'Hola'},
+    ]
+    request = get_openai_request('{"role": "user"}', '', 'gpt-4', '1', None)
+    assert 'OAI-065' in request['error_message']
+    request = get_openai_request('[{"content": "Hola"}]', '', 'gpt-4', '1',
+                                 None)
+    assert 'OAI-065' in request['error_message']
+    with mock.patch.object(settings, 'OPENAI_PROMPT_PREFLIGHT', '0'):
+        request = get_openai_request('Hola', '', 'gpt-4', '1', None)
+    assert 'max_tokens' not in json.loads(request['data'])
+    # Not raised to the pre-flight minimum
+    request = get_openai_request('Hola', '', 'gpt-4', '1', '5')
+    assert json.loads(request['data'])['max_tokens'] == 5
+
+
+@pytest.mark.parametrize('openai_model', ['gpt-5', 'o1-mini', 'o3',
+                                          'o4-mini'])
+def test_reasoning_models_request(words_encoding, openai_model):
+    request = get_openai_request('Hola', '', openai_model, '1', None)
+    data = json.loads(request['data'])
+    assert 'max_tokens' not in data
+    assert 'max_completion_tokens' not in data
+    request = get_openai_request('Hola', '', openai_model, '1', '500')
+    data = json.loads(request['data'])
+    assert 'max_tokens' not in data
+    assert data['max_completion_tokens'] == 500
+
+
+def test_oversized_conversation_is_trimmed_before_sending(words_encoding):
+    conversation = json.dumps(
+        [{'role': 'system', 'content': 'be brief'}] +
+        get_messages('a ' * 40, 'b ' * 40, 'last question'))
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'), \
+         mock.patch.object(api_openai, 'http_post',
+                           return_value=get_http_response()) \
+            as mock_http_post:
+        response = openai_api_general(conversation, openai_model='tiny',
+                                      max_tokens='50')
+    assert response == 'Hello!'
+    data = json.loads(mock_http_post.call_args.kwargs['data'])
+    assert data['messages'] == [
+        {'role': 'system', 'content': 'be brief'},
+        {'role': 'user', 'content': 'last question'},
+    ]
+    assert data['max_tokens'] == 50
+
+
+def test_too_long_prompt_is_not_sent(words_encoding):
+    with mock.patch.object(settings, 'OPENAI_CONTEXT_LIMITS', 'tiny=100'), \
+         mock.patch.object(api_openai, 'http_post') as mock_http_post:
+        response = openai_api_general('a ' * 200, openai_model='tiny')
+    assert 'OAI-070' in response['error_message']
+    mock_http_post.assert_not_called()
+
+
+def test_usage_totals_by_user_and_model():
+    with mock.patch.object(api_openai, 'http_post',
+                           return_value=get_http_response()):
+        openai_api_general('Hola', temperature='0', user='carlos')
+        openai_api_general('Hola', temperature='0', user='carlos')
+        openai_api_general('Hi', openai_model='gpt-4o', user='maria')
+    usage = ai_usage.get_totals()
+    assert usage['users']['carlos']['gpt-4'] == {
+        'prompt_tokens': 9, 'completion_tokens': 2, 'total_tokens': 11,
+        'requests': 1, 'cached_requests': 1,
+    }
+    assert usage['totals']['total_tokens'] == 22
+    assert list(ai_usage.get_totals(model='gpt-4o')['users']) == ['maria']
+    assert ai_usage.get_totals(user='nobody')['totals'] == {}
+
+
+def test_stream_usage_is_recorded():
+    stream_response = get_http_response()
+    stream_response.iter_lines.return_value = iter([
+        'data: {"choices": [{"delta": {"content": "Hi"}}], "usage": null}',
+        'data: {"choices": [], "usage": {"prompt_tokens": 5,'
+        ' "completion_tokens": 1, "total_tokens": 6}}',
+        'data: [DONE]',
+    ])
+
+    @contextmanager
+    def http_post_stream(url, **kwargs):
+        yield stream_response
+
+    with mock.patch.object(api_openai, 'http_post_stream', http_post_stream):
+        ''.join(openai_api_stream('Hola', user='carlos'))
+    totals = ai_usage.get_totals(user='carlos')['totals']
+    assert totals['total_tokens'] == 6
+    assert totals['requests'] == 1
+
+
+def test_usage_max_entries():
+    meter = AiUsageMeter(max_entries=1)
+    meter.record('carlos', 'gpt-4', {'total_tokens': 3})
+    meter.record('maria', 'gpt-4', {'total_tokens': 4})
+    meter.record(None, 'gpt-4', {'total_tokens': 5})
+    assert meter.get_totals()['users'] == {
+        'carlos': {'gpt-4': mock.ANY},
+        '*': {'gpt-4': mock.ANY},
+    }
+    assert meter.get_totals(user='*')['totals']['total_tokens'] == 9
+
+
+def test_chalice_ai_usage(client, mock_requires_auth):
+    ai_usage.record('mock_user', 'gpt-4', {'total_tokens': 3})
+    ai_usage.record('maria', 'gpt-4', {'total_tokens': 4})
+    response = client.get('/ai_usage?user=mock_user')
+    assert response.status_code == 200
+    assert response.json_body['totals']['total_tokens'] == 3
+    # Only their own totals
+    response = client.get('/ai_usage')
+    assert list(response.json_body['users']) == ['mock_user']
+    response = client.get('/ai_usage?user=maria')
+    assert response.status_code == 403
+    with mock.patch.object(settings, 'AI_USAGE_ADMINS', 'admin, mock_user'):
+        response = client.get('/ai_usage')
+        assert response.json_body['totals']['total_tokens'] == 7
+        response = client.get('/ai_usage?user=maria')
+        assert response.json_body['totals']['total_tokens'] == 4
@@ -0,0 +1,107 @@
+"""
+Cross-rate graph engine and /convert endpoint test
+"""
+
+from unittest import mock
+
+import pytest
+
+from chalicelib.utility_rate_graph import RateGraph, get_pair_nodes
+
+
+# http://127.0.0.1:5001/convert/btc/ves?amount=0.5
+#
+# Returns:
+# {"error": false, "error_message": "",
+#  "data": {"from": "BTC", "to": "VES", "rate": 10000000.0,
+#           "amount": 0.5, "value": 5000000.0, "updated_at": 1748300000.0}}
+
+
+BASE_RATES = {
+    'USD-VES': 100.0,
+    'EUR-VES': 110.0,
+    'USD-VES-MONITOR-EP': 120.0,
+    'USD-COP': 4000.0,
+    'USD-COP-GOOGLE': 4100.0,
+    'BTC-USD': 100000.0,
+    'ETH-USD': 2500.0,
+}
+
+
+def ok_response(data):
+    return {'error': False, 'error_message': '', 'data': data}
+
+
+def test_get_pair_nodes():
+    assert get_pair_nodes('usd-ves') == ('USD', 'VES')
+    assert get_pair_nodes('USD-VES-MONITOR-EP') == ('USD', 'VES_MONITOR_EP')
+
+
+def test_rate_graph_derived_pairs():
+    graph = RateGraph()
+    assert graph.update(BASE_RATES)
+    assert graph.rate('BTC', 'VES') == pytest.approx(10000000.0)
+    assert graph.rate('COP', 'ETH') == pytest.approx(1 / (4000.0 * 2500.0))
+    assert graph.rate('EUR', 'COP') == pytest.approx(110.0 / 100.0 * 4000.0)
+    assert graph.rate('vES', 'ves_monitor_ep') == pytest.approx(1.2)
+    assert graph.rate('USD', 'USD') == 1.0
+    assert graph.rate('BTC', 'XYZ') is None
+    # Same base rates: the derived pairs are not computed again
+    assert not graph.update(dict(BASE_RATES))
+    assert graph.stats()['builds'] == 1
+    assert graph.update(dict(BASE_RATES, **{'BTC-USD': 'N/A'}))
+    assert graph.rate('BTC', 'VES') is None
+
+
+def test_rate_graph_disconnected_nodes():
+    graph = RateGraph()
+    graph.update({'USD-VES': 100.0, 'XAU-XAG': 80.0})
+    assert graph.rate('XAU', 'XAG') == 80.0
+    assert graph.rate('XAU', 'VES') is None
+
+
+@pytest.fixture
+def mock_base_apis():
+    bcv = ok_response({'data': {
+        'dolar': {'symbol': 'USD', 'value': 100.0},
+        'euro': {'symbol': 'EUR', 'value': 110.0},
+        'effective_date': 'Lunes, 26 Mayo  2025',
+    }})
+    cop = ok_response({'data': {
+        'official_cop': {'data': {'valor': 4000.0}},
+        'google_cop': {'data': {'value': 4100.0}},
+    }})
+    crypto = ok_response({'BTC': {'USD': 100000.0}, 'ETH': {'USD': 2500.0}})
+    monitor_error = dict(ok_response({}), error=True,
+                         error_message='ERROR: down')
+    with mock.patch('chalicelib.api_currency_exchange.rate_graph',
+                    new_callable=RateGraph), \
+         mock.patch('chalicelib.api_currency_exchange.veb_bcv_api',
+                    return_value=bcv), \
+         mock.patch('chalicelib.api_currency_exchange.veb_monitor_api',
+                    return_value=monitor_error), \
+         mock.patch('chalicelib.api_currency_exchange.cop_api',
+                    return_value=cop), \
+         mock.patch('chalicelib.api_currency_exchange.crypto_multi_api',
+                    return_value=crypto):
+        yield
+
+
+def test_convert_endpoint(client, mock_base_apis):
+    response = client.get('/convert/btc/ves?amount=0.5')
+    assert response.status_code == 200
+    assert response.json_body['error'] is False
+    assert response.json_body['data']['rate'] == pytest.approx(10000000.0)
+    assert response.json_body['data']['value'] == pytest.approx(5000000.0)
+
+    response = client.get('/convert/COP/EUR')
+    assert response.json_body['data']['rate'] == \
+        pytest.approx(1 / 4000.0 * 100.0 / 110.0)
+
+    # The Monitor provider is down, so its node is unknown
+    response = client.get('/convert/USD/VES_MONITOR_EP')
+    assert response.json_body['error'] is True
+    assert 'VES' in response.json_body['data']['currencies']
+
+    response = client.get('/convert/USD/VES?amount=xxx')
+    assert response.json_body['error'] is True
@@ -0,0 +1,74 @@
+"""
+Exchange rates cache test
+"""
+
+import time
+from unittest import mock
+
+from chalicelib.utility_cache import TtlCache, cached_rates, rates_cache
+
+
+def get_fetcher(value):
+    return mock.MagicMock(return_value=value)
+
+
+def test_cache_fresh_hit():
+    cache = TtlCache({'bcv': (60, 60)})
+    fetcher = get_fetcher({'error': False, 'data': {'rate': 1}})
+    assert cache.get_or_fetch('bcv', 'bcv', fetcher)['data'] == {'rate': 1}
+    assert cache.get_or_fetch('bcv', 'bcv', fetcher)['data'] == {'rate': 1}
+    fetcher.assert_called_once()
+    stats = cache.stats()
+    assert stats['providers']['bcv']['hits'] == 1
+    assert stats['providers']['bcv']['misses'] == 1
+    assert stats['entries']['bcv']['age'] >= 0
+
+
+def test_cache_errors_are_not_cached():
+    cache = TtlCache({'crypto': (60, 60)})
+    fetcher = get_fetcher({'error': True, 'error_message': 'ERROR'})
+    cache.get_or_fetch('crypto:BTC', 'crypto', fetcher)
+    cache.get_or_fetch('crypto:BTC', 'crypto', fetcher)
+    assert fetcher.call_count == 2
+    assert cache.stats()['entries'] == {}
+
+
+def test_cache_stale_while_revalidate():
+    cache = TtlCache({'cop': (0.01, 60)})
+    fetcher = get_fetcher({'error': False, 'data': {'rate': 1}})
+    cache.get_or_fetch('cop', 'cop', fetcher)
+    time.sleep(0.02)
+    fetcher.return_value = {'error': False, 'data': {'rate': 2}}
+    # Expired entry is served stale while one background refresh runs
+    assert cache.get_or_fetch('cop', 'cop', fetcher)['data'] == {'rate': 1}
+    for _ in range(100):
+        if cache.get_entry('cop')['value']['data'] == {'rate': 2}:
+            break
+        time.sleep(0.01)
+    assert cache.get_entry('cop')['value']['data'] == {'rate': 2}
+    assert fetcher.call_count == 2
+    assert cache.stats()['providers']['cop']['stale_hits'] == 1
+    assert cache.stats()['providers']['cop']['refreshes'] == 1
+
+
+def test_cached_rates_decorator():
+    fetcher = get_fetcher({'error': False, 'data': {'USD': 1.0}})
+
+    @cached_rates('crypto')
+    def fake_crypto_api(symbol, currency):
+        return fetcher(symbol, currency)
+
+    rates_cache.invalidate()
+    fake_crypto_api('BTC', 'USD')
+    fake_crypto_api('BTC', 'USD')
+    fake_crypto_api('ETH', 'USD')
+    assert fetcher.call_count == 2
+    assert fake_crypto_api.uncached('BTC', 'USD')['data'] == {'USD': 1.0}
+    rates_cache.invalidate()
+
+
+def test_rates_cache_stats_endpoint(client):
+    response = client.get('/rates_cache_stats')
+    assert response.status_code == 200
+    assert 'providers' in response.json_body
+    assert 'entries' in response.json_body
@@ -0,0 +1,108 @@
+"""
+Composite rate endpoints concurrent fan-out test
+"""
+
+import asyncio
+import time
+from unittest import mock
+
+import pytest
+
+from chalicelib.api_currency_exchange import (
+    veb_cop, veb_cop_async, usdveb_full, usdveb_full_async)
+
+
+SLEEP_SECONDS = 0.2
+
+
+def slow_bcv_response():
+    return {
+        'error': False,
+        'error_message': '',
+        'data': {'data': {
+            'dolar': {'symbol': 'USD', 'value': 100.0},
+            'effective_date': 'Lunes, 26 Mayo  2025',
+        }}
+    }
+
+
+def slow_cop_response():
+    return {
+        'error': False,
+        'error_message': '',
+        'data': {'data': {'official_cop': {'data': {'valor': 4000.0}}}}
+    }
+
+
+def slow_bcv():
+    time.sleep(SLEEP_SECONDS)
+    return slow_bcv_response()
+
+
+def slow_cop():
+    time.sleep(SLEEP_SECONDS)
+    return slow_cop_response()
+
+
+async def slow_bcv_async():
+    await asyncio.sleep(SLEEP_SECONDS)
+    return slow_bcv_response()
+
+
+async def slow_cop_async():
+    await asyncio.sleep(SLEEP_SECONDS)
+    return slow_cop_response()
+
+
+@pytest.fixture
+def mock_slow_apis():
+    with mock.patch('chalicelib.api_currency_exchange.veb_bcv_api',
+                    side_effect=slow_bcv), \
+         mock.patch('chalicelib.api_currency_exchange.cop_api',
+                    side_effect=slow_cop), \
+         mock.patch('chalicelib.api_currency_exchange.veb_bcv_api_async',
+                    side_effect=slow_bcv_async), \
+         mock.patch('chalicelib.api_currency_exchange.cop_api_async',
+                    side_effect=slow_cop_async):
+        yield
+
+
+@pytest.mark.parametrize("currency_pair, expected", [
+    ('copveb', '40.0000 COP/Bs'),
+    ('vebcop', '0.0250 Bs/COP'),
+])
+def test_veb_cop_fanout(mock_slow_apis, currency_pair, expected):
+    start = time.monotonic()
+    response_message = veb_cop(currency_pair, False)
+    assert time.monotonic() - start < SLEEP_SECONDS * 1.9
+    assert expected in response_message
+
+
+def test_veb_cop_async_fanout(mock_slow_apis):
+    start = time.monotonic()
+    response_message = asyncio.run(veb_cop_async('copveb', False))
+    assert time.monotonic() - start < SLEEP_SECONDS * 1.9
+    assert '40.0000 COP/Bs' in response_message
+
+
+def test_usdveb_full_fanout():
+    def slow_message(debug):
+        time.sleep(SLEEP_SECONDS)
+        return 'message'
+
+    async def slow_message_async(debug):
+        await asyncio.sleep(SLEEP_SECONDS)
+        return 'message'
+
+    with mock.patch('chalicelib.api_currency_exchange.veb_bcv',
+                    side_effect=slow_message), \
+         mock.patch('chalicelib.api_currency_exchange.veb_monitor',
+                    side_effect=slow_message), \
+         mock.patch('chalicelib.api_currency_exchange.veb_bcv_async',
+                    side_effect=slow_message_async), \
+         mock.patch('chalicelib.api_currency_exchange.veb_monitor_async',
+                    side_effect=slow_message_async):
+        start = time.monotonic()
+        assert usdveb_full(False) == 'message\n\nmessage'
+        assert asyncio.run(usdveb_full_async(False)) == 'message\n\nmessage'
+        assert time.monotonic() - start < SLEEP_SECONDS * 3.8
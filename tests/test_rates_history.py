@@ -0,0 +1,90 @@
+"""
+Exchange rates history store test
+"""
+
+from unittest import mock
+
+import pytest
+
+from chalicelib import utility_rates_history
+from chalicelib.api_currency_exchange import crypto
+from chalicelib.settings import settings
+from chalicelib.utility_cache import rates_cache
+from chalicelib.utility_rates_history import RatesHistory, record_rates
+
+
+@pytest.fixture
+def history(tmp_path):
+    rates_history = RatesHistory(str(tmp_path))
+    with mock.patch.object(utility_rates_history, 'rates_history',
+                           rates_history):
+        yield rates_history
+
+
+def test_append_and_as_of(history):
+    for timestamp, value in [(100, 1.0), (200, 2.0), (300, 3.0)]:
+        assert history.append('USD-VES', value, timestamp)
+    assert history.as_of('USD-VES', 50) is None
+    assert history.as_of('USD-VES', 100) == (100.0, 1.0)
+    assert history.as_of('USD-VES', 250) == (200.0, 2.0)
+    assert history.as_of('USD-VES', 1000) == (300.0, 3.0)
+    assert history.as_of('USD-COP', 1000) is None
+
+
+def test_range(history):
+    for timestamp in range(10):
+        history.append('BTC-USD', timestamp * 10.0, timestamp)
+    assert history.range('BTC-USD', 3, 5) == [
+        (3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+    assert len(history.range('BTC-USD')) == 10
+    assert history.range('BTC-USD', 20, 30) == []
+
+
+def test_append_skips_repeated_values(history):
+    assert history.append('USD-COP', 4000.0, 100, min_interval=60)
+    assert not history.append('USD-COP', 4000.0, 130, min_interval=60)
+    assert history.append('USD-COP', 4001.0, 140, min_interval=60)
+    assert history.append('USD-COP', 4001.0, 300, min_interval=60)
+    # Timestamps never go backwards, so the binary search stays valid
+    assert history.append('USD-COP', 4002.0, 10)
+    assert [record[0] for record in history.range('USD-COP')] == \
+        [100.0, 140.0, 300.0, 300.0]
+    # A new store instance reads the last record from the file
+    assert RatesHistory(history.directory).get_last_record('USD-COP') == \
+        (300.0, 4002.0)
+
+
+def test_rates_history_endpoints(client, history):
+    record_rates({'USD-VES': 95.08, 'EUR-VES': 107.79}, 1000)
+    response = client.get('/rates_history')
+    assert response.status_code == 200
+    assert response.json_body == {'pairs': ['EUR-VES', 'USD-VES']}
+
+    response = client.get('/rates_history/usd-ves?as_of=2000')
+    assert response.status_code == 200
+    assert response.json_body['pair'] == 'USD-VES'
+    assert response.json_body['data'] == [
+        {'timestamp': 1000.0, 'value': 95.08}]
+
+    response = client.get('/rates_history/USD-VES?start=0&end=500')
+    assert response.json_body['data'] == []
+
+    response = client.get('/rates_history/USD-VES?as_of=xxx')
+    assert response.json_body['error'] is True
+
+
+def test_only_fetches_are_recorded(history):
+    rates_cache.invalidate()
+    with mock.patch.object(settings, 'RATES_HISTORY_MIN_INTERVAL', '0'), \
+         mock.patch.object(utility_rates_history.time, 'time',
+                           return_value=1000.0), \
+         mock.patch('chalicelib.api_currency_exchange.http_get') \
+            as mock_http_get:
+        mock_http_get.return_value.status_code = 200
+        mock_http_get.return_value.json.return_value = {'USD': 109437.64}
+        crypto('btc', 'usd', False)
+        # Served from the cache: same rate, no new observation
+        crypto('btc', 'usd', False)
+    rates_cache.invalidate()
+    mock_http_get.assert_called_once()
+    assert history.range('BTC-USD') == [(1000.0, 109437.64)]
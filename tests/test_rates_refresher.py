@@ -0,0 +1,77 @@
+"""
+Background rates refresher test
+"""
+
+import asyncio
+from unittest import mock
+
+from chalicelib import utility_rates_refresher
+from chalicelib.utility_cache import (
+    cached_rates, rates_cache, refresh_cached_rates)
+from chalicelib.utility_rates_refresher import (
+    RatesRefresher, get_next_delay, get_refresh_jobs, get_refresh_interval)
+
+
+def test_get_refresh_jobs():
+    with mock.patch.object(utility_rates_refresher.settings,
+                           'RATES_REFRESHER_CRYPTO_PAIRS', 'btc-usd, ETH-EUR'):
+        jobs = get_refresh_jobs()
+    assert [(provider, args) for provider, _, args in jobs] == [
+        ('bcv', ()),
+        ('monitor', ()),
+        ('cop', ()),
+        ('crypto', ('BTC', 'USD')),
+        ('crypto', ('ETH', 'EUR')),
+    ]
+
+
+def test_refresh_interval_and_backoff():
+    with mock.patch.object(utility_rates_refresher.settings,
+                           'RATES_REFRESHER_INTERVAL_BCV', '120'):
+        assert get_refresh_interval('bcv') == 120
+    with mock.patch.object(utility_rates_refresher.settings,
+                           'RATES_REFRESHER_JITTER', '0'):
+        assert get_next_delay(100, 0) == 100
+        assert get_next_delay(100, 1) == 5
+        assert get_next_delay(100, 3) == 20
+        assert get_next_delay(100, 10) == 100
+
+
+def test_refresh_cached_rates():
+    fetcher = mock.MagicMock(return_value={'error': False, 'data': 1})
+
+    @cached_rates('bcv')
+    def fake_bcv_api():
+        return fetcher()
+
+    rates_cache.invalidate()
+    assert refresh_cached_rates('bcv', fake_bcv_api)['data'] == 1
+    fetcher.return_value = {'error': False, 'data': 2}
+    assert refresh_cached_rates('bcv', fake_bcv_api)['data'] == 2
+    # The refreshed entry is served without calling the upstream again
+    assert fake_bcv_api()['data'] == 2
+    assert fetcher.call_count == 2
+    rates_cache.invalidate()
+
+
+def test_rates_refresher_runs_jobs():
+    refresh = mock.MagicMock(return_value={'error': False})
+
+    async def run():
+        refresher = RatesRefresher()
+        refresher.start()
+        assert refresher.is_running()
+        await asyncio.sleep(0.3)
+        await refresher.stop()
+        return refresher
+
+    with mock.patch.object(utility_rates_refresher, 'get_refresh_jobs',
+                           return_value=[('cop', None, ())]), \
+         mock.patch.object(utility_rates_refresher, 'refresh_cached_rates',
+                           refresh), \
+         mock.patch.object(utility_rates_refresher.settings,
+                           'RATES_REFRESHER_JITTER', '0'):
+        refresher = asyncio.run(run())
+    refresh.assert_called_once_with('cop', None)
+    assert not refresher.is_running()
+    assert refresher.status()['jobs']['cop']['last_refresh'] is not None
@@ -0,0 +1,123 @@
+"""
+Single-flight coalescing test
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from chalicelib.utility_singleflight import SingleFlight, single_flight
+
+
+def test_single_flight_threads_share_result():
+    flight = SingleFlight()
+    calls = []
+
+    def slow_fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'error': False, 'data': {'rate': 1}}
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(flight.do('bcv', slow_fetch)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(results) == 10
+    assert all(result['data'] == {'rate': 1} for result in results)
+    assert flight.stats()['coalesced'] == 9
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_threads_share_error():
+    flight = SingleFlight()
+    errors = []
+
+    def failing_fetch():
+        time.sleep(0.2)
+        raise ValueError('upstream down')
+
+    def call():
+        try:
+            flight.do('cop', failing_fetch)
+        except ValueError as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 5
+    assert len(set(id(err) for err in errors)) == 1
+
+
+def test_single_flight_async():
+    calls = []
+
+    @single_flight('crypto')
+    async def fake_crypto_api(symbol, currency):
+        calls.append((symbol, currency))
+        await asyncio.sleep(0.1)
+        return {'error': False, 'data': {currency: 1.0}}
+
+    async def run():
+        return await asyncio.gather(
+            *[fake_crypto_api('BTC', 'USD') for _ in range(10)],
+            fake_crypto_api('ETH', 'USD'),
+        )
+
+    results = asyncio.run(run())
+    assert len(results) == 11
+    assert calls == [('BTC', 'USD'), ('ETH', 'USD')]
+
+
+def test_single_flight_async_error():
+    @single_flight('bcv')
+    async def failing_api():
+        await asyncio.sleep(0.1)
+        raise ValueError('upstream down')
+
+    async def run():
+        return await asyncio.gather(
+            *[failing_api() for _ in range(3)], return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    with pytest.raises(ValueError):
+        asyncio.run(failing_api())
+
+
+def test_single_flight_async_leader_cancelled():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        return {'error': False, 'data': {'rate': 1}}
+
+    async def run():
+        leader = asyncio.create_task(flight.do_async('bcv', fetch))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(flight.do_async('bcv', fetch))
+                     for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*followers)
+
+    results = asyncio.run(run())
+    # The followers are not cancelled: one of them calls again
+    assert all(result['data'] == {'rate': 1} for result in results)
+    assert len(calls) == 2
+    assert flight.stats()['in_flight'] == 0
@@ -0,0 +1,78 @@
+"""
+Verified access tokens cache test
+"""
+
+import datetime
+from unittest import mock
+
+from fastapi import HTTPException
+
+from chalicelib import model_users, utility_jwt
+from chalicelib.utility_jwt import (
+    create_access_token, get_current_active_user_chalice)
+from chalicelib.utility_token_cache import TokenCache, verified_tokens
+
+
+def get_token(username='mock_user', minutes=30):
+    return create_access_token(
+        data={'sub': username},
+        expires_delta=datetime.timedelta(minutes=minutes)
+    )
+
+
+def test_repeat_calls_skip_decode_and_user_lookup():
+    token = get_token()
+    # The counters are per process, not reset by clear()
+    hits = verified_tokens.stats()['hits']
+    with mock.patch.object(utility_jwt, 'get_user',
+                           wraps=utility_jwt.get_user) as mock_get_user, \
+         mock.patch.object(utility_jwt.jwt, 'decode',
+                           wraps=utility_jwt.jwt.decode) as mock_decode:
+        for _ in range(3):
+            user = get_current_active_user_chalice(token)
+            assert user.username == 'mock_user'
+    mock_get_user.assert_called_once()
+    mock_decode.assert_called_once()
+    assert verified_tokens.stats()['hits'] - hits == 2
+
+
+def test_entry_expires_with_the_token():
+    cache = TokenCache(max_size=10, max_age=300)
+    cache.set('token', 'user', 'mock_user', exp=0)
+    assert cache.get('token') is None
+    cache.set('token', 'user', 'mock_user', exp=None)
+    assert cache.get('token') == 'user'
+    with mock.patch('chalicelib.utility_token_cache.time.time',
+                    return_value=cache._entries[
+                        next(iter(cache._entries))]['expires_at']):
+        assert cache.get('token') is None
+
+
+def test_lru_eviction():
+    cache = TokenCache(max_size=2, max_age=300)
+    cache.set('token_1', 'user_1', 'user_1')
+    cache.set('token_2', 'user_2', 'user_2')
+    assert cache.get('token_1') == 'user_1'
+    cache.set('token_3', 'user_3', 'user_3')
+    assert cache.get('token_2') is None
+    assert cache.get('token_1') == 'user_1'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_disabled_user_tokens_are_invalidated():
+    token = get_token()
+    assert get_current_active_user_chalice(token).username == 'mock_user'
+    mock_db = mock.MagicMock()
+    with mock.patch.object(model_users, 'db', new=mock_db):
+        mock_db.users.update_one.return_value.matched_count = 1
+        resultset = model_users.update_user_disabled('mock_user')
+    assert resultset['found']
+    assert verified_tokens.stats()['size'] == 0
+    with mock.patch.object(
+        model_users, 'fetch_user_by_entryname',
+        return_value={'error': False, 'found': True, 'resultset': {
+            'username': 'mock_user', 'disabled': True}}
+    ):
+        response = get_current_active_user_chalice(token)
+    assert isinstance(response, HTTPException)
+    assert response.status_code == 400
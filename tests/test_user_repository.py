@@ -0,0 +1,207 @@
+"""
+Users read-through cache test
+"""
+
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from chalicelib import model_users, utility_jwt
+from chalicelib.model_users import UserRepository, users_repository
+from chalicelib.utility_token_cache import verified_tokens
+
+
+USER_DOCUMENT = {
+    '_id': 'mock_user_id',
+    'username': 'mock_user',
+    'email': 'mock_email',
+    'full_name': 'mock_full_name',
+    'hashed_password': 'mock_hashed_password',
+    'disabled': False,
+}
+
+
+def get_resultset(document, error=False):
+    return {
+        'error': error,
+        'error_message': None,
+        'found': document is not None,
+        'resultset': document,
+    }
+
+
+@pytest.fixture
+def mock_fetch():
+    with mock.patch.object(
+        model_users, 'fetch_user_by_entryname',
+        return_value=get_resultset(dict(USER_DOCUMENT))
+    ) as mock_fetch:
+        yield mock_fetch
+
+
+def test_one_fetch_per_login(mock_fetch):
+    with mock.patch.object(utility_jwt, 'verify_password',
+                           return_value=True), \
+         mock.patch.object(utility_jwt, 'needs_rehash', return_value=False):
+        user = utility_jwt.authenticate_user('mock_user', 'password')
+    assert user.hashed_password == 'mock_hashed_password'
+    assert utility_jwt.get_user('mock_user').username == 'mock_user'
+    mock_fetch.assert_called_once_with('username', 'mock_user', None)
+
+
+def test_projection_is_applied_to_the_cached_document(mock_fetch):
+    resultset = users_repository.get_user_by_entryname(
+        'username', 'mock_user', {'_id': 0})
+    assert '_id' not in resultset['resultset']
+    resultset = users_repository.get_user_by_entryname(
+        'username', 'mock_user', {'username': 1, '_id': 0})
+    assert resultset['resultset'] == {'username': 'mock_user'}
+    resultset['resultset']['username'] = 'changed'
+    resultset = users_repository.get_user_by_entryname(
+        'username', 'mock_user')
+    assert resultset['resultset'] == USER_DOCUMENT
+    mock_fetch.assert_called_once()
+
+
+def test_unknown_users_are_negatively_cached(mock_fetch):
+    mock_fetch.return_value = get_resultset(None)
+    for _ in range(2):
+        resultset = users_repository.get_user_by_entryname(
+            'username', 'unknown_user')
+        assert not resultset['found']
+    mock_fetch.assert_called_once()
+    assert users_repository.stats()['negative_hits'] == 1
+
+
+def test_errors_are_not_cached(mock_fetch):
+    mock_fetch.return_value = get_resultset(None, error=True)
+    for _ in range(2):
+        assert users_repository.get_user_by_entryname(
+            'username', 'mock_user')['error']
+    assert mock_fetch.call_count == 2
+
+
+def test_change_stream_events_invalidate(mock_fetch):
+    users_repository.get_user_by_entryname('username', 'mock_user')
+    mock_fetch.return_value = get_resultset(None)
+    users_repository.get_user_by_entryname('username', 'new_user')
+    users_repository.on_change({
+        'operationType': 'update',
+        'documentKey': {'_id': 'mock_user_id'},
+    })
+    users_repository.on_change({
+        'operationType': 'insert',
+        'documentKey': {'_id': 'new_user_id'},
+        'fullDocument': {'_id': 'new_user_id', 'username': 'new_user'},
+    })
+    assert users_repository.stats()['size'] == 0
+
+
+def test_polling_invalidates_changed_users(mock_fetch):
+    users_repository.get_user_by_entryname('username', 'mock_user')
+    mock_db = mock.MagicMock()
+    mock_db.users.find.return_value = [dict(USER_DOCUMENT)]
+    with mock.patch.object(model_users, 'db', new=mock_db):
+        assert users_repository.poll_once() == 0
+        mock_db.users.find.return_value = [
+            dict(USER_DOCUMENT, disabled=True)]
+        assert users_repository.poll_once() == 1
+    mock_db.users.find.assert_called_with(
+        {'username': {'$in': ['mock_user']}})
+
+
+def test_changes_drop_the_cached_tokens(mock_fetch):
+    users_repository.get_user_by_entryname('username', 'mock_user')
+    verified_tokens.set('mock_token', 'mock_user_object', 'mock_user')
+    verified_tokens.set('other_token', 'other_user_object', 'other_user')
+    users_repository.on_change({
+        'operationType': 'update',
+        'documentKey': {'_id': 'mock_user_id'},
+    })
+    assert verified_tokens.get('mock_token') is None
+    # Not cached in the repository, but in the token cache
+    users_repository.on_change({
+        'operationType': 'update',
+        'documentKey': {'_id': 'other_user_id'},
+        'fullDocument': {'_id': 'other_user_id', 'username': 'other_user',
+                         'disabled': True},
+    })
+    assert verified_tokens.stats()['size'] == 0
+
+
+def test_unknown_user_deletion_drops_all_tokens():
+    verified_tokens.set('mock_token', 'mock_user_object', 'mock_user')
+    users_repository.on_change({
+        'operationType': 'delete',
+        'documentKey': {'_id': 'unknown_user_id'},
+    })
+    assert verified_tokens.stats()['size'] == 0
+
+
+def test_polling_drops_the_cached_tokens(mock_fetch):
+    users_repository.get_user_by_entryname('username', 'mock_user')
+    verified_tokens.set('mock_token', 'mock_user_object', 'mock_user')
+    verified_tokens.set('other_token', 'other_user_object', 'other_user')
+    verified_tokens.set('gone_token', 'gone_user_object', 'gone_user')
+    mock_db = mock.MagicMock()
+    mock_db.users.find.side_effect = [
+        [dict(USER_DOCUMENT, disabled=True)],
+        [{'username': 'other_user', 'disabled': False}],
+    ]
+    with mock.patch.object(model_users, 'db', new=mock_db):
+        assert users_repository.poll_once() == 1
+    assert verified_tokens.get('mock_token') is None
+    assert verified_tokens.get('other_token') == 'other_user_object'
+    assert verified_tokens.get('gone_token') is None
+
+
+def test_change_stream_listener_stops_without_events():
+    repository = UserRepository()
+    mock_db = mock.MagicMock()
+    stream = mock_db.users.watch.return_value.__enter__.return_value
+    stream.try_next.side_effect = lambda: time.sleep(0.01)
+    with mock.patch.object(model_users, 'db', new=mock_db):
+        watcher = threading.Thread(target=repository.watch_changes)
+        watcher.start()
+        time.sleep(0.05)
+        repository._watcher_stop.set()
+        watcher.join(timeout=1)
+    assert not watcher.is_alive()
+    assert mock_db.users.watch.call_args.kwargs['max_await_time_ms'] > 0
+
+
+def test_change_stream_is_retried_after_an_error():
+    repository = UserRepository()
+    mock_db = mock.MagicMock()
+    stream = mock.MagicMock()
+    stream.__enter__.return_value.try_next.side_effect = \
+        lambda: repository._watcher_stop.set()
+    mock_db.users.watch.side_effect = [Exception('Transient error'), stream]
+    with mock.patch.object(model_users, 'db', new=mock_db), \
+         mock.patch.object(repository._watcher_stop, 'wait',
+                           return_value=False) as mock_wait, \
+         mock.patch.object(repository, 'poll_changes') as mock_poll:
+        repository.run_invalidation()
+    mock_wait.assert_called_once_with(1)
+    mock_poll.assert_not_called()
+    assert repository.stats()['invalidation'] == 'change_stream'
+
+
+def test_polling_fallback_without_change_streams():
+    repository = UserRepository()
+    mock_db = mock.MagicMock()
+    mock_db.users.watch.side_effect = Exception(
+        'The $changeStream stage is only supported on replica sets')
+    with mock.patch.object(model_users, 'db', new=mock_db), \
+         mock.patch.object(model_users.settings,
+                           'USER_CACHE_WATCH_RETRIES', '2'), \
+         mock.patch.object(repository._watcher_stop, 'wait',
+                           return_value=False) as mock_wait, \
+         mock.patch.object(repository, 'poll_changes') as mock_poll:
+        repository.run_invalidation()
+    assert mock_db.users.watch.call_count == 3
+    assert [call.args[0] for call in mock_wait.call_args_list] == [1, 2]
+    mock_poll.assert_called_once()
+    assert repository.stats()['invalidation'] == 'poll'